@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Times the manage.py pipeline against synthetic labs of increasing size.
+Usage is
+
+    python benchmarks/pipeline.py [--sizes 10,50,200,1000] [--latency 0]
+        [--output results.json] [--baseline old_results.json] [--tolerance 0.25]
+
+Each size runs in a fresh interpreter against the mock GNS3 server and fake FRR nodes
+in `tests` (see `tests/mock_gns3.py`), so nothing real is needed. For each step it
+reports the wall time, HTTP requests, telnet commands and connections, and each size's
+peak memory. Exits with 1 if anything got worse than the baseline by more than the
+tolerance.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+root_path = Path(__file__).resolve().parent.parent
+tests_path = root_path / "tests"
+
+# (name, manage.py arguments) in the order they're run. The label steps call gns3
+# directly as they don't have commands of their own
+steps = [
+    ("set-up", ["set-up"]),
+    ("generate-configs", ["generate-configs"]),
+    ("apply-configs", ["apply-configs"]),
+    # nothing's changed, so this should be cheap
+    ("apply-configs unchanged", ["apply-configs"]),
+    ("show-labels", None),
+    ("reset-labels", None),
+    ("reset", ["reset"]),
+]
+
+# what's measured for each step
+step_metrics = ["seconds", "http_requests", "telnet_commands", "telnet_connections"]
+# timings under this many seconds are noise, never regressions
+min_seconds = 0.05
+
+
+def run_size(router_count: int, latency: float) -> dict:
+    """
+    Runs every step against a lab of router_count routers in this process. Returns the
+    results for it.
+    """
+    sys.path.insert(0, str(root_path))
+    sys.path.insert(0, str(tests_path))
+    import mock_gns3
+    import synthetic_topology
+
+    lab = mock_gns3.MockLab(
+        synthetic_topology.generate_topology(router_count), latency=latency
+    )
+    lab.start()
+    output_path = Path(tempfile.mkdtemp(prefix="gns3-bgp-frr-benchmark-"))
+    # big enough for the links of 1000 routers
+    mock_gns3.install_settings(lab, output_path, P2P_SUPERNET="10.0.0.0/16")
+
+    import manage
+    from gns3_bgp_frr import gns3
+
+    results: Dict[str, Dict[str, float]] = {}
+    try:
+        for name, arguments in steps:
+            http_requests = sum(lab.request_counts.values())
+            telnet_commands = lab.telnet_commands()
+            telnet_connections = lab.telnet_connections()
+            start = time.perf_counter()
+            if arguments is not None:
+                manage.cli(arguments, standalone_mode=False)
+            elif name == "show-labels":
+                gns3.show_interface_ips()
+            else:
+                gns3.reset_interface_ip_labels()
+            results[name] = {
+                "seconds": round(time.perf_counter() - start, 3),
+                "http_requests": sum(lab.request_counts.values()) - http_requests,
+                "telnet_commands": lab.telnet_commands() - telnet_commands,
+                "telnet_connections": lab.telnet_connections() - telnet_connections,
+            }
+    finally:
+        lab.close()
+
+    return {
+        "routers": len(lab.routers),
+        "peak_memory_mb": peak_memory_mb(),
+        "steps": results,
+    }
+
+
+def peak_memory_mb() -> Optional[float]:
+    """
+    The most memory this process has used, or None where that isn't available.
+    """
+    try:
+        import resource
+    except ImportError:
+        # windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB everywhere else
+    if sys.platform == "darwin":
+        peak //= 1024
+    return round(peak / 1024, 1)
+
+
+def benchmark(sizes: List[int], latency: float) -> dict:
+    """
+    Runs each size in a fresh interpreter so peak memory is its own. Returns all the
+    results, as saved with --output.
+    """
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency": latency,
+        "sizes": {},
+    }
+    for size in sizes:
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--run-size",
+                str(size),
+                "--latency",
+                str(latency),
+            ],
+            cwd=root_path,
+            capture_output=True,
+            text=True,
+        )
+        if output.returncode != 0:
+            print(output.stderr, file=sys.stderr)
+            raise SystemExit(f"{size} routers failed")
+        # the last line, after the pipeline's own logging
+        results["sizes"][str(size)] = json.loads(output.stdout.splitlines()[-1])
+        print_size(size, results["sizes"][str(size)])
+    return results
+
+
+def print_size(size: int, result: dict):
+    print(
+        f"{size} routers ({result['routers']} nodes with telnet), "
+        f"peak memory {result['peak_memory_mb']} MB"
+    )
+    for name, metrics in result["steps"].items():
+        print(
+            f"    {name:26} {metrics['seconds']:8.2f} s  "
+            f"{metrics['http_requests']:6} http  "
+            f"{metrics['telnet_commands']:7} telnet commands  "
+            f"{metrics['telnet_connections']:5} connections"
+        )
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Returns a description of each metric that's more than tolerance (a fraction) worse
+    than the baseline. Sizes and steps that aren't in both are skipped.
+    """
+    regressions = []
+    for size, result in results["sizes"].items():
+        if size not in baseline["sizes"]:
+            continue
+        old_result = baseline["sizes"][size]
+
+        compared = [
+            (f"{size} routers peak_memory_mb", old, new)
+            for old, new in [(old_result["peak_memory_mb"], result["peak_memory_mb"])]
+            if old is not None and new is not None
+        ]
+        for name, metrics in result["steps"].items():
+            old_metrics = old_result["steps"].get(name)
+            if old_metrics is None:
+                continue
+            for metric in step_metrics:
+                compared.append(
+                    (
+                        f"{size} routers {name} {metric}",
+                        old_metrics[metric],
+                        metrics[metric],
+                    )
+                )
+
+        for description, old, new in compared:
+            if description.endswith("seconds") and new < min_seconds:
+                continue
+            if new > old * (1 + tolerance):
+                regressions.append(f"{description}: {old} -> {new}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--sizes",
+        default="10,50,200,1000",
+        help="Comma separated router counts.",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds the mock adds to every HTTP and telnet response.",
+    )
+    parser.add_argument("--output", type=Path, help="Save the results here as JSON.")
+    parser.add_argument(
+        "--baseline", type=Path, help="Results from --output to compare against."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="How much worse than the baseline, as a fraction, counts as a regression.",
+    )
+    # used by benchmark() to run each size in its own interpreter
+    parser.add_argument("--run-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_size is not None:
+        result = run_size(args.run_size, args.latency)
+        print(json.dumps(result))
+        return
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = benchmark(sizes, args.latency)
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=4))
+
+    if args.baseline is not None:
+        regressions = compare(
+            results, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
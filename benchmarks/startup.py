@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Times how long `manage.py` takes to start for commands that shouldn't need the GNS3
+server, e.g. `--help`. Each is run in a fresh interpreter, like a user would.
+Usage is
+
+    python benchmarks/startup.py [--runs 20] [--budget-ms 100]
+
+Exits with 1 if any command's median takes more than the budget longer than just
+importing rich_click. That import is most of the time (over 100 ms alone on a slow
+machine), and help can't be shown without it, so the budget is for what we add on top.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+root_path = Path(__file__).resolve().parent.parent
+
+# manage.py arguments to time
+commands = [
+    ["--help"],
+    ["apply-configs", "--help"],
+    ["generate-configs", "--help"],
+]
+
+# modules that should only be imported once a command actually runs
+heavy_modules = ["gns3fy", "jinja2", "netaddr", "pytest", "gns3_bgp_frr.gns3"]
+
+
+def time_command(arguments, runs: int) -> list:
+    """
+    Returns the wall time in ms of each run of `python <arguments>`.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *arguments],
+            cwd=root_path,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def heavy_modules_imported() -> list:
+    """
+    Which of `heavy_modules` importing manage.py pulls in.
+    """
+    script = (
+        "import sys, manage; "
+        f"print(' '.join(m for m in {heavy_modules!r} if m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=root_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return output.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=100)
+    args = parser.parse_args()
+
+    # python's own startup, for reference
+    python = statistics.median(time_command(["-c", "pass"], args.runs))
+    print(f"{'python -c pass':40} median {python:7.1f} ms")
+    baseline = statistics.median(time_command(["-c", "import rich_click"], args.runs))
+    print(f"{'python -c import rich_click':40} median {baseline:7.1f} ms")
+
+    over_budget = False
+    for arguments in commands:
+        timings = time_command(["manage.py", *arguments], args.runs)
+        median = statistics.median(timings)
+        over_budget = over_budget or median - baseline > args.budget_ms
+        print(
+            f"{'manage.py ' + ' '.join(arguments):40} median {median:7.1f} ms  "
+            f"min {min(timings):7.1f} ms  ({median - baseline:+.1f} ms)"
+        )
+
+    imported = heavy_modules_imported()
+    print(f"heavy modules imported at startup: {', '.join(imported) or 'none'}")
+
+    if over_budget:
+        print(f"over the {args.budget_ms:g} ms budget on top of importing rich_click")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,63 +1,130 @@
-from typing import Generator
-from typing import Dict
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 from netaddr import IPNetwork
+import settings
 from settings import *
-from gns3_bgp_frr import gns3, logging
-import gns3fy
+from gns3_bgp_frr import logging, roles, topology, tracing
+from gns3_bgp_frr.allocator import SubnetPool, get_p2p_ips, half
+
+# optional settings, with the defaults for settings.py files from before they existed.
+# See settings.example.py
+P2P_PREFIXLEN: int = getattr(settings, "P2P_PREFIXLEN", 30)
+P2P_SUPERNET_V6: Optional[str] = getattr(settings, "P2P_SUPERNET_V6", None)
+ASN_SUPERNETS: Dict[int, str] = getattr(settings, "ASN_SUPERNETS", {})
+# the addresses routers' external ports get, by router name. See
+# `roles.RouterRole.external_ports`
+EXTERNAL_IPS: Dict[str, str] = getattr(settings, "EXTERNAL_IPS", None) or {
+    "asn1border1": ASN1BORDER1_EXTERNAL_IP,
+    "asn1border2": ASN1BORDER2_EXTERNAL_IP,
+}
+
+# node name: port name: IP in CIDR notation
+InterfaceIps = Dict[str, Dict[str, str]]
+
+# where the last addressing plan is saved. See `get_interface_ips()`
+addressing_path = (
+    Path(__file__).resolve().parent / ".." / "generated" / "addressing.json"
+)
+
+# the subnet each link was given, kept between runs so links keep their subnets when
+# others are added or removed. See `assign_interface_ips()`
+allocations_path = (
+    Path(__file__).resolve().parent / ".." / "generated" / "allocations.json"
+)
+
+# get_link_key(): IP version (as a string, for JSON): the link's subnet
+Allocations = Dict[str, Dict[str, str]]
+
+# (get_addressing_key(), IP version: interface IPs) for this run
+_interface_ips: Optional[Tuple[str, Dict[int, InterfaceIps]]] = None
 
 
 def get_asn1_supernet() -> IPNetwork:
     """
-    Returns the first /25 of the /24 P2P_SUPERNET for easier summarisation.
+    Returns the supernet asn1 internal links are addressed from, for easier
+    summarisation. The first half of P2P_SUPERNET unless ASN_SUPERNETS has one for it.
     """
-    supernet = IPNetwork(P2P_SUPERNET)
-    supernet_halves = supernet.subnet(25)
-    first_half = next(supernet_halves)
-    return first_half
+    if 1 in ASN_SUPERNETS:
+        return IPNetwork(ASN_SUPERNETS[1]).cidr
+    return half(P2P_SUPERNET, 0)
 
 
-def get_asn1_p2p_subnets(log=False) -> Generator[IPNetwork, None, None]:
+def get_asn_supernet(asn: Optional[int]) -> Optional[IPNetwork]:
     """
-    Get the /30s available for asn1-internal links.
-    Uses the first /25 of the /24 P2P_SUPERNET for easier summarisation.
-    Returns an interable of IPNetwork()s.
-    Wrap with list() if you need to get all at once.
+    Returns the supernet an AS's internal links are addressed from, if it has one of its
+    own, so its border routers can advertise it as a summary.
     """
+    if asn == 1:
+        return get_asn1_supernet()
+    if asn in ASN_SUPERNETS:
+        return IPNetwork(ASN_SUPERNETS[asn]).cidr
+    return None
 
-    first_half = get_asn1_supernet()
-
-    if log:
-        logging.log(f"carving up {first_half} into /30s for asn1 links", "info")
-
-    # carve up the supernet into /30 subnets
-    return first_half.subnet(prefixlen=30)
 
-
-def get_non_asn1_p2p_subnets(log=False) -> Generator[IPNetwork, None, None]:
+def get_pools(version=4, log=False) -> Dict[Optional[int], SubnetPool]:
     """
-    Get the /30s available for non-asn1-internal links.
-    Uses the second /25 of the /24 P2P_SUPERNET.
-    Returns an interable of IPNetwork()s.
-    Wrap with list() if you need to get all at once.
+    Returns the pools links are addressed from, keyed by AS number for links inside that
+    AS, or None for every other link.
+
+    asn1 gets the first half of the supernet (see `get_asn1_supernet()`) and everything
+    else shares the second. For IPv4, ASN_SUPERNETS can give other ASes their own.
     """
+    if version == 4:
+        supernet, prefixlen = P2P_SUPERNET, P2P_PREFIXLEN
+        asn1_supernet = get_asn1_supernet()
+        asn_supernets = {
+            asn: IPNetwork(cidr).cidr for asn, cidr in ASN_SUPERNETS.items()
+        }
+    else:
+        # RFC 6164
+        supernet, prefixlen = P2P_SUPERNET_V6, 127
+        asn1_supernet = half(supernet, 0)
+        asn_supernets = {}
+
+    pools: Dict[Optional[int], SubnetPool] = {
+        1: SubnetPool(asn1_supernet, prefixlen, name=f"{asn1_supernet} (asn1)"),
+        None: SubnetPool(half(supernet, 1), prefixlen),
+    }
+    for asn, asn_supernet in asn_supernets.items():
+        pools[asn] = SubnetPool(
+            asn_supernet, prefixlen, name=f"{asn_supernet} (asn{asn})"
+        )
 
-    # use the second half of the /24
-    supernet = IPNetwork(P2P_SUPERNET)
-    supernet_halves = supernet.subnet(25)
-    next(supernet_halves)
-    second_half = next(supernet_halves)
+    # catch typos in ASN_SUPERNETS before they turn into duplicate addresses
+    pool_list = list(pools.values())
+    for index, pool in enumerate(pool_list):
+        for other in pool_list[index + 1 :]:
+            if (
+                pool.supernet.first <= other.supernet.last
+                and other.supernet.first <= pool.supernet.last
+            ):
+                raise ValueError(f"address pools {pool.name} and {other.name} overlap")
 
     if log:
-        logging.log(f"carving up {second_half} into /30s for non-asn1 links", "info")
+        for pool in pool_list:
+            logging.log(
+                f"carving up {pool.name} into /{prefixlen}s ({pool.size} links)", "info"
+            )
 
-    # carve up the supernet into /30 subnets
-    return second_half.subnet(prefixlen=30)
+    return pools
 
 
-def get_interface_ips(log=False) -> Dict[str, Dict[str, str]]:
+@tracing.traced()
+def get_interface_ips(log=False, refresh=False, version=4) -> InterfaceIps:
     """
     Returns a dict of dicts that contains the IP address for each FRR router's connected
-    interfaces.
+    interfaces. Set version to 6 for their IPv6 addresses, if P2P_SUPERNET_V6 is set.
+
+    Worked out at most once per run, and saved to `addressing_path` so later runs (e.g.
+    `apply-configs` after `generate-configs`) reuse it. Either is only used while the
+    topology revision and addressing settings match. Set refresh to true to always work
+    it out again. Don't modify the result, it's shared.
+
+    Working it out again only gives new links new addresses. See
+    `assign_interface_ips()`.
 
     Returns:
         Dict[
@@ -72,74 +139,273 @@ def get_interface_ips(log=False) -> Dict[str, Dict[str, str]]:
             Inner dicts mapping node port names (e.g. "eth0") to interface IP/Masks in
             CIDR notation (e.g. "10.0.0.1/24")
     """
+    global _interface_ips
+
+    # works from the saved topology so the server isn't needed. See `topology`
+    project_topology = topology.get_topology(log=log)
+    key = get_addressing_key(project_topology)
+
+    if not refresh:
+        if _interface_ips is not None and _interface_ips[0] == key:
+            return _interface_ips[1][version]
+        saved = load_interface_ips(key)
+        if saved is not None:
+            if log:
+                logging.log("using the interface IPs from the last run", "info")
+            _interface_ips = (key, saved)
+            return saved[version]
+
+    interface_ips, allocations = assign_interface_ips(
+        project_topology, load_allocations(), log=log
+    )
+    _interface_ips = (key, interface_ips)
+    save_allocations(allocations)
+    save_interface_ips(key, interface_ips)
+    return interface_ips[version]
+
+
+def assign_interface_ips(
+    project_topology: topology.Topology,
+    allocations: Optional[Allocations] = None,
+    log=False,
+) -> Tuple[Dict[int, InterfaceIps], Allocations]:
+    """
+    Does the work for `get_interface_ips()`. Returns the interface IPs for each IP
+    version, and the subnet each link ended up with.
+
+    Links in `allocations` (from the last run) keep their subnets if they're still
+    free and in the right pool, so adding or removing a link doesn't renumber the
+    others. Only new links get new subnets, starting with ones that removed links
+    freed up.
+    """
     if log:
         logging.log("generating interface IPs", "info")
 
-    # there's weirdness if the nodes aren't started
-    gns3.start_all(log=log)
-
-    output_dict: Dict[str, Dict[str, str]] = {}
+    output_dict: InterfaceIps = {}
+    output_dict_v6: InterfaceIps = {}
+    previous = allocations or {}
+    new_allocations: Allocations = {}
 
-    asn1_subnets = list(get_asn1_p2p_subnets(log=log))
-    non_asn1_subnets = list(get_non_asn1_p2p_subnets(log=log))
+    pools = get_pools(log=log)
+    pools_v6 = get_pools(version=6, log=log) if P2P_SUPERNET_V6 else None
+    router_roles = roles.get_roles(project_topology)
 
     if log:
-        logging.log(f"assigning subnets to {len(gns3.project.links)} links", "info")
+        logging.log(f"assigning subnets to {len(project_topology.links)} links", "info")
 
-    for index, link in enumerate(gns3.project.links):
+    # (get_link_key(), AS number, the router ends of the link as (node name, port
+    # name)) for each link (or loopback) that needs a subnet
+    links_to_address: List[Tuple[str, Optional[int], List[Tuple[str, str]]]] = []
+
+    for link in project_topology.links:
         if link.nodes is None:
             continue
 
-        # assign a /30 per link.
-        # group the asn1 internal links for route summarisation
-        subnets = asn1_subnets if gns3.is_asn1_internal_link(link) else non_asn1_subnets
-        if index >= len(subnets):
-            raise IndexError("too many links, not enough /30s in the given supernet")
-        link_subnet = subnets[index]
-
-        # get a generator we can pull successive IPs from
-        subnet_ips = link_subnet.iter_hosts()
-
-        # assign each router in this link an IP in the subnet
+        ends: List[Tuple[str, str]] = []
         for node_entry in link.nodes:
-            node = gns3.project.get_node(node_id=node_entry["node_id"])
-            if (
-                node is None
-                or node.name is None
-                or node.ports is None
-                or not gns3.is_router(node)
-            ):
+            node_id = node_entry["node_id"]
+            if not project_topology.is_router(node_id):
                 continue
+            node = project_topology.nodes_by_id[node_id]
             # ensure their output entry exists
             if node.name not in output_dict.keys():
                 output_dict[node.name] = {}
             # the link stores the port number of the host. Convert it to the name of
             # the port
-            port_number = node_entry["adapter_number"]
-            port_name = node.ports[port_number]["name"]
+            port_name = project_topology.port_name(
+                node_id, node_entry["adapter_number"]
+            )
+            if port_name is None:
+                continue
 
             # handle external addressing as a special case
-            if node.name in ["asn1border1", "asn1border2"] and port_name == "eth7":
-                if node.name == "asn1border1":
+            if port_name in router_roles[node.name].external_ports:
+                if node.name not in EXTERNAL_IPS:
                     if log:
                         logging.log(
-                            "giving [cyan]asn1border1 eth7[/] an external address",
-                            "info",
+                            f"no external address for [cyan]{node.name} "
+                            f"{port_name}[/] in settings, leaving it unaddressed",
+                            "error",
                         )
-                    ip_cidr = ASN1BORDER1_EXTERNAL_IP
-                else:
-                    if log:
-                        logging.log(
-                            "giving [cyan]asn1border2 eth7[/] an external address",
-                            "info",
-                        )
-                    ip_cidr = ASN1BORDER2_EXTERNAL_IP
-            else:
-                # otherwise assign the next available IP in the subnet
-                ip = next(subnet_ips)
-                ip_cidr = f"{ip}/{link_subnet.prefixlen}"
+                    continue
+                if log:
+                    logging.log(
+                        f"giving [cyan]{node.name} {port_name}[/] an external address",
+                        "info",
+                    )
+                output_dict[node.name][port_name] = EXTERNAL_IPS[node.name]
+                continue
+
+            ends.append((node.name, port_name))
+
+        # nothing to address. Don't use up a subnet
+        if not ends:
+            continue
+
+        # the ends get the IPs in the subnet in this order. Sorted rather than in link
+        # order so re-creating a link the other way round doesn't swap them
+        links_to_address.append(
+            (
+                get_link_key(link, project_topology),
+                get_link_asn(link, project_topology),
+                sorted(ends),
+            )
+        )
+
+    # loopbacks, for iBGP in route reflector mode. Given a subnet from their AS's pool
+    # like a link, so they're kept between runs and covered by its summary
+    for node_name, role in router_roles.items():
+        if role.loopback:
+            output_dict.setdefault(node_name, {})
+            links_to_address.append(
+                (
+                    f"{node_name} {roles.loopback_port}",
+                    role.asn,
+                    [(node_name, roles.loopback_port)],
+                )
+            )
+
+    for version, version_pools, version_output in (
+        (4, pools, output_dict),
+        (6, pools_v6, output_dict_v6),
+    ):
+        if version_pools is None:
+            continue
+
+        # a subnet per link from its AS's pool, if it's inside one that has its own.
+        # e.g. asn1 internal links are grouped for route summarisation
+        subnets: Dict[str, IPNetwork] = {}
+        # keep the subnets links already had first, so new links can't take them
+        for link_key, asn, ends in links_to_address:
+            pool = version_pools[asn if asn in version_pools else None]
+            subnet = previous.get(link_key, {}).get(str(version))
+            if subnet is not None and keep_subnet(pool, subnet):
+                subnets[link_key] = IPNetwork(subnet)
+        kept = len(subnets)
+        for link_key, asn, ends in links_to_address:
+            if link_key not in subnets:
+                pool = version_pools[asn if asn in version_pools else None]
+                subnets[link_key] = pool.allocate()
+
+        if log:
+            logging.log(
+                f"kept {kept} IPv{version} link subnets from the last run, assigned "
+                f"{len(subnets) - kept} new",
+                "info",
+            )
+
+        # and each router in each link the next IP in its subnet
+        for link_key, asn, ends in links_to_address:
+            subnet = subnets[link_key]
+            new_allocations.setdefault(link_key, {})[str(version)] = str(subnet)
+            for (node_name, port_name), ip_cidr in zip(ends, get_p2p_ips(subnet)):
+                if port_name == roles.loopback_port:
+                    # just the one address
+                    ip = ip_cidr.split("/")[0]
+                    ip_cidr = f"{ip}/32" if version == 4 else f"{ip}/128"
+                version_output.setdefault(node_name, {})[port_name] = ip_cidr
+
+    return {4: output_dict, 6: output_dict_v6}, new_allocations
+
+
+def keep_subnet(pool: SubnetPool, subnet: str) -> bool:
+    """
+    Try to give a link the subnet it had last time. False if it's already taken or
+    isn't in the pool any more, e.g. the addressing settings changed.
+    """
+    try:
+        return pool.reserve(subnet)
+    except ValueError:
+        return False
+
+
+def get_link_key(link: topology.Link, project_topology: topology.Topology) -> str:
+    """
+    Identifies a link by the ports it connects rather than its ID or position, so a
+    link that's deleted and re-created between the same ports keeps its subnet. e.g.
+    "asn1border1 eth0 -- asn1border2 eth1".
+    """
+    ends = []
+    for end in link.nodes:
+        node = project_topology.get_node(node_id=end["node_id"])
+        port_name = project_topology.port_name(end["node_id"], end["adapter_number"])
+        if node is None or port_name is None:
+            return link.link_id
+        ends.append(f"{node.name} {port_name}")
+    return " -- ".join(sorted(ends))
+
+
+def get_link_asn(
+    link: topology.Link, project_topology: topology.Topology
+) -> Optional[int]:
+    """
+    Returns the AS number both ends of the link are in, or None if it's between ASes or
+    either end doesn't have one.
+    """
+    if len(link.nodes) != 2:
+        return None
+    first, second = (project_topology.asns.get(end["node_id"]) for end in link.nodes)
+    return first if first is not None and first == second else None
+
+
+def get_addressing_key(project_topology: topology.Topology) -> str:
+    """
+    Changes whenever something that affects the addressing plan does.
+    """
+    data = [
+        project_topology.revision,
+        P2P_SUPERNET,
+        P2P_PREFIXLEN,
+        P2P_SUPERNET_V6,
+        sorted(ASN_SUPERNETS.items()),
+        # route reflector mode adds loopbacks
+        roles.IBGP_MODE,
+        sorted(EXTERNAL_IPS.items()),
+    ]
+    return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+
+def load_interface_ips(key: str) -> Optional[Dict[int, InterfaceIps]]:
+    """
+    Returns the saved addressing plan if it was made with the same `key`.
+    """
+    if not addressing_path.exists():
+        return None
+    try:
+        data = json.loads(addressing_path.read_text())
+    except ValueError:
+        return None
+    if data.get("key") != key:
+        return None
+    return {4: data.get("interface_ips", {}), 6: data.get("interface_ipv6s", {})}
+
+
+def save_interface_ips(key: str, interface_ips: Dict[int, InterfaceIps]):
+    addressing_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = addressing_path.with_name(addressing_path.name + ".tmp")
+    data = {
+        "key": key,
+        "interface_ips": interface_ips[4],
+        "interface_ipv6s": interface_ips[6],
+    }
+    temp_path.write_text(json.dumps(data, indent=4))
+    os.replace(temp_path, addressing_path)
+
+
+def load_allocations() -> Allocations:
+    """
+    Returns the subnet each link had last run, or nothing if there wasn't one.
+    """
+    if not allocations_path.exists():
+        return {}
+    try:
+        return json.loads(allocations_path.read_text())
+    except ValueError:
+        return {}
 
-            # record it
-            output_dict[node.name][port_name] = ip_cidr
 
-    return output_dict
+def save_allocations(allocations: Allocations):
+    allocations_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = allocations_path.with_name(allocations_path.name + ".tmp")
+    temp_path.write_text(json.dumps(allocations, indent=4, sort_keys=True))
+    os.replace(temp_path, allocations_path)
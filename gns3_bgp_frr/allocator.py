@@ -0,0 +1,134 @@
+from typing import List, Union
+from netaddr import IPAddress, IPNetwork
+
+
+class SubnetPool:
+    """
+    Hands out equal-sized subnets (e.g. /30s) of a supernet, lowest free one first.
+
+    Which subnets are taken is kept in a bitmap, one bit per subnet, that only grows as
+    far as the highest one handed out. So a big supernet (e.g. an IPv6 /64 of /127s)
+    costs nothing up front, and allocating is a couple of integer operations rather
+    than carving the supernet up with netaddr.
+    """
+
+    def __init__(self, supernet: Union[str, IPNetwork], prefixlen: int, name=""):
+        supernet = IPNetwork(supernet).cidr
+        width = 32 if supernet.version == 4 else 128
+        if not supernet.prefixlen <= prefixlen <= width:
+            raise ValueError(f"can't carve {supernet} into /{prefixlen}s")
+
+        self.supernet = supernet
+        self.prefixlen = prefixlen
+        # shown in errors
+        self.name = name or str(supernet)
+        # how many subnets fit, and how many addresses each one has
+        self.size = 1 << (prefixlen - supernet.prefixlen)
+        self.block = 1 << (width - prefixlen)
+        self.used = 0
+
+        self._first = supernet.first
+        self._bits = bytearray()
+        # every subnet below this is taken
+        self._next = 0
+
+    def __len__(self) -> int:
+        return self.used
+
+    def allocate(self) -> IPNetwork:
+        """
+        Take the lowest free subnet. Raises `IndexError` if there aren't any left.
+        """
+        index = self._next
+        while self._is_set(index):
+            index += 1
+        if index >= self.size:
+            raise IndexError(
+                f"not enough /{self.prefixlen}s left in {self.name} ({self.size} total)"
+            )
+        self._set(index)
+        self._next = index + 1
+        return self._subnet(index)
+
+    def reserve(self, subnet: Union[str, IPNetwork]) -> bool:
+        """
+        Take a specific subnet, e.g. one it had last time. Returns false if it's already
+        taken. Raises `ValueError` if it isn't one of ours.
+        """
+        index = self._index(IPNetwork(subnet))
+        if self._is_set(index):
+            return False
+        self._set(index)
+        if index == self._next:
+            self._next += 1
+        return True
+
+    def release(self, subnet: Union[str, IPNetwork]):
+        """
+        Give a subnet back so it can be handed out again.
+        """
+        index = self._index(IPNetwork(subnet))
+        if not self._is_set(index):
+            return
+        self._bits[index >> 3] &= ~(1 << (index & 7))
+        self.used -= 1
+        self._next = min(self._next, index)
+
+    def is_allocated(self, subnet: Union[str, IPNetwork]) -> bool:
+        return self._is_set(self._index(IPNetwork(subnet)))
+
+    def _is_set(self, index: int) -> bool:
+        byte = index >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << (index & 7)))
+
+    def _set(self, index: int):
+        byte = index >> 3
+        if byte >= len(self._bits):
+            # grow in chunks so a run of allocations doesn't resize every time
+            self._bits.extend(bytes(max(byte + 1 - len(self._bits), 64)))
+        self._bits[byte] |= 1 << (index & 7)
+        self.used += 1
+
+    def _index(self, subnet: IPNetwork) -> int:
+        offset = subnet.first - self._first
+        if (
+            subnet.version != self.supernet.version
+            or subnet.prefixlen != self.prefixlen
+            or offset < 0
+            or offset % self.block
+            or offset // self.block >= self.size
+        ):
+            raise ValueError(f"{subnet} isn't a /{self.prefixlen} in {self.name}")
+        return offset // self.block
+
+    def _subnet(self, index: int) -> IPNetwork:
+        # much quicker than parsing a string
+        return IPNetwork(
+            (self._first + index * self.block, self.prefixlen), self.supernet.version
+        )
+
+
+def get_p2p_ips(subnet: IPNetwork) -> List[str]:
+    """
+    The usable addresses of a point-to-point subnet in the order they're given to the
+    ends of a link, in CIDR notation. Both addresses of a /31 or /127 (RFC 3021 and
+    6164), otherwise the first two hosts.
+    """
+    width = 32 if subnet.version == 4 else 128
+    # same as the first two of subnet.iter_hosts(), without the overhead
+    first = subnet.first if subnet.prefixlen >= width - 1 else subnet.first + 1
+    return [
+        f"{IPAddress(host, subnet.version)}/{subnet.prefixlen}"
+        for host in (first, first + 1)
+        if host <= subnet.last
+    ]
+
+
+def half(supernet: Union[str, IPNetwork], which: int) -> IPNetwork:
+    """
+    The first (0) or second (1) half of a supernet.
+    """
+    supernet = IPNetwork(supernet).cidr
+    halves = supernet.subnet(supernet.prefixlen + 1)
+    first = next(halves)
+    return first if which == 0 else next(halves)
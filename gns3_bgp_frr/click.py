@@ -1,4 +1,16 @@
+from rich_click.rich_command import RichCommand
 from rich_click.rich_group import RichGroup
+from gns3_bgp_frr import tracing
+
+
+class TracedCommand(RichCommand):
+    """
+    Records each run of the command as a span. See `tracing`.
+    """
+
+    def invoke(self, ctx):
+        with tracing.span(str(ctx.info_name), "subcommand"):
+            return super().invoke(ctx)
 
 
 class AppearanceOrderGroup(RichGroup):
@@ -6,5 +18,7 @@ class AppearanceOrderGroup(RichGroup):
     Sort commands by order of appearance.
     """
 
+    command_class = TracedCommand
+
     def list_commands(self, ctx):
         return self.commands.keys()
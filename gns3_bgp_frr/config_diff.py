@@ -0,0 +1,138 @@
+from typing import Dict, List, Tuple
+
+# A parsed config. Each line (stripped) maps to the lines nested under it, in order.
+# e.g. {"router bgp 1": {"bgp router-id 0.0.1.1": {}, ...}, ...}
+ConfigTree = Dict[str, "ConfigTree"]
+
+# lines that only close a section. Indentation already tells us that
+closing_lines = ("exit", "exit-address-family", "exit-vrf", "end")
+
+# top level lines FRR adds itself that the generated configs don't manage. Never remove
+# these
+unmanaged_prefixes = (
+    "frr version",
+    "frr defaults",
+    "hostname",
+    "log ",
+    "service ",
+    "line vty",
+    "Building configuration",
+    "Current configuration",
+)
+
+# negated defaults that FRR never shows in the running config
+hidden_defaults = ("no shutdown",)
+
+
+def parse_config(text: str) -> ConfigTree:
+    """
+    Parse an FRR config (generated, or `show running-config` output) into a tree based on
+    indentation. Comments, blank lines and section-closing lines are dropped. Sections
+    that appear more than once (e.g. `interface eth0` in both the base and OSPF parts of
+    a generated config) are merged.
+    """
+    tree: ConfigTree = {}
+    # (indent, section) pairs for the sections the current line could be nested in
+    stack: List[Tuple[int, ConfigTree]] = [(-1, tree)]
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("!") or stripped in closing_lines:
+            continue
+
+        indent = len(line) - len(line.lstrip())
+        while stack[-1][0] >= indent:
+            stack.pop()
+
+        parent = stack[-1][1]
+        section = parent.setdefault(stripped, {})
+        stack.append((indent, section))
+
+    return tree
+
+
+def extract_running_config(output: str) -> str:
+    """
+    Pull the config out of the output of `vtysh -c 'show running-config'` run over
+    telnet, dropping the echoed command, the header and the trailing prompt.
+    """
+    lines = output.replace("\r", "").split("\n")
+    start = 0
+    for index, line in enumerate(lines):
+        if line.startswith("Current configuration:"):
+            start = index + 1
+            break
+    end = len(lines)
+    for index in range(len(lines) - 1, start - 1, -1):
+        if lines[index] == "end":
+            end = index
+            break
+    return "\n".join(lines[start:end])
+
+
+def diff_configs(running: ConfigTree, desired: ConfigTree) -> List[str]:
+    """
+    Returns the vtysh config mode commands that turn `running` into `desired`, in the
+    spirit of frr-reload: lines that are no longer wanted are negated with `no`, missing
+    lines and sections are added, and sections that exist in both are entered only if
+    something inside them changed.
+
+    Removals come before additions so that changed values (e.g. a new router-id) end up
+    with the new value. An empty list means the configs already match.
+    """
+    return _diff_section(running, desired, top_level=True)
+
+
+def _diff_section(
+    running: ConfigTree, desired: ConfigTree, top_level=False
+) -> List[str]:
+    removals: List[str] = []
+    additions: List[str] = []
+
+    for line, children in running.items():
+        if line in desired:
+            continue
+        if top_level and line.startswith(unmanaged_prefixes):
+            continue
+        # we can't tell what FRR would need to undo a negation, so leave it
+        if line.startswith("no "):
+            continue
+        # physical interfaces can't be deleted, so empty them instead
+        if line.startswith("interface ") and children:
+            inner = _diff_section(children, {})
+            if inner:
+                removals.extend([line, *inner, _closing_line(line)])
+            continue
+        removals.append(f"no {line}")
+
+    for line, children in desired.items():
+        if line not in running:
+            # these are already in effect if they're not shown
+            if line in hidden_defaults:
+                continue
+            additions.extend(_section_lines(line, children))
+            continue
+        inner = _diff_section(running[line], children)
+        if inner:
+            additions.extend([line, *inner, _closing_line(line)])
+
+    return removals + additions
+
+
+def _section_lines(line: str, children: ConfigTree) -> List[str]:
+    """
+    The commands to create a section from scratch.
+    """
+    if not children:
+        return [line]
+    lines = [line]
+    for child, grandchildren in children.items():
+        lines.extend(_section_lines(child, grandchildren))
+    lines.append(_closing_line(line))
+    return lines
+
+
+def _closing_line(line: str) -> str:
+    if line.startswith("address-family"):
+        return "exit-address-family"
+    return "exit"
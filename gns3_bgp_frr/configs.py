@@ -1,10 +1,28 @@
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
+from dataclasses import dataclass
+import os
 import re
 from time import sleep
-from typing import Dict, List
-from jinja2 import Environment, FileSystemLoader, select_autoescape, Template
+from typing import Dict, List, Optional, Union
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    select_autoescape,
+    Template,
+)
 from pathlib import Path
-from gns3_bgp_frr import addressing, gns3, logging
+from gns3_bgp_frr import (
+    addressing,
+    config_diff,
+    gns3,
+    logging,
+    roles,
+    topology,
+    tracing,
+)
+from gns3_bgp_frr.state import AppliedState, content_hash
 from netaddr import IPNetwork, IPAddress
 import gns3fy
 import settings
@@ -13,35 +31,51 @@ import settings
 parent_path = Path(__file__).resolve().parent
 root_path = parent_path / ".."
 templates_folder_path = root_path / "templates"
-env = Environment(
-    loader=FileSystemLoader(templates_folder_path), autoescape=select_autoescape()
-)
 
 # write to this folder
 output_folder_path = root_path / "generated"
 # ensure it exists
 output_folder_path.mkdir(parents=True, exist_ok=True)
 
-# mark which interfaces of asn1 devices should form ospf adjacencies.
-ospf_interfaces = {
-    "asn1border1": ["eth0", "eth1"],
-    "asn1border2": ["eth0", "eth1"],
-    "asn1border3": ["eth6", "eth7"],
-    "asn1internal1": ["eth0", "eth6", "eth7"],
-    "asn1internal2": ["eth0", "eth6", "eth7"],
-}
+# compiled templates, so they're only compiled again when they change. Saves each run
+# (and each render worker, see `generate_configs()`) from doing it. Kept in this folder
+# of `output_folder_path`
+template_cache_folder_name = "template_cache"
+# the jinja environment for each template cache folder. See `get_environment()`
+_environments: Dict[Path, Environment] = {}
+
+# what was last applied to each node. See `AppliedState`
+applied_state_path = output_folder_path / "applied.json"
 
-# mark which interfaces of asn1 border devices should form iBGP peers
-asn1_ibgp_interfaces = {
-    "asn1border1": ["eth0", "eth1"],
-    "asn1border2": ["eth0", "eth1"],
-    "asn1border3": ["eth6", "eth7"],
-}
+# where bulk applies put each config inside the node before loading it
+remote_config_path = "/tmp/gns3-bgp-frr.conf"
+# where FRR saves its config. Hashed to spot changes made outside of this tool
+frr_config_path = "/etc/frr/frr.conf"
+# where alpine keeps its network config
+alpine_config_path = "/etc/network/interfaces"
 
+# how many processes render configs at once, for topologies with at least
+# PARALLEL_RENDER_MIN_ROUTERS routers. Smaller ones aren't worth starting them for. Set
+# from `generate-configs --workers`
+RENDER_WORKERS = os.cpu_count() or 1
+PARALLEL_RENDER_MIN_ROUTERS = 200
 
-def generate_configs(log=False):
+# the second octet of the router ID for each kind of router. See `generate_router_id()`
+router_id_types = {"border": 0, "internal": 1, "cpe": 2}
+
+
+@tracing.traced()
+def generate_configs(log=False, refresh_topology=False) -> List[str]:
     """
     Creates FRR configs for each router, in the `<project root>/generated` folder.
+
+    Works from the saved topology snapshot if there is one, so doesn't need the GNS3
+    server. Set refresh_topology to true to read it from the server first. See
+    `topology.get_topology()`.
+
+    Big topologies are rendered across RENDER_WORKERS processes. Files are only written
+    if their config changed, so their modification times say when that last happened.
+    Returns the names of the routers whose configs changed.
     """
     if log:
         logging.log(
@@ -49,64 +83,194 @@ def generate_configs(log=False):
             "info",
         )
 
-    # template that applies to all routers
-    base_template = env.get_template("base.j2")
-    # template that applies to ospf routers in asn 1
-    ospf_template = env.get_template("ospf.j2")
-    # template that applies to all border routers
-    bgp_template = env.get_template("bgp.j2")
+    project_topology = topology.get_topology(refresh=refresh_topology, log=log)
+    # IP addresses for the interfaces of all routers. Always worked out fresh here, so
+    # everything after uses what the configs were generated with
+    interface_ips = addressing.get_interface_ips(log=log, refresh=True)
+    context = RenderContext(
+        interface_ips=interface_ips,
+        # empty unless P2P_SUPERNET_V6 is set
+        interface_ipv6s=addressing.get_interface_ips(version=6),
+        # eBGP neighbors of all routers
+        border_neighbors=gns3.get_all_neighboring_border_routers_info(interface_ips),
+        # what each router does, from what it's linked to. See `roles.infer_roles()`
+        router_roles=roles.get_roles(project_topology),
+        template_cache_path=output_folder_path / template_cache_folder_name,
+    )
+
+    routers = [node for node in project_topology.nodes if gns3.is_router(node)]
+    with tracing.span("render", routers=len(routers)):
+        if len(routers) >= PARALLEL_RENDER_MIN_ROUTERS and RENDER_WORKERS > 1:
+            if log:
+                logging.log(
+                    f"rendering {len(routers)} configs with {RENDER_WORKERS} workers",
+                    "info",
+                )
+            with ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                initializer=_set_render_context,
+                initargs=(context,),
+            ) as executor:
+                # big chunks, each one is sent to a worker and back
+                chunk_size = max(1, len(routers) // (RENDER_WORKERS * 4))
+                configs = list(
+                    executor.map(_render_config, routers, chunksize=chunk_size)
+                )
+        else:
+            _set_render_context(context)
+            configs = [_render_config(node) for node in routers]
+
+    changed = []
+    with tracing.span("write"):
+        for node, config in zip(routers, configs):
+            # save with a cisco extension to get better highlighting
+            file_name = f"{node.name}.ios"
+            if write_if_changed(output_folder_path / file_name, config):
+                changed.append(node.name)
+                if log:
+                    logging.log(f"generated [cyan]{file_name}[/]", "info")
 
-    # IP addresses for the interfaces of all routers
-    interface_ips = addressing.get_interface_ips(log=log)
-    # asn1 p2p links summarised
-    asn1_supernet = addressing.get_asn1_supernet()
+    if log:
+        logging.log(
+            f"{len(changed)} of {len(routers)} configs changed",
+            "done" if changed else "info",
+        )
 
-    for node in gns3.project.nodes:
-        if node.name is None or not gns3.is_router(node):
-            continue
+    return changed
+
+
+@dataclass
+class RenderContext:
+    """
+    Everything about the whole lab that rendering a router's config needs. Worked out
+    once by `generate_configs()` then shared with each render worker.
+    """
 
-        node_interface_ips = interface_ips[node.name]
+    interface_ips: Dict[str, "addressing.InterfaceIps"]
+    interface_ipv6s: Dict[str, "addressing.InterfaceIps"]
+    border_neighbors: Dict[str, List["gns3.NeighboringBorderRouterInfo"]]
+    router_roles: roles.Roles
+    # where the compiled templates go. See `get_environment()`
+    template_cache_path: Path
 
-        # save with a cisco extension to get better highlighting
-        file_name = f"{node.name}.ios"
 
-        if log:
-            logging.log(f"generating [cyan]{file_name}[/]", "info")
+def get_environment(template_cache_path: Path) -> Environment:
+    """
+    Returns the jinja environment that loads templates from the templates folder and
+    caches them compiled in template_cache_path. Made the first time it's needed, so
+    importing us doesn't create anything.
+    """
+    environment = _environments.get(template_cache_path)
+    if environment is None:
+        template_cache_path.mkdir(parents=True, exist_ok=True)
+        environment = Environment(
+            loader=FileSystemLoader(templates_folder_path),
+            autoescape=select_autoescape(),
+            bytecode_cache=FileSystemBytecodeCache(template_cache_path),
+        )
+        _environments[template_cache_path] = environment
+    return environment
+
 
-        # generate separate config sections
-        base_config = base_template.render({"interface_ips": node_interface_ips})
-        ospf_config = generate_ospf_config(node.name, ospf_template, asn1_supernet)
-        bgp_config = generate_bgp_config(node, bgp_template, interface_ips)
+# the context for `_render_config()` in this process. See `_set_render_context()`
+_render_context: Optional[RenderContext] = None
 
-        output_path = output_folder_path / file_name
-        # write a single combined config file
-        config = base_config + "\n" + ospf_config + "\n" + bgp_config
-        with open(output_path, "w") as output_file:
-            output_file.write(config)
+
+def _set_render_context(context: RenderContext):
+    """
+    Sets what `_render_config()` renders with. Run once in each render worker when it
+    starts, so the context is only sent to it once.
+    """
+    global _render_context
+    _render_context = context
+
+
+def _render_config(node: topology.Node) -> str:
+    """
+    Renders the whole config for a router: base, OSPF and BGP sections.
+    """
+    context = _render_context
+    if context is None:
+        raise RuntimeError("no render context set, see generate_configs()")
+
+    env = get_environment(context.template_cache_path)
+    # template that applies to all routers
+    base_template = env.get_template("base.j2")
+    # template that applies to routers in ASes that run OSPF
+    ospf_template = env.get_template("ospf.j2")
+    # template that applies to all routers that run BGP
+    bgp_template = env.get_template("bgp.j2")
+
+    base_config = base_template.render(
+        {
+            "interface_ips": context.interface_ips.get(node.name, {}),
+            "interface_ipv6s": context.interface_ipv6s.get(node.name, {}),
+        }
+    )
+    ospf_config = generate_ospf_config(
+        node.name, ospf_template, context.interface_ips, context.router_roles
+    )
+    bgp_config = generate_bgp_config(
+        node,
+        bgp_template,
+        context.interface_ips,
+        context.border_neighbors,
+        context.router_roles,
+    )
+
+    # a single combined config
+    return base_config + "\n" + ospf_config + "\n" + bgp_config
+
+
+def write_if_changed(path: Path, content: str) -> bool:
+    """
+    Writes content to path unless it already has exactly that content. Returns whether
+    it wrote.
+
+    Writes to a temporary file then moves it over the original, so anything reading it
+    (e.g. `apply_frr_configs()`) sees either the old file or the new one, never half.
+    """
+    try:
+        if path.read_text() == content:
+            return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+
+    temp_path = path.with_name(path.name + ".tmp")
+    temp_path.write_text(content)
+    os.replace(temp_path, path)
+    return True
 
 
 def generate_ospf_config(
-    node_name: str, ospf_template: Template, asn1_supernet: IPNetwork
+    node_name: str,
+    ospf_template: Template,
+    interface_ips: Dict[str, Dict[str, str]],
+    router_roles: Optional[roles.Roles] = None,
 ) -> str:
     """
-    Generate and return the OSPF part of the config for asn1 devices.
+    Generate and return the OSPF part of the config for routers in ASes that run OSPF.
     @see `generate_configs()`.
+
+    router_roles is the output of `roles.get_roles()`. If given we don't have to look it
+    up each call.
     """
-    if node_name.startswith("asn1"):
+    if router_roles is None:
+        router_roles = roles.get_roles()
+    role = router_roles[node_name]
+
+    if role.ospf:
 
-        # required, as it won't redistribute from bgp
-        default_information_originate = (
-            True
-            if node_name.endswith("border1") or node_name.endswith("border2")
-            else False
+        # required, as it won't redistribute from bgp. Only where there's somewhere
+        # for it to go: an external port that was given an address
+        default_information_originate = any(
+            port in interface_ips.get(node_name, {}) for port in role.external_ports
         )
 
-        node_ospf_interfaces = ospf_interfaces[node_name]
         ospf_config = ospf_template.render(
             {
-                "ospf_interfaces": node_ospf_interfaces,
-                "asn1_supernet": asn1_supernet,
-                "router_id": generate_router_id(node_name),
+                "ospf_interfaces": role.ospf_interfaces,
+                "router_id": generate_router_id(node_name, role.kind),
                 "default_information_originate": default_information_originate,
             }
         )
@@ -117,33 +281,64 @@ def generate_ospf_config(
 
 
 def generate_bgp_config(
-    node: gns3fy.Node, bgp_template: Template, interface_ips: Dict[str, Dict[str, str]]
+    node: topology.Node,
+    bgp_template: Template,
+    interface_ips: Dict[str, Dict[str, str]],
+    # quoted so gns3 can import us before it's finished loading
+    border_neighbors: Optional[
+        Dict[str, List["gns3.NeighboringBorderRouterInfo"]]
+    ] = None,
+    router_roles: Optional[roles.Roles] = None,
 ) -> str:
     """
-    Generate and return the BGP part of the config for border devices.
-    @see `generate_configs()`.
+    Generate and return the BGP part of the config for routers that run BGP (all but
+    internal ones). @see `generate_configs()`.
+
+    border_neighbors is the output of `gns3.get_all_neighboring_border_routers_info()`
+    and router_roles of `roles.get_roles()`. If given we don't have to work them out
+    each call.
     """
-    # only generate for border and CPE devices
-    if node.name and (node.name.find("border") != -1 or node.name.find("cpe") != -1):
+    if router_roles is None:
+        router_roles = roles.get_roles()
+    role = router_roles[node.name]
 
-        asn = gns3.get_asn(node.name)
-        # directly connected and border only, sonly only eBGP. Not asn1 or asn6 iBGP
-        neighbors = gns3.get_neighboring_border_routers_info(node, interface_ips)
+    if role.bgp:
 
-        if node.name.startswith("asn1"):
-            # summarise ASN 1 at its edge
-            advertised_networks = [addressing.get_asn1_supernet()]
+        asn = gns3.get_asn(node.name)
+        # directly connected only, so eBGP and iBGP between routers in ASes without
+        # OSPF
+        if border_neighbors is None:
+            border_neighbors = gns3.get_all_neighboring_border_routers_info(
+                interface_ips
+            )
+        # copy, we add to it below
+        neighbors = list(border_neighbors.get(node.name, []))
+
+        # summarise the AS at its edge if its links come from a supernet of their own
+        # (e.g. asn1), and enable iBGP over OSPF
+        asn_supernet = addressing.get_asn_supernet(asn) if role.ospf else None
+        if asn_supernet is not None:
+            advertised_networks = [asn_supernet]
             redistribute_connected = False
-            # enable iBGP by also peering with all interfaces of other asn1 border nodes
-            neighbors.extend(get_asn1_ibgp_peers_info(node, interface_ips))
         else:
             advertised_networks = []
-            # non-ASN-1 devices just advertise their connected links instead
+            # just advertise connected links instead
             redistribute_connected = True
+        if role.ospf:
+            neighbors.extend(get_ibgp_peers_info(node, interface_ips, router_roles))
 
-        # configure external BGP or a default route for asn1border1 and asn1border2
+        # configure external BGP or a default route for routers with external links,
+        # e.g. asn1border1 and asn1border2
         external_default_gateway = None
-        if node.name == "asn1border1" or node.name == "asn1border2":
+        external_ip = next(
+            (
+                interface_ips[node.name][port]
+                for port in role.external_ports
+                if port in interface_ips.get(node.name, {})
+            ),
+            None,
+        )
+        if external_ip is not None:
             if settings.ENABLE_EXTERNAL_GATEWAY_BGP:
                 neighbors.append(
                     gns3.NeighboringBorderRouterInfo(
@@ -153,7 +348,7 @@ def generate_bgp_config(
                     )
                 )
                 # and advertise the local network too. Same local network for both
-                external_ip_subnet = IPNetwork(interface_ips[node.name]["eth7"])
+                external_ip_subnet = IPNetwork(external_ip)
                 external_subnet = (
                     f"{external_ip_subnet.network}/{external_ip_subnet.prefixlen}"
                 )
@@ -167,7 +362,7 @@ def generate_bgp_config(
                 "neighbors": neighbors,
                 "advertised_networks": advertised_networks,
                 "redistribute_connected": redistribute_connected,
-                "router_id": generate_router_id(node.name),
+                "router_id": generate_router_id(node.name, role.kind),
                 "external_default_gateway": external_default_gateway,
             }
         )
@@ -177,35 +372,57 @@ def generate_bgp_config(
     return bgp_config
 
 
-def get_asn1_ibgp_peers_info(
-    asn1_node: gns3fy.Node, interface_ips: Dict[str, Dict[str, str]]
-) -> List[gns3.NeighboringBorderRouterInfo]:
-    """
-    Given an asn1 node, returns neighbor info on which BGP peers to set up to create
-    iBGP for ASN1.
+def get_ibgp_peers_info(
+    node: Union[gns3fy.Node, topology.Node],
+    interface_ips: Dict[str, Dict[str, str]],
+    router_roles: Optional[roles.Roles] = None,
+) -> List["gns3.NeighboringBorderRouterInfo"]:
     """
+    Given a router in an AS that runs OSPF, returns neighbor info on which BGP peers to
+    set up to create iBGP for the AS (see `roles.get_ibgp_peers()`).
 
-    # get the peers and interfaces that aren't us
-    other_asn1_ibgp_interfaces = {
-        name: interfaces
-        for (name, interfaces) in asn1_ibgp_interfaces.items()
-        if name != asn1_node.name
-    }
+    In full mesh mode that's every OSPF interface of each peer. In route reflector mode
+    it's each peer's loopback instead, one session per peer.
+    """
+    if router_roles is None:
+        router_roles = roles.get_roles()
+    role = router_roles[str(node.name)]
 
     ibgp_neighbors = []
-    for name, interfaces in other_asn1_ibgp_interfaces.items():
-        for interface in interfaces:
-            ip = interface_ips[name][interface].split("/")[0]
+    for peer in roles.get_ibgp_peers(router_roles, str(node.name)):
+        if role.loopback:
+            loopback_ip = interface_ips.get(peer.name, {}).get(roles.loopback_port)
+            if loopback_ip is None:
+                continue
+            ibgp_neighbors.append(
+                gns3.NeighboringBorderRouterInfo(
+                    asn=peer.asn,
+                    name=peer.name,
+                    ip=loopback_ip.split("/")[0],
+                    update_source=roles.loopback_port,
+                    # not directly connected. OSPF notices failures instead
+                    bfd=False,
+                    route_reflector_client=(
+                        role.route_reflector and not peer.route_reflector
+                    ),
+                )
+            )
+            continue
+
+        for interface in peer.ospf_interfaces:
+            if interface not in interface_ips.get(peer.name, {}):
+                continue
+            ip = interface_ips[peer.name][interface].split("/")[0]
             ibgp_neighbors.append(
                 gns3.NeighboringBorderRouterInfo(
-                    asn=1, name=f"{name}-{interface}", ip=ip
+                    asn=peer.asn, name=f"{peer.name}-{interface}", ip=ip
                 )
             )
 
     return ibgp_neighbors
 
 
-def generate_router_id(node_name: str) -> IPAddress:
+def generate_router_id(node_name: str, kind: Optional[str] = None) -> IPAddress:
     """
     Generate a router ID based on the ASN and router number to make things clearer.
 
@@ -214,61 +431,215 @@ def generate_router_id(node_name: str) -> IPAddress:
     CPE routers get 0.2.asn.num.
     All others get 0.255.asn.num.
 
-    If asn or num are missing or the given name can't be parsed, 255s will be used.
+    The kind of router comes from its role (see `roles.RouterRole.kind`) if given,
+    otherwise its name. If asn or num are over 255 they're packed into 12 bits each
+    after a first octet of 1 (border) to 4 (others) instead. If they're missing or the
+    given name can't be parsed, 255s will be used.
     """
-    if node_name.find("border") != -1:
-        type_id = 0
-    elif node_name.find("internal") != -1:
-        type_id = 1
-    elif node_name.find("cpe") != -1:
-        type_id = 2
-    else:
-        type_id = 255
+    if kind is None:
+        if node_name.find("border") != -1:
+            kind = "border"
+        elif node_name.find("internal") != -1:
+            kind = "internal"
+        elif node_name.find("cpe") != -1:
+            kind = "cpe"
+    type_id = router_id_types.get(str(kind), 255)
 
     match = re.match(r"asn(\d+)[a-zA-Z]+(\d+)", node_name)
     if match:
-        asn = match.group(1) if match.group(1) else "255"
-        num = match.group(2) if match.group(2) else "255"
-        router_id = f"0.{type_id}.{asn}.{num}"
+        asn = int(match.group(1)) if match.group(1) else 255
+        num = int(match.group(2)) if match.group(2) else 255
     else:
-        router_id = f"0.{type_id}.255.255"
+        asn, num = 255, 255
 
-    return IPAddress(router_id)
+    if asn > 255 or num > 255:
+        first_octet = 1 + min(type_id, 3)
+        return IPAddress((first_octet << 24) | ((asn & 0xFFF) << 12) | (num & 0xFFF))
 
+    return IPAddress(f"0.{type_id}.{asn}.{num}")
 
-def apply_frr_configs(log=False):
+
+@tracing.traced()
+def apply_frr_configs(log=False, bulk=True, incremental=False, force=False):
     """
     Apply the generated configs to the frr devices.
     Configs must have been generated first.
     Automatically starts the nodes.
+
+    If bulk is true each config file is copied into the node in one go and loaded with
+    `vtysh -f`, so the cost is set by the size of the file rather than a round trip per
+    line. If the copy fails its checksum, that node falls back to typing the config
+    line by line into `vtysh`'s config mode, which is what bulk=False always does.
+
+    If incremental is true bulk is ignored. Each router's running config is compared to
+    the generated one and only the differences are sent. See
+    `apply_frr_config_incremental()`.
+
+    Routers are skipped if their generated config and node ID are the same as the last
+    successful apply, and the hash of their saved `frr.conf` hasn't changed since (i.e.
+    nobody has changed it by hand). Set force to true to apply to every router anyway.
     """
     gns3.start_all(log=log)
 
     if log:
         logging.log("applying frr configs", "info")
 
-    for config_file_path in output_folder_path.iterdir():
+    # read every config up front, then push them all at once
+    nodes: List[gns3fy.Node] = []
+    node_configs: Dict[str, str] = {}
+    for config_file_path in sorted(output_folder_path.glob("*.ios")):
         node_name = config_file_path.name.split(".")[0]
 
-        if log:
-            logging.log(f"    [cyan]{node_name}[/]", "info")
-
         node = gns3.project.get_node(name=node_name)
         if node is None:
             continue
 
         with open(config_file_path) as config_file:
-            config_lines = config_file.read().splitlines()
-            # enter config mode
-            config_lines.insert(0, "vtysh")
-            config_lines.insert(1, "conf t")
-            # save
-            config_lines.append("end")
-            config_lines.append("wr mem")
+            node_configs[node_name] = config_file.read()
+        nodes.append(node)
+
+    state = AppliedState(applied_state_path)
+    config_hashes = {
+        name: content_hash(config) for name, config in node_configs.items()
+    }
+    if not force:
+        nodes = get_changed_nodes(nodes, config_hashes, state, frr_config_path, log=log)
+
+    if incremental:
+        apply = apply_frr_config_incremental
+    elif bulk:
+        apply = apply_frr_config_bulk
+    else:
+        apply = apply_frr_config_lines
+
+    def apply_and_hash(node: gns3fy.Node):
+        result = apply(node, node_configs[node.name])
+        return result, gns3.get_file_hash(node, frr_config_path)
+
+    results: List[gns3.NodeResult] = []
+    try:
+        results = gns3.run_on_nodes(nodes, apply_and_hash, log=log)
+    except gns3.NodeError as error:
+        results = error.results
+        raise
+    finally:
+        # remember the ones that worked, even if others didn't
+        for result in results:
+            if result.error is None:
+                name = str(result.node.name)
+                remote_hash = result.result[1]
+                state.record(
+                    name, str(result.node.node_id), config_hashes[name], remote_hash
+                )
+        state.save()
+
+    if log and incremental:
+        changed = [result for result in results if result.result[0]]
+        logging.log(
+            f"{len(changed)} of {len(results)} routers had changes, "
+            f"{sum(result.result[0] for result in changed)} commands sent",
+            "info",
+        )
+
+
+@tracing.traced()
+def get_changed_nodes(
+    nodes: List[gns3fy.Node],
+    config_hashes: Dict[str, str],
+    state: AppliedState,
+    remote_path: str,
+    log=False,
+) -> List[gns3fy.Node]:
+    """
+    Returns the nodes that need their config applied: those whose config hash or node
+    ID differs from the last successful apply in `state`, and those where the hash of
+    `remote_path` inside the node no longer matches what it was after that apply.
+    """
+    unchanged = [
+        node
+        for node in nodes
+        if state.is_unchanged(
+            str(node.name), str(node.node_id), config_hashes[str(node.name)]
+        )
+    ]
+
+    # cheap check that nobody has changed the unchanged ones by hand since
+    try:
+        results = gns3.run_on_nodes(
+            unchanged, lambda node: gns3.get_file_hash(node, remote_path)
+        )
+    except gns3.NodeError as error:
+        results = error.results
+    skipped = {
+        result.node.name
+        for result in results
+        if result.error is None
+        and result.result == state.remote_hash(str(result.node.name))
+    }
+
+    if log and skipped:
+        logging.log(
+            f"skipping {len(skipped)} unchanged nodes (use --force to apply anyway)",
+            "info",
+        )
 
-            gns3.run_shell_commands(node, config_lines)
+    return [node for node in nodes if node.name not in skipped]
 
 
+def apply_frr_config_bulk(node: gns3fy.Node, config: str):
+    """
+    Copy a whole config into the node and load it with `vtysh -f`, then save.
+    Falls back to `apply_frr_config_lines()` if the copy doesn't pass its checksum.
+    """
+    try:
+        gns3.write_file(node, remote_config_path, config)
+    except gns3.ChecksumError as error:
+        logging.log(f"{error}, applying line by line instead", "error")
+        apply_frr_config_lines(node, config)
+        return
+
+    gns3.run_shell_commands(
+        node,
+        [
+            f"vtysh -f {remote_config_path}",
+            "vtysh -c 'write memory'",
+            f"rm -f {remote_config_path}",
+        ],
+    )
+
+
+def apply_frr_config_incremental(node: gns3fy.Node, config: str) -> int:
+    """
+    Compare the node's running config to `config` and send only the commands needed to
+    make them match, so unchanged routers and sessions aren't touched. Returns how many
+    commands were sent.
+    """
+    output = gns3.run_shell_command(node, "vtysh -c 'show running-config'")
+    running = config_diff.parse_config(config_diff.extract_running_config(output))
+    commands = config_diff.diff_configs(running, config_diff.parse_config(config))
+
+    if commands:
+        gns3.run_shell_commands(node, ["vtysh", "conf t", *commands, "end", "wr mem"])
+
+    return len(commands)
+
+
+def apply_frr_config_lines(node: gns3fy.Node, config: str):
+    """
+    Type a config into `vtysh`'s config mode one line at a time, then save.
+    """
+    config_lines = config.splitlines()
+    # enter config mode
+    config_lines.insert(0, "vtysh")
+    config_lines.insert(1, "conf t")
+    # save
+    config_lines.append("end")
+    config_lines.append("wr mem")
+
+    gns3.run_shell_commands(node, config_lines)
+
+
+@tracing.traced()
 def clear_frr_configs(log=False):
     """
     Clears the config on frr nodes.
@@ -279,27 +650,41 @@ def clear_frr_configs(log=False):
     if log:
         logging.log("clearing frr configs", "info")
 
-    for node in gns3.project.nodes:
-        if gns3.is_router(node):
-
-            if log:
-                logging.log(f"    [cyan]{node.name}[/]", "info")
+    # delete all frr config files and conf.sav files
+    routers = [node for node in gns3.project.nodes if gns3.is_router(node)]
+    results = gns3.run_on_nodes(
+        routers,
+        lambda node: gns3.run_shell_command(node, "rm /etc/frr/*.conf*"),
+        log=log,
+    )
+    # rm complains if the glob didn't match anything, i.e. there was nothing to clear
+    changed = [
+        result.node
+        for result in results
+        if "No such file or directory" not in result.result
+    ]
 
-            # delete all frr config files and conf.sav files
-            gns3.run_shell_command(node, "rm /etc/frr/*.conf*")
+    # they'll all need their configs applied again
+    state = AppliedState(applied_state_path)
+    for node in routers:
+        state.forget(str(node.name))
+    state.save()
 
+    # FRR needs to be restarted for it to apply
     if log:
-        logging.log("restarting to apply:", "info")
+        logging.log(f"reloading FRR on {len(changed)} changed nodes to apply:", "info")
 
-    # they need to be restarted for it to apply
-    gns3.stop_all(log=log)
-    gns3.start_all(log=log)
+    gns3.reload_frr(changed, log=log)
 
 
-def configure_alpine(log=False):
+@tracing.traced()
+def configure_alpine(log=False, force=False):
     """
     Apply network settings to the alpine-1 endpoint.
     Automatically starts the node.
+
+    Skipped if the settings haven't changed since they were last applied, unless force
+    is true. See `apply_frr_configs()`.
     """
     # get the alpine-1 endpoint and its router from the project
     alpine_1 = gns3.project.get_node("alpine-1")
@@ -312,7 +697,7 @@ def configure_alpine(log=False):
     if log:
         logging.log("starting [cyan]alpine-1[/]", "info")
 
-    alpine_1.start()
+    gns3.start_nodes([alpine_1])
 
     # get the CIDR IP of the router's interface.
     # this will tell us the subnet and give us the default gateway IP
@@ -338,16 +723,32 @@ def configure_alpine(log=False):
         f"echo '       netmask {asn6cpe1_network.netmask}' >> /etc/network/interfaces",
         f"echo '       gateway {asn6cpe1_network.ip}' >> /etc/network/interfaces",
     ]
+
+    state = AppliedState(applied_state_path)
+    config_hashes = {"alpine-1": content_hash("\n".join(commands))}
+    if not force and not get_changed_nodes(
+        [alpine_1], config_hashes, state, alpine_config_path
+    ):
+        if log:
+            logging.log("[cyan]alpine-1[/] is unchanged, skipping", "info")
+        return
+
     gns3.run_shell_commands(alpine_1, commands)
 
     if log:
         logging.log("restarting [cyan]alpine-1[/] to apply", "info")
 
     # apply
-    alpine_1.stop()
-    alpine_1.start()
+    gns3.restart_nodes([alpine_1])
 
+    remote_hash = gns3.get_file_hash(alpine_1, alpine_config_path)
+    state.record(
+        "alpine-1", str(alpine_1.node_id), config_hashes["alpine-1"], remote_hash
+    )
+    state.save()
 
+
+@tracing.traced()
 def clear_alpine_config(log=False):
     """
     Resets the alpine  node back to default.
@@ -361,16 +762,24 @@ def clear_alpine_config(log=False):
     if log:
         logging.log("starting [cyan]alpine-1[/] ", "info")
 
-    alpine_1.start()
+    gns3.start_nodes([alpine_1])
 
     if log:
         logging.log("clearing [cyan]alpine-1[/] network config", "info")
 
-    gns3.run_shell_command(alpine_1, "rm /etc/network/interfaces")
+    output = gns3.run_shell_command(alpine_1, "rm /etc/network/interfaces")
+
+    # it'll need configuring again
+    state = AppliedState(applied_state_path)
+    state.forget("alpine-1")
+    state.save()
+
+    # nothing to apply if it wasn't configured
+    if "No such file or directory" in output:
+        return
 
     # apply
     if log:
         logging.log("restarting [cyan]alpine-1[/] to apply ", "info")
 
-    alpine_1.stop()
-    alpine_1.start()
+    gns3.restart_nodes([alpine_1])
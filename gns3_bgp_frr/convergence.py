@@ -0,0 +1,353 @@
+from dataclasses import dataclass, field
+import json
+from pathlib import Path
+import re
+from time import perf_counter, sleep
+from typing import Any, Dict, List, Optional, Set, Tuple
+import gns3fy
+from gns3_bgp_frr import config_diff, configs, gns3, logging, telnet, tracing
+
+# how long to wait for the whole lab to converge, how often to poll each router that
+# hasn't, and how long its sessions and route count have to stay put to count as
+# converged. Set from the `measure-convergence` options
+CONVERGENCE_TIMEOUT = 300
+POLL_INTERVAL = 1.0
+SETTLE_TIME = 5.0
+
+bgp_summary_command = "vtysh -c 'show bgp summary json'"
+ospf_neighbor_command = "vtysh -c 'show ip ospf neighbor json'"
+bfd_peers_command = "vtysh -c 'show bfd peers json'"
+
+# a prompt at the start of a line. See `telnet.prompt_line_pattern`
+prompt_line_pattern = re.compile("(?m)^" + telnet.prompt_line_pattern.pattern.decode())
+# vtysh's JSON output starts on a line of its own
+json_start_pattern = re.compile(r"(?m)^[ \t]*[{\[]")
+
+
+@dataclass
+class ExpectedSessions:
+    """
+    What a router's generated config says it should have once the lab has converged.
+    See `get_expected_sessions()`.
+    """
+
+    # BGP neighbor IPs
+    bgp: Set[str] = field(default_factory=set)
+    # how many OSPF neighbors: one per non-passive interface, as every link is p2p
+    ospf: int = 0
+    # BFD peer IPs
+    bfd: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class RouterConvergence:
+    """
+    How far a router has got, as of its last poll. Times are seconds since
+    `measure_convergence()` started.
+    """
+
+    name: str
+    expected: ExpectedSessions
+    bgp_established: int = 0
+    ospf_full: int = 0
+    bfd_up: int = 0
+    # prefixes received over all BGP sessions
+    routes: int = 0
+    # when every expected session was up with the current route count. None if they
+    # aren't
+    converged_at: Optional[float] = None
+    # when it was last polled
+    polled_at: float = 0.0
+
+    @property
+    def sessions_up(self) -> bool:
+        return (
+            self.bgp_established == len(self.expected.bgp)
+            and self.ospf_full >= self.expected.ospf
+            and self.bfd_up == len(self.expected.bfd)
+        )
+
+    def is_settled(self, settle_time: float) -> bool:
+        return (
+            self.converged_at is not None
+            and self.polled_at - self.converged_at >= settle_time
+        )
+
+
+def get_expected_sessions(config: str) -> ExpectedSessions:
+    """
+    Reads the BGP neighbors, BFD peers and OSPF interfaces out of a generated config.
+    """
+    tree = config_diff.parse_config(config)
+    expected = ExpectedSessions()
+    for line, children in tree.items():
+        if line.startswith("router bgp "):
+            expected.bgp.update(
+                child.split()[1]
+                for child in children
+                if child.startswith("neighbor ") and " remote-as " in child
+            )
+        elif line == "bfd":
+            expected.bfd.update(
+                child.split()[1] for child in children if child.startswith("peer ")
+            )
+        elif line.startswith("interface ") and "no ip ospf passive" in children:
+            expected.ospf += 1
+    return expected
+
+
+def parse_json_outputs(output: str, commands: List[str]) -> List[Any]:
+    """
+    Splits the output of `gns3.run_shell_commands()` up by the prompt after each command,
+    the way `telnet.TelnetSession.stream()` counts them, and returns the JSON each one
+    printed, or None where it didn't print any (e.g. the daemon isn't running).
+
+    Doesn't look for the echoed commands, as the terminal wraps long ones.
+    """
+    # everything before each prompt. The last one is whatever came after the last prompt
+    sections = prompt_line_pattern.split(output)[:-1]
+    if len(sections) < len(commands):
+        return [None] * len(commands)
+
+    decoder = json.JSONDecoder()
+    results: List[Any] = []
+    for section in sections[len(sections) - len(commands) :]:
+        # skip the echoed command, however many lines it was wrapped over
+        json_start = json_start_pattern.search(section)
+        if json_start is None:
+            results.append(None)
+            continue
+        try:
+            results.append(decoder.raw_decode(section, json_start.end() - 1)[0])
+        except ValueError:
+            results.append(None)
+    return results
+
+
+def get_bgp_peers(summary: Any) -> Dict[str, Tuple[str, int]]:
+    """
+    Peer IP: (state, prefixes received), over every address family in
+    `show bgp summary json`.
+    """
+    peers: Dict[str, Tuple[str, int]] = {}
+    if not isinstance(summary, dict):
+        return peers
+    for address_family in summary.values():
+        if not isinstance(address_family, dict):
+            continue
+        for ip, peer in address_family.get("peers", {}).items():
+            state, routes = peers.get(ip, ("", 0))
+            if peer.get("state") == "Established" or not state:
+                state = peer.get("state", "")
+            peers[ip] = (state, routes + int(peer.get("pfxRcd", 0)))
+    return peers
+
+
+def count_full_ospf_neighbors(neighbors: Any) -> int:
+    """
+    Neighbors in `show ip ospf neighbor json` that are Full. Older FRR calls the state
+    `state`, newer `nbrState`.
+    """
+    if not isinstance(neighbors, dict):
+        return 0
+    return sum(
+        1
+        for entries in neighbors.get("neighbors", {}).values()
+        for entry in entries
+        if str(entry.get("nbrState", entry.get("state", ""))).startswith("Full")
+    )
+
+
+def get_up_bfd_peers(peers: Any) -> Set[str]:
+    if not isinstance(peers, list):
+        return set()
+    return {peer["peer"] for peer in peers if peer.get("status") == "up"}
+
+
+def poll_router(node: gns3fy.Node, state: RouterConvergence, start: float):
+    """
+    Asks the router how its sessions are doing, in one round trip, and updates state.
+    Only asks about the protocols it's expected to run.
+    """
+    commands = [bgp_summary_command]
+    if state.expected.ospf:
+        commands.append(ospf_neighbor_command)
+    if state.expected.bfd:
+        commands.append(bfd_peers_command)
+    outputs = dict(
+        zip(
+            commands,
+            parse_json_outputs(gns3.run_shell_commands(node, commands), commands),
+        )
+    )
+    polled_at = perf_counter() - start
+
+    bgp_peers = get_bgp_peers(outputs[bgp_summary_command])
+    state.bgp_established = sum(
+        1 for ip in state.expected.bgp if bgp_peers.get(ip, ("", 0))[0] == "Established"
+    )
+    state.ospf_full = count_full_ospf_neighbors(outputs.get(ospf_neighbor_command))
+    state.bfd_up = len(
+        get_up_bfd_peers(outputs.get(bfd_peers_command)) & state.expected.bfd
+    )
+    routes = sum(routes for _, routes in bgp_peers.values())
+
+    if not state.sessions_up:
+        state.converged_at = None
+    elif state.converged_at is None or routes != state.routes:
+        # the clock starts again whenever the routes change
+        state.converged_at = polled_at
+    state.routes = routes
+    state.polled_at = polled_at
+
+
+@tracing.traced()
+def measure_convergence(
+    timeout: Optional[float] = None,
+    poll_interval: Optional[float] = None,
+    settle_time: Optional[float] = None,
+    log=False,
+) -> Dict[str, RouterConvergence]:
+    """
+    Polls every router with a generated config at the same time until all the sessions
+    in it are up (BGP Established, OSPF Full and BFD up) and its BGP route count hasn't
+    changed for settle_time seconds. Routers that have settled stop being polled.
+
+    Run it straight after `apply-configs`. Returns how each router got on. Their
+    `converged_at` is how long after starting they got there, and the lab converged
+    when the last of them did. Gives up after timeout seconds, leaving the routers that
+    hadn't settled by then with whatever they last had.
+
+    Defaults are `CONVERGENCE_TIMEOUT`, `POLL_INTERVAL` and `SETTLE_TIME`.
+    """
+    timeout = CONVERGENCE_TIMEOUT if timeout is None else timeout
+    poll_interval = POLL_INTERVAL if poll_interval is None else poll_interval
+    settle_time = SETTLE_TIME if settle_time is None else settle_time
+
+    nodes: List[gns3fy.Node] = []
+    states: Dict[str, RouterConvergence] = {}
+    for config_file_path in sorted(configs.output_folder_path.glob("*.ios")):
+        node_name = config_file_path.name.split(".")[0]
+        node = gns3.project.get_node(name=node_name)
+        if node is None:
+            continue
+        expected = get_expected_sessions(config_file_path.read_text())
+        states[node_name] = RouterConvergence(name=node_name, expected=expected)
+        nodes.append(node)
+
+    if log:
+        logging.log(
+            f"waiting for {len(nodes)} routers to converge (up to {timeout:g}s)", "info"
+        )
+
+    start = perf_counter()
+    pending = nodes
+    while pending:
+        round_start = perf_counter()
+        try:
+            gns3.run_on_nodes(
+                pending, lambda node: poll_router(node, states[node.name], start)
+            )
+        except gns3.NodeError as error:
+            # try them again next time round
+            if log:
+                for result in error.results:
+                    if result.error is not None:
+                        logging.log(
+                            f"    [cyan]{result.node.name}[/]: {result.error!r}",
+                            "error",
+                        )
+
+        pending = [
+            node for node in pending if not states[node.name].is_settled(settle_time)
+        ]
+        if perf_counter() - start > timeout:
+            break
+        if pending:
+            sleep(max(0.0, poll_interval - (perf_counter() - round_start)))
+
+    if log:
+        print_convergence(states, settle_time)
+
+    return states
+
+
+def print_convergence(states: Dict[str, RouterConvergence], settle_time: float):
+    """
+    A table of how each router got on, then when the whole lab converged.
+    """
+    from rich import print
+    from rich.table import Table
+
+    table = Table(title="convergence")
+    table.add_column("router")
+    table.add_column("bgp", justify="right")
+    table.add_column("ospf", justify="right")
+    table.add_column("bfd", justify="right")
+    table.add_column("routes", justify="right")
+    table.add_column("converged", justify="right")
+    for state in sorted(
+        states.values(),
+        key=lambda state: (state.converged_at is None, state.converged_at or 0),
+    ):
+        settled = state.is_settled(settle_time)
+        table.add_row(
+            state.name,
+            f"{state.bgp_established}/{len(state.expected.bgp)}",
+            f"{state.ospf_full}/{state.expected.ospf}",
+            f"{state.bfd_up}/{len(state.expected.bfd)}",
+            str(state.routes),
+            f"{state.converged_at:.1f}s"
+            if settled and state.converged_at is not None
+            else "no",
+        )
+    print(table)
+
+    unsettled = [
+        state.name for state in states.values() if not state.is_settled(settle_time)
+    ]
+    if unsettled:
+        logging.log(
+            f"{len(unsettled)} of {len(states)} routers didn't converge: "
+            f"{', '.join(unsettled)}",
+            "error",
+        )
+    elif states:
+        lab = max(state.converged_at or 0.0 for state in states.values())
+        logging.log(f"lab converged in {lab:.1f}s", "done")
+
+
+def save_convergence(
+    states: Dict[str, RouterConvergence], path: Path, settle_time: float
+):
+    """
+    Save how each router got on as JSON, e.g. to compare timer settings.
+    """
+    routers = {}
+    for name, state in states.items():
+        routers[name] = {
+            "converged_at": state.converged_at
+            if state.is_settled(settle_time)
+            else None,
+            "bgp_established": state.bgp_established,
+            "bgp_expected": len(state.expected.bgp),
+            "ospf_full": state.ospf_full,
+            "ospf_expected": state.expected.ospf,
+            "bfd_up": state.bfd_up,
+            "bfd_expected": len(state.expected.bfd),
+            "routes": state.routes,
+        }
+    converged = [router["converged_at"] for router in routers.values()]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        json.dumps(
+            {
+                "lab_converged_at": (
+                    max(converged) if converged and None not in converged else None
+                ),
+                "settle_time": settle_time,
+                "routers": routers,
+            },
+            indent=4,
+        )
+    )
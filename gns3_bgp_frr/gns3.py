@@ -1,41 +1,143 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+import hashlib
 import re
-from time import sleep
-from typing import Dict, List, Literal, Optional
+import threading
+from time import perf_counter, sleep, time
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple
 import gns3fy
-from gns3_bgp_frr import configs, logging, addressing
+import requests
+from gns3_bgp_frr import (
+    configs,
+    logging,
+    addressing,
+    metrics,
+    roles,
+    telnet,
+    topology,
+    tracing,
+)
+
+# these live with the topology so it can classify nodes without importing us
+from gns3_bgp_frr.topology import get_asn, is_router
 from settings import *
-from telnetlib import Telnet
 from netaddr import IPAddress
 
 # connection and command write timeout
 TELNET_TIMEOUT = 5
-
-# set up the connection to the project once for all functionality below (and anyone that
-# imports us)
-try:
-    gns3_server = gns3fy.Gns3Connector(
-        GNS3_SERVER_URL, GNS3_SERVER_USERNAME, GNS3_SERVER_PASSWORD
-    )
-    project = gns3fy.Project(name=PROJECT_NAME, connector=gns3_server)
-    project.get()
-    if project.status != "opened":
-        project.open()
-except:
-    message = f"Couldn't connect to GNS3 project with the following settings.\n \
-                Please make sure they're correct in settings.py.\n \
-                \n \
-                GNS3_SERVER_URL: {GNS3_SERVER_URL}\n \
-                GNS3_SERVER_USERNAME: {GNS3_SERVER_USERNAME}\n \
-                GNS3_SERVER_PASSWORD: <not printed>\n \
-                PROJECT_NAME: {PROJECT_NAME}\n \
-                \n \
-                run [cyan]pytest --no-header --tb=line[/] for a more detailed test.\n"
-    logging.log(message, "error")
-    exit(1)
-# print("ran gns3.py startup code")
+# how many nodes to work on at once. Each node has its own aux port so they don't
+# interfere. Set from the `--concurrency` global option.
+MAX_CONCURRENCY = 16
+# how many base64 characters `write_file()` sends per `echo`
+WRITE_FILE_CHUNK_SIZE = 512
+# how often to check on a node that's starting or stopping, and how long to wait for it
+NODE_POLL_INTERVAL = 0.5
+NODE_STATUS_TIMEOUT = 120
+
+# which FRR daemons run. See `set_daemon_state_all()`
+daemons_path = "/etc/frr/daemons"
+# restarts the FRR daemons inside a router's container. See `reload_frr()`
+frr_init_script = "/usr/lib/frr/frrinit.sh"
+# the daemons set_daemon_state_all() turns on and off
+optional_daemons = ["bgpd", "ospfd", "bfdd"]
+# the daemons the daemons file can turn on. It also has settings like
+# `vtysh_enable=yes`, which aren't daemons
+frr_daemons = [
+    "zebra",
+    "bgpd",
+    "ospfd",
+    "ospf6d",
+    "ripd",
+    "ripngd",
+    "isisd",
+    "pimd",
+    "ldpd",
+    "nhrpd",
+    "eigrpd",
+    "babeld",
+    "sharpd",
+    "pbrd",
+    "staticd",
+    "bfdd",
+    "fabricd",
+    "vrrpd",
+    "pathd",
+]
+# how long to wait for the daemons to come back after `reload_frr()`
+FRR_RELOAD_TIMEOUT = 15
+# how long to wait for nodes to be usable after starting them. See `wait_until_ready()`
+READY_TIMEOUT = 120
+# the first and longest wait between readiness checks of a node. Doubles each check
+READY_INITIAL_BACKOFF = 0.25
+READY_MAX_BACKOFF = 4
+
+# the connection to the project, shared by all functionality below (and anyone that
+# imports us). Made on first use by `get_project()` so that importing this module, e.g.
+# for `manage.py --help`, doesn't need the server
+_gns3_server: Optional[gns3fy.Gns3Connector] = None
+_project: Optional[gns3fy.Project] = None
+_project_lock = threading.Lock()
+
+
+def get_project() -> gns3fy.Project:
+    """
+    Returns the GNS3 project, connecting to the server and opening it the first time.
+    Exits with a message if that fails.
+    """
+    global _gns3_server, _project
+    with _project_lock:
+        if _project is not None:
+            return _project
+        try:
+            gns3_server = gns3fy.Gns3Connector(
+                GNS3_SERVER_URL, GNS3_SERVER_USERNAME, GNS3_SERVER_PASSWORD
+            )
+            # keep a connection per worker alive, e.g. for `update_link_labels()`
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=MAX_CONCURRENCY
+            )
+            gns3_server.session.mount("http://", adapter)
+            gns3_server.session.mount("https://", adapter)
+            # time every API call. See `metrics`
+            gns3_server.session.hooks["response"].append(metrics.record_http)
+            project = gns3fy.Project(name=PROJECT_NAME, connector=gns3_server)
+            project.get()
+            if project.status != "opened":
+                project.open()
+        except:
+            message = f"Couldn't connect to GNS3 project with the following settings.\n \
+                        Please make sure they're correct in settings.py.\n \
+                        \n \
+                        GNS3_SERVER_URL: {GNS3_SERVER_URL}\n \
+                        GNS3_SERVER_USERNAME: {GNS3_SERVER_USERNAME}\n \
+                        GNS3_SERVER_PASSWORD: <not printed>\n \
+                        PROJECT_NAME: {PROJECT_NAME}\n \
+                        \n \
+                        run [cyan]pytest --no-header --tb=line[/] for a more detailed test.\n"
+            logging.log(message, "error")
+            exit(1)
+        _gns3_server = gns3_server
+        _project = project
+        # keep the offline copy of the topology up to date while we're here
+        topology.update_snapshot(project)
+        return _project
+
+
+def __getattr__(name: str):
+    """
+    Keeps `gns3.project` and `gns3.gns3_server` working for modules that import us, while
+    only connecting when they're first used.
+    """
+    if name == "project":
+        return get_project()
+    if name == "gns3_server":
+        get_project()
+        return _gns3_server
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
+@tracing.traced()
 def start_all(log=False):
     """
     Starts all nodes.
@@ -43,13 +145,10 @@ def start_all(log=False):
     if log:
         logging.log("Starting all nodes ", "info")
 
-    # save time - only run if required. There's a wait from start_nodes() even if
-    # they're already started
-    already_started = all([node.status == "started" for node in project.nodes])
-    if not already_started:
-        project.start_nodes()
+    start_nodes(get_project().nodes, log=log)
 
 
+@tracing.traced()
 def stop_all(log=False):
     """
     Stops all nodes.
@@ -57,11 +156,86 @@ def stop_all(log=False):
     if log:
         logging.log("Stopping all nodes ", "info")
 
-    # save time - only run if required. There's a wait from stop_nodes() even if
-    # they're already stopped
-    already_stopped = all([node.status == "stopped" for node in project.nodes])
-    if not already_stopped:
-        project.stop_nodes()
+    stop_nodes(get_project().nodes, log=log)
+
+
+def start_nodes(nodes: List[gns3fy.Node], log=False):
+    """
+    Starts the given nodes at the same time and returns once they've all started. Nodes
+    that already have are skipped.
+    """
+    set_node_status(nodes, "started", log=log)
+
+
+def stop_nodes(nodes: List[gns3fy.Node], log=False):
+    """
+    Stops the given nodes at the same time and returns once they've all stopped. Nodes
+    that already have are skipped.
+    """
+    set_node_status(nodes, "stopped", log=log)
+
+
+def restart_nodes(nodes: List[gns3fy.Node], log=False):
+    """
+    Stops then starts the given nodes. Each one is started again as soon as it has
+    stopped, without waiting for the others.
+    """
+
+    def restart(node: gns3fy.Node):
+        change_node_status(node, "stopped")
+        change_node_status(node, "started")
+
+    run_on_nodes(nodes, restart, log=log)
+
+
+@tracing.traced()
+def set_node_status(
+    nodes: List[gns3fy.Node], status: Literal["started", "stopped"], log=False
+):
+    """
+    Used by `start_nodes()` and `stop_nodes()`.
+    """
+    # save time - only act on the ones that need it
+    pending = [node for node in nodes if node.status != status]
+    if pending:
+        run_on_nodes(pending, lambda node: change_node_status(node, status), log=log)
+
+
+def change_node_status(node: gns3fy.Node, status: Literal["started", "stopped"]):
+    """
+    Start or stop a single node, then poll it until it gets there. Started docker nodes
+    are also waited on until they're ready to be configured (see `check_ready()`).
+    Raises `TimeoutError` if it takes longer than `NODE_STATUS_TIMEOUT`.
+    """
+    if status == "started":
+        node.start()
+    else:
+        node.stop()
+        # its telnet sessions are dead now
+        discard_telnet_sessions(node)
+
+    deadline = time() + NODE_STATUS_TIMEOUT
+    while node.status != status:
+        if time() > deadline:
+            raise TimeoutError(
+                f"{node.name} still {node.status} after {NODE_STATUS_TIMEOUT}s"
+            )
+        sleep(NODE_POLL_INTERVAL)
+        node.get(get_links=False)
+
+    # the only nodes we telnet to
+    if status == "started" and node.node_type == "docker":
+        wait_until_node_ready(node, time() + READY_TIMEOUT)
+
+
+def discard_telnet_sessions(node: gns3fy.Node):
+    """
+    Close any telnet sessions we have open to the node's ports.
+    """
+    if node.console is not None:
+        telnet.pool.discard(GNS3_SERVER_HOST, node.console)
+    if node.properties is not None and "aux" in node.properties:
+        telnet.pool.discard(GNS3_SERVER_HOST, node.properties["aux"])
 
 
 def reset_all(log=False):
@@ -73,6 +247,7 @@ def reset_all(log=False):
     configs.clear_frr_configs(log=log)
 
 
+@tracing.traced()
 def set_daemon_state_all(enabled: bool = True, log=False):
     """
     Enable the required daemons on each node.
@@ -85,40 +260,250 @@ def set_daemon_state_all(enabled: bool = True, log=False):
         verb = "enabling" if enabled else "disabling"
         logging.log(f"{verb} bgp and ospf daemons", "info")
 
-    for node in project.nodes:
-        if is_router(node):
+    running = "yes" if enabled else "no"
+    commands = [
+        f"sed -i 's/^{daemon}=.*/{daemon}={running}/g' {daemons_path}"
+        for daemon in optional_daemons
+    ]
+    routers = [node for node in get_project().nodes if is_router(node)]
+
+    def set_daemon_state(node: gns3fy.Node) -> bool:
+        """
+        Returns true if anything changed.
+        """
+        before = get_file_hash(node, daemons_path)
+        run_shell_commands(node, commands)
+        return get_file_hash(node, daemons_path) != before
+
+    results = run_on_nodes(routers, set_daemon_state, log=log)
+    changed = [result.node for result in results if result.result]
+
+    # FRR needs to be restarted for it to apply
+    if log:
+        logging.log(f"reloading FRR on {len(changed)} changed nodes to apply:", "info")
 
-            if log:
-                logging.log(f"    [cyan]{node.name}[/]", "info")
+    if enabled:
+        reload_frr(changed, running=optional_daemons, log=log)
+    else:
+        reload_frr(changed, stopped=optional_daemons, log=log)
 
-            running = "yes" if enabled else "no"
-            for daemon in ["bgpd", "ospfd", "bfdd"]:
-                run_shell_command(
-                    node,
-                    f"sed -i 's/^{daemon}=.*/{daemon}={running}/g' /etc/frr/daemons",
-                )
 
-    # they need to be restarted for it to apply
-    if log:
-        logging.log("restarting nodes to apply:", "info")
+@tracing.traced()
+def reload_frr(
+    routers: List[gns3fy.Node],
+    running: Optional[List[str]] = None,
+    stopped: Optional[List[str]] = None,
+    log=False,
+):
+    """
+    Restarts the FRR daemons inside each router's container with the init script, which
+    picks up changes to the daemons file and saved config without restarting the whole
+    node. Then checks zebra and `running` are running and `stopped` aren't.
 
-    stop_all(log=log)
-    start_all(log=log)
+    Routers where that fails get a full node restart instead.
+    """
+
+    def reload(node: gns3fy.Node) -> bool:
+        run_shell_command(node, f"{frr_init_script} restart")
+        return wait_for_daemons(node, ["zebra", *(running or [])], stopped or [])
 
+    try:
+        results = run_on_nodes(routers, reload, log=log)
+    except NodeError as error:
+        results = error.results
+    failed = [result.node for result in results if not result.result]
 
-def is_router(node: gns3fy.Node) -> bool:
-    return (
-        node.properties is not None
-        and "image" in node.properties
-        and node.properties["image"].startswith("frrouting")
+    if failed:
+        if log:
+            logging.log(
+                f"FRR didn't reload on {len(failed)} nodes, restarting them:", "error"
+            )
+        restart_nodes(failed, log=log)
+
+
+def wait_for_daemons(node: gns3fy.Node, running: List[str], stopped: List[str]) -> bool:
+    """
+    Polls the node's processes until the `running` daemons are and the `stopped` ones
+    aren't. Returns false if that doesn't happen within `FRR_RELOAD_TIMEOUT`.
+    """
+    deadline = time() + FRR_RELOAD_TIMEOUT
+    while True:
+        daemons = get_running_daemons(node)
+        if all(daemon in daemons for daemon in running) and not any(
+            daemon in daemons for daemon in stopped
+        ):
+            return True
+        if time() > deadline:
+            return False
+        sleep(NODE_POLL_INTERVAL)
+
+
+def get_running_daemons(node: gns3fy.Node) -> List[str]:
+    """
+    Returns the names of the FRR daemons running in the node, e.g. ["zebra", "bgpd"].
+    """
+    output = run_shell_command(node, "ps")
+    return re.findall(r"/usr/lib/frr/(\w+)", output)
+
+
+@tracing.traced()
+def wait_until_ready(
+    nodes: List[gns3fy.Node], timeout: Optional[float] = None, log=False
+):
+    """
+    Polls the nodes at the same time until they're all ready to be configured (see
+    `check_ready()`), backing off exponentially between checks of each node. Raises a
+    `NodeError` if any aren't within `timeout` (default `READY_TIMEOUT`) seconds.
+    """
+    start = time()
+    deadline = start + (READY_TIMEOUT if timeout is None else timeout)
+    # the only nodes we telnet to
+    docker_nodes = [node for node in nodes if node.node_type == "docker"]
+    run_on_nodes(
+        docker_nodes, lambda node: wait_until_node_ready(node, deadline), log=log
     )
 
+    if log:
+        logging.log(f"{len(docker_nodes)} nodes ready in {time() - start:.1f}s", "done")
+
+
+def wait_until_node_ready(node: gns3fy.Node, deadline: float):
+    """
+    Used by `wait_until_ready()`. Raises `TimeoutError` if the node isn't ready by
+    `deadline`.
+    """
+    if node.status != "started":
+        raise RuntimeError(f"{node.name} is {node.status}, start it first")
+    # we've no way of telling, and nothing can be sent to it anyway
+    if get_telnet_port(node) is None:
+        return
+
+    backoff = READY_INITIAL_BACKOFF
+    while True:
+        reason = check_ready(node)
+        if reason is None:
+            return
+        if time() + backoff > deadline:
+            raise TimeoutError(f"{node.name} isn't ready: {reason}")
+        sleep(backoff)
+        backoff = min(backoff * 2, READY_MAX_BACKOFF)
+
+
+def check_ready(node: gns3fy.Node) -> Optional[str]:
+    """
+    Returns None if the node is ready to be configured, otherwise why not.
+
+    Ready means the shell prompt comes back on its aux port and, for routers, vtysh
+    answers with every daemon enabled in the daemons file running.
+    """
+    router = is_router(node)
+    try:
+        output = run_shell_command(
+            node, f"grep =yes {daemons_path}" if router else "true"
+        )
+        # the prompt should be the last thing printed
+        if not output.rstrip().endswith("#"):
+            return "no shell prompt"
+        if not router:
+            return None
+        enabled = [
+            daemon
+            for daemon in re.findall(r"^(\w+)=yes", output, re.MULTILINE)
+            if daemon in frr_daemons
+        ]
+        output = run_shell_command(node, "vtysh -c 'show daemons'")
+    except (OSError, EOFError) as error:
+        return f"aux port not answering ({error})"
+
+    running = re.findall(r"\w+", output)
+    missing = [daemon for daemon in enabled if daemon not in running]
+    if missing:
+        return f"{', '.join(missing)} not running"
+    return None
+
+
+@dataclass
+class NodeResult:
+    """
+    The outcome of running something against a single node with `run_on_nodes()`.
+    """
+
+    node: gns3fy.Node
+    # whatever the function returned
+    result: Any = None
+    # set if the function raised instead
+    error: Optional[Exception] = None
+
+
+class NodeError(Exception):
+    """
+    Raised by `run_on_nodes()` once every node has finished, if any of them failed.
+    `results` has the outcome for every node, not just the failed ones.
+    """
+
+    def __init__(self, results: List[NodeResult]):
+        self.results = results
+        failed = [result for result in results if result.error is not None]
+        names = ", ".join(str(result.node.name) for result in failed)
+        super().__init__(f"{len(failed)} of {len(results)} nodes failed: {names}")
+
+
+def run_on_nodes(
+    nodes: List[gns3fy.Node],
+    function: Callable[[gns3fy.Node], Any],
+    log=False,
+    max_workers: Optional[int] = None,
+) -> List[NodeResult]:
+    """
+    Calls `function(node)` for every node, working on up to `max_workers` (default
+    `MAX_CONCURRENCY`) nodes at once. Use this to run telnet work across the whole lab
+    so it takes about as long as the slowest node instead of the sum of them all.
+
+    Results come back in the same order as `nodes`. Node names (and errors) are logged
+    in that order too, as each one finishes, so the output doesn't jump around.
+
+    A failing node doesn't stop the others. Once they've all finished a `NodeError` is
+    raised if any of them failed.
+    """
+    if max_workers is None:
+        max_workers = MAX_CONCURRENCY
+
+    results: List[NodeResult] = []
+    if not nodes:
+        return results
+
+    # the worker threads don't know what they're part of
+    parent = tracing.current()
+    phase = parent.name if parent is not None else None
+
+    def traced_function(node: gns3fy.Node):
+        with tracing.span(str(node.name), "node", phase=phase):
+            return function(node)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(traced_function, node) for node in nodes]
+        # wait in submission order so the log output is ordered
+        for node, future in zip(nodes, futures):
+            try:
+                results.append(NodeResult(node=node, result=future.result()))
+                if log:
+                    logging.log(f"    [cyan]{node.name}[/]", "info")
+            except Exception as error:
+                results.append(NodeResult(node=node, error=error))
+                if log:
+                    logging.log(f"    [cyan]{node.name}[/]: {error!r}", "error")
+
+    if any(result.error is not None for result in results):
+        raise NodeError(results)
+
+    return results
+
 
 def run_shell_command(
     node: gns3fy.Node,
     command: str,
     aux_port: bool = True,
-):
+) -> str:
     """
     Runs a command in the outer sh shell of the frr image. Exits back to sh before each
     so use `run_shell_commands()` to e.g write configs.
@@ -126,22 +511,33 @@ def run_shell_command(
     If aux_port is true it sends the command to the aux port which is what FRR requires.
     If false it sends it to the console port. I'm having issues with alpine - not sure
     whether it wants the console or aux port.
+
+    Returns everything printed while it ran. See `run_shell_commands()`.
     """
-    run_shell_commands(node, [command], aux_port)
+    return run_shell_commands(node, [command], aux_port)
 
 
 def run_shell_commands(
     node: gns3fy.Node,
     commands: List[str],
     aux_port: bool = True,
-):
+    stream: bool = True,
+) -> str:
     """
-    Runs multiple commands in the outer sh shell of the gns3 node.
+    Runs multiple commands in the outer sh shell of the gns3 node. Returns everything
+    that was printed while they ran, including the echoed commands and prompts.
 
     If aux_port is true it sends the command to the aux port which is what FRR requires.
     If false it sends it to the console port. I'm having issues with alpine - not sure
     whether it wants the console or aux port.
 
+    If stream is true the commands are sent back to back in batches and completion is
+    tracked by counting prompts (see `TelnetSession.stream()`). If that sees signs of
+    the interference described below, the commands it hadn't sent yet are run in the
+    careful mode: ctrl-c, command, wait for the prompt, sleep, one command at a time.
+    None are sent twice, as they aren't all safe to repeat. Set stream to false to
+    always use the careful mode.
+
     I was getting weird input errors. Happened intermittently before `conf t`. It shows
     up as `\\x07;5R` (so `\\x07;5Rconf t) if I read it which doesn't show up in google
     and doesn't look exactly like an ANSI code.
@@ -165,85 +561,139 @@ def run_shell_commands(
       - clearing the line before writing with ctrl-c
 
     """
-    if node is None or node.properties is None or node.console is None:
-        return
-    telnet_port: int = node.properties["aux"] if aux_port else node.console
+    telnet_port = get_telnet_port(node, aux_port)
+    if telnet_port is None:
+        return ""
     # print(aux_port, telnet_port)
-    prompt = b"# "
-    with Telnet(GNS3_SERVER_HOST, telnet_port, timeout=TELNET_TIMEOUT) as telnet:
-        # clear the active line (ctrl-c)
-        telnet.write(b"\x03")
-        # these are required, mainly the last one. closing the connection too early
-        telnet.read_until(prompt, timeout=TELNET_TIMEOUT)
-        # exit to the shell in case we're in vtysh, potentially in config mode.
-        telnet.write(b"end\n")
-        # stops it running
-        telnet.read_until(prompt, timeout=TELNET_TIMEOUT)
-        telnet.write(b"exit\n")
-        telnet.read_until(prompt, timeout=TELNET_TIMEOUT)
-
-        for command in commands:
-            command_line = command.strip().encode() + b"\n"
-            # send ctrl-c to clear the line to avoid the junk if a putty session is open
-            # to the same port (see docstring)
-            telnet.write(b"\x03")
-            result = telnet.read_until(prompt, timeout=TELNET_TIMEOUT)
-
-            telnet.write(command_line)
-            result = telnet.read_until(prompt, timeout=TELNET_TIMEOUT)
-
-            # # debug
-            # print(f"{node.name}: {str(result)}")
-            # if str(result).find("Unknown command") != -1:
-            #    rich.print("[bold red]error above[/]")
-
-            # try to fix the alpine node not always getting the last command
-            sleep(0.1)
+    # reuse the connection from earlier commands this run if there is one
+    session = telnet.pool.get(GNS3_SERVER_HOST, telnet_port, TELNET_TIMEOUT)
+    with session:
+        # try again on a fresh connection if the old one died, e.g. the node restarted
+        # since we last used it
+        for attempt in range(2):
+            try:
+                # get back to the outer shell. Cheap if we're already there
+                session.reset()
+                output = b""
+                remaining = commands
+
+                if stream:
+                    try:
+                        output = session.stream(commands)
+                        break
+                    except telnet.StreamError as error:
+                        if not error.interference:
+                            raise
+                        # something else is typing on this port. Carry on from where
+                        # it got to (which may be inside vtysh), the slow way
+                        stream = False
+                        output = error.output
+                        remaining = commands[error.completed :]
+                        session.drain()
+
+                for command in remaining:
+                    started = perf_counter()
+                    command_line = command.strip().encode() + b"\n"
+                    # send ctrl-c to clear the line to avoid the junk if a putty
+                    # session is open to the same port (see docstring)
+                    session.write(b"\x03")
+                    result = session.read_prompt()
+
+                    session.write(command_line)
+                    sent = perf_counter()
+                    result = session.read_prompt()
+                    metrics.observe("telnet prompt wait", perf_counter() - sent)
+                    output += result
+
+                    # # debug
+                    # print(f"{node.name}: {str(result)}")
+                    # if str(result).find("Unknown command") != -1:
+                    #    rich.print("[bold red]error above[/]")
+
+                    # try to fix the alpine node not always getting the last command
+                    sleep(0.1)
+                    tracing.record(
+                        command.strip(),
+                        "command",
+                        started,
+                        perf_counter(),
+                        port=telnet_port,
+                    )
+                break
+            except (EOFError, OSError):
+                session.close()
+                if attempt > 0:
+                    raise
+
+    return output.decode(errors="replace")
+
+
+def get_telnet_port(
+    node: Optional[gns3fy.Node], aux_port: bool = True
+) -> Optional[int]:
+    """
+    The port `run_shell_commands()` reaches the node on, or None if it doesn't have one,
+    e.g. a docker node set up without a console.
+    """
+    if node is None:
+        return None
+    if aux_port:
+        return (node.properties or {}).get("aux")
+    return node.console
 
 
-def escape_ansi_bytes(input: bytes):
+class ChecksumError(Exception):
     """
-    https://stackoverflow.com/questions/14693701/how-can-i-remove-the-ansi-escape-sequences-from-a-string-in-python#14693789
+    Raised by `write_file()` when the file on the node doesn't match what we sent.
     """
-    # 7-bit and 8-bit C1 ANSI sequences
-    ansi_escape_8bit = re.compile(
-        rb"(?:\x1B[@-Z\\-_]|[\x80-\x9A\x9C-\x9F]|(?:\x1B\[|\x9B)[0-?]*[ -/]*[@-~])"
-    )
-    return ansi_escape_8bit.sub(b"", input)
 
 
-def is_asn1_internal_link(link: gns3fy.Link) -> bool:
+def write_file(node: gns3fy.Node, path: str, contents: str, aux_port: bool = True):
     """
-    Returns True if both nodes connected to the link are asn1 nodes.
+    Writes `contents` to `path` inside the node in a single batch of shell commands,
+    then checks it arrived intact with sha256sum.
+
+    The file is sent as base64 in chunks appended to a temporary file so quoting and
+    line endings can't mangle it, then decoded into place. Raises `ChecksumError` if the
+    sha256 on the node doesn't match.
     """
+    data = contents.encode()
+    encoded = base64.b64encode(data).decode()
+    encoded_path = f"{path}.b64"
 
-    if link and link.nodes and link.nodes[0] and link.nodes[1]:
-        node0 = project.get_node(node_id=link.nodes[0]["node_id"])
-        node1 = project.get_node(node_id=link.nodes[1]["node_id"])
-        if (
-            node0
-            and node1
-            and node0.name
-            and node1.name
-            and node0.name.startswith("asn1")
-            and node1.name.startswith("asn1")
-        ):
-            return True
+    commands = [f"rm -f {encoded_path}"]
+    for start in range(0, len(encoded), WRITE_FILE_CHUNK_SIZE):
+        chunk = encoded[start : start + WRITE_FILE_CHUNK_SIZE]
+        commands.append(f"echo '{chunk}' >> {encoded_path}")
+    commands.append(f"base64 -d {encoded_path} > {path}")
+    commands.append(f"rm -f {encoded_path}")
+    commands.append(f"sha256sum {path}")
+
+    output = run_shell_commands(node, commands, aux_port)
 
-    # else
-    return False
+    expected = hashlib.sha256(data).hexdigest()
+    if f"{expected}  {path}" not in output:
+        raise ChecksumError(f"{path} on {node.name} doesn't match what was sent")
 
 
-def get_asn(node_name: str) -> Optional[int]:
+def get_file_hash(node: gns3fy.Node, path: str, aux_port: bool = True) -> Optional[str]:
     """
-    Returns the AS number of the device via name if it has one, otherwise None.
+    Returns the sha256 of a file inside the node, or None if it doesn't exist.
     """
-    match = re.match(r"asn(\d+)", node_name)
-    if match and match.group(1):
-        return int(match.group(1))
+    output = run_shell_command(node, f"sha256sum {path}", aux_port)
+    match = re.search(rf"\b([0-9a-f]{{64}})  {re.escape(path)}", output)
+    return match.group(1) if match else None
 
-    # else
-    return None
+
+def escape_ansi_bytes(input: bytes):
+    """
+    https://stackoverflow.com/questions/14693701/how-can-i-remove-the-ansi-escape-sequences-from-a-string-in-python#14693789
+    """
+    # 7-bit and 8-bit C1 ANSI sequences
+    ansi_escape_8bit = re.compile(
+        rb"(?:\x1B[@-Z\\-_]|[\x80-\x9A\x9C-\x9F]|(?:\x1B\[|\x9B)[0-?]*[ -/]*[@-~])"
+    )
+    return ansi_escape_8bit.sub(b"", input)
 
 
 @dataclass
@@ -252,7 +702,7 @@ class NeighboringBorderRouterInfo:
     Data representing a border router directly connected to a node, it's AS number and
     the IP of the interface facing the node.
 
-    Used as a return of get_neighboring_border_routers() for better structure.
+    Used as a return of get_all_neighboring_border_routers_info() for better structure.
     """
 
     # asn of the neighboring router.
@@ -261,72 +711,69 @@ class NeighboringBorderRouterInfo:
     name: str
     # IP of the interface facing the target node. No prefix length.
     ip: str
+    # set for iBGP over loopbacks: the interface to send from
+    update_source: Optional[str] = None
+    # BFD only works for directly connected peers here
+    bfd: bool = True
+    # set on route reflectors for their clients
+    route_reflector_client: bool = False
 
 
-def get_neighboring_border_routers_info(
-    node: gns3fy.Node,
+@tracing.traced()
+def get_all_neighboring_border_routers_info(
     interface_ips: Optional[Dict[str, Dict[str, str]]] = None,
-) -> List[NeighboringBorderRouterInfo]:
+) -> Dict[str, List[NeighboringBorderRouterInfo]]:
     """
-    Returns details of the border and CPE routers directly connected to the given node, and
-    their links facing the given node.
+    Returns details of the border and CPE routers directly connected to each node, and
+    their links facing it, in a single pass over each node's links (see
+    `topology.Topology.endpoints()`).
 
     Args:
-        node (gns3fy.Node): The node to get neighboring border routers of.
-
         interface_ips (Dict[str, Dict[str, str]]): The output of
-        `addressing.get_interface_ips()`. If given we don't have to generate it each
-        call.
+        `addressing.get_interface_ips()`. If given we don't have to generate it.
 
     Returns:
-        List[NeighboringBorderRouterInfo]: Info on the neighboring border routers.
+        Dict[str, List[NeighboringBorderRouterInfo]]: node names mapped to info on their
+        neighboring border routers. Nodes without any aren't included.
     """
     # retrieve if not given
     if interface_ips is None:
         interface_ips = addressing.get_interface_ips()
 
-    # get neighboring device names and the name of their link facing us
-    neighboring_nodes: Dict[str, str] = {}
-    # populate
-    node.get_links()
-    # connected links
-    for node_link in node.links:
-        if node_link.nodes is None:
-            continue
-        # nodes on those links including us
-        for link_node_info in node_link.nodes:
-            # not us
-            if link_node_info["node_id"] != node.node_id:
-                neighboring_node = project.get_node(node_id=link_node_info["node_id"])
-                if (
-                    neighboring_node is not None
-                    and neighboring_node.ports is not None
-                    and neighboring_node.name is not None
-                ):
-                    port_number = link_node_info["adapter_number"]
-                    port_name = neighboring_node.ports[port_number]["name"]
-                    neighboring_nodes[neighboring_node.name] = port_name
-
-    # retrieve the info of border devices
-    return_list: List[NeighboringBorderRouterInfo] = []
-    for neighboring_node_name, interface_name in neighboring_nodes.items():
-        # if they're a border router
-        if neighboring_node_name and (
-            neighboring_node_name.find("border") != -1
-            or neighboring_node_name.find("cpe") != -1
-        ):
-            asn = get_asn(neighboring_node_name)
+    project_topology = topology.get_topology()
+    router_roles = roles.get_roles(project_topology)
 
-            ip_cidr = interface_ips[neighboring_node_name][interface_name]
+    # node name: neighboring border router name: their info. Only one entry per
+    # neighbor even if there are multiple links to it
+    neighbors: Dict[str, Dict[str, NeighboringBorderRouterInfo]] = {}
+    for node in project_topology.nodes:
+        for endpoint in project_topology.endpoints(node.node_id):
+            neighbor = project_topology.get_node(node_id=endpoint.peer_node_id)
+            if neighbor is None:
+                continue
+            # only routers that run BGP
+            if neighbor.name not in router_roles or not router_roles[neighbor.name].bgp:
+                continue
+            asn = project_topology.asns[neighbor.node_id]
+            interface_name = endpoint.peer_port_name
+            if asn is None or interface_name is None:
+                continue
+
+            # e.g. an external port with no address in settings
+            ip_cidr = interface_ips.get(neighbor.name, {}).get(interface_name)
+            if ip_cidr is None:
+                continue
             ip = ip_cidr.split("/")[0]
+            neighbors.setdefault(node.name, {})[
+                neighbor.name
+            ] = NeighboringBorderRouterInfo(asn=asn, name=neighbor.name, ip=ip)
+
+    return {name: list(infos.values()) for name, infos in neighbors.items()}
 
-            if asn is not None and ip is not None:
-                info = NeighboringBorderRouterInfo(
-                    asn=asn, name=neighboring_node_name, ip=ip
-                )
-                return_list.append(info)
 
-    return return_list
+# link end label styles. `show_interface_ips()` greys them out a bit
+ip_label_style = "'font-family: TypeWriter;font-size: 10.0;font-weight: bold;fill: #444444;fill-opacity: 1.0;'"
+default_label_style = "'font-family: TypeWriter;font-size: 10.0;font-weight: bold;fill: #000000;fill-opacity: 1.0;'"
 
 
 def show_interface_ips(log=False):
@@ -340,31 +787,13 @@ def show_interface_ips(log=False):
 
     interface_ips = addressing.get_interface_ips()
 
-    for link in project.links:
-        if link.nodes is None:
-            continue
+    def get_label(node_name: str, interface_name: str) -> Optional[Tuple[str, str]]:
+        if interface_name not in interface_ips.get(node_name, {}):
+            return None
+        interface_ip = interface_ips[node_name][interface_name].split("/")[0]
+        return f"{interface_name}\n{interface_ip}", ip_label_style
 
-        for link_node in link.nodes:
-            node = project.get_node(node_id=link_node["node_id"])
-            if node is None or node.name is None or node.ports is None:
-                continue
-
-            interface_name = node.ports[link_node["adapter_number"]]["name"]
-            if (
-                node.name not in interface_ips
-                or interface_name not in interface_ips[node.name]
-            ):
-                continue
-            interface_ip_cidr = interface_ips[node.name][interface_name]
-            interface_ip = interface_ip_cidr.split("/")[0]
-
-            new_label_text = f"{interface_name}\n{interface_ip}"
-            new_label_style = "'font-family: TypeWriter;font-size: 10.0;font-weight: bold;fill: #444444;fill-opacity: 1.0;'"
-
-            link_node["label"]["text"] = new_label_text
-            link_node["label"]["style"] = new_label_style
-
-        link.update(nodes=link.nodes)
+    update_link_labels(get_label, log=log)
 
 
 def reset_interface_ip_labels(log=False):
@@ -375,21 +804,67 @@ def reset_interface_ip_labels(log=False):
     if log:
         logging.log("resetting interface labels", "info")
 
-    for link in project.links:
+    update_link_labels(
+        lambda node_name, interface_name: (interface_name, default_label_style),
+        log=log,
+    )
+
+
+@tracing.traced()
+def update_link_labels(
+    get_label: Callable[[str, str], Optional[Tuple[str, str]]], log=False
+) -> int:
+    """
+    Set the label of each link end to what `get_label(node name, interface name)`
+    returns as (text, style), or leave it if that's None.
+
+    Only links with a label that's actually different are sent, at the same time.
+    Returns how many were.
+    """
+    start = time()
+    project_topology = topology.get_topology()
+
+    changed_links: List[gns3fy.Link] = []
+    for link in get_project().links:
         if link.nodes is None:
             continue
 
+        changed = False
         for link_node in link.nodes:
-            node = project.get_node(node_id=link_node["node_id"])
-            if node is None or node.name is None or node.ports is None:
+            node = project_topology.get_node(node_id=link_node["node_id"])
+            interface_name = project_topology.port_name(
+                link_node["node_id"], link_node["adapter_number"]
+            )
+            if node is None or interface_name is None:
+                continue
+            label = get_label(node.name, interface_name)
+            if label is None:
                 continue
 
-            interface_name = node.ports[link_node["adapter_number"]]["name"]
+            new_label_text, new_label_style = label
+            current_label = link_node.setdefault("label", {})
+            if (
+                current_label.get("text") != new_label_text
+                or current_label.get("style") != new_label_style
+            ):
+                current_label["text"] = new_label_text
+                current_label["style"] = new_label_style
+                changed = True
 
-            new_label_text = f"{interface_name}"
-            new_label_style = "'font-family: TypeWriter;font-size: 10.0;font-weight: bold;fill: #000000;fill-opacity: 1.0;'"
+        if changed:
+            changed_links.append(link)
 
-            link_node["label"]["text"] = new_label_text
-            link_node["label"]["style"] = new_label_style
+    if changed_links:
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+            # list() to raise any errors
+            list(
+                executor.map(lambda link: link.update(nodes=link.nodes), changed_links)
+            )
 
-        link.update(nodes=link.nodes)
+    if log:
+        logging.log(
+            f"updated {len(changed_links)} of {len(get_project().links)} links in "
+            f"{time() - start:.1f}s",
+            "info",
+        )
+    return len(changed_links)
@@ -0,0 +1,150 @@
+import json
+from pathlib import Path
+import re
+import threading
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+# upper bounds of the latency histogram buckets, in seconds. Anything slower goes in a
+# last, unbounded one
+latency_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+# GNS3 project, node and link IDs. Replaced in endpoints so requests for different
+# nodes count together
+id_pattern = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+class Histogram:
+    """
+    How many observations of a duration fell in each of `latency_buckets`, plus their
+    count, total and max.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(latency_buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        index = next(
+            (index for index, bound in enumerate(latency_buckets) if seconds <= bound),
+            len(latency_buckets),
+        )
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        bounds: List[str] = [f"<={bound:g}s" for bound in latency_buckets] + [
+            f">{latency_buckets[-1]:g}s"
+        ]
+        return {
+            "count": self.count,
+            "total": round(self.total, 6),
+            "max": round(self.max, 6),
+            "buckets": dict(zip(bounds, self.buckets)),
+        }
+
+
+# everything recorded this run, by name. Shared by all threads
+counters: Dict[str, int] = {}
+histograms: Dict[str, Histogram] = {}
+_lock = threading.Lock()
+
+
+def count(name: str, amount: int = 1):
+    with _lock:
+        counters[name] = counters.get(name, 0) + amount
+
+
+def observe(name: str, seconds: float):
+    """
+    Add a duration to the named histogram.
+    """
+    with _lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+
+def reset():
+    with _lock:
+        counters.clear()
+        histograms.clear()
+
+
+def get_endpoint(url: str) -> str:
+    """
+    The path of a GNS3 API URL with the IDs taken out, e.g.
+    `/v2/projects/{id}/nodes/{id}/start`.
+    """
+    return id_pattern.sub("{id}", urlparse(url).path)
+
+
+def record_http(response, *args, **kwargs):
+    """
+    A requests response hook that times each request by endpoint. See
+    `gns3.get_project()`.
+    """
+    request = response.request
+    observe(
+        f"http {request.method} {get_endpoint(request.url)}",
+        response.elapsed.total_seconds(),
+    )
+    if response.status_code >= 400:
+        count("http errors")
+
+
+def to_dict() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "counters": dict(sorted(counters.items())),
+            "histograms": {
+                name: histogram.to_dict()
+                for name, histogram in sorted(histograms.items())
+            },
+        }
+
+
+def write(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(to_dict(), indent=4))
+
+
+def print_summary(telnet_timeout: Optional[float] = None):
+    """
+    Print everything recorded this run, if anything was. Timeouts are called out, as
+    each one is a stall of up to telnet_timeout seconds.
+    """
+    from rich import print
+    from rich.table import Table
+
+    recorded = to_dict()
+    if not recorded["counters"] and not recorded["histograms"]:
+        return
+
+    table = Table(title="I/O this run")
+    table.add_column("name")
+    table.add_column("count", justify="right")
+    table.add_column("total", justify="right")
+    table.add_column("mean", justify="right")
+    table.add_column("max", justify="right")
+    for name, histogram in recorded["histograms"].items():
+        table.add_row(
+            name,
+            str(histogram["count"]),
+            f"{histogram['total']:.3f}s",
+            f"{histogram['total'] / histogram['count'] * 1000:.1f}ms",
+            f"{histogram['max'] * 1000:.1f}ms",
+        )
+    for name, value in recorded["counters"].items():
+        table.add_row(name, str(value), "", "", "")
+    print(table)
+
+    timeouts = recorded["counters"].get("telnet read timeouts", 0)
+    if timeouts:
+        stall = f", up to {timeouts * telnet_timeout:g}s" if telnet_timeout else ""
+        print(f"[bold red]{timeouts} telnet reads timed out waiting{stall}[/]")
@@ -0,0 +1,243 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+import settings
+from gns3_bgp_frr import topology
+
+# optional settings, with the defaults for settings.py files from before they existed.
+# See settings.example.py
+IBGP_MODE: str = getattr(settings, "IBGP_MODE", "full-mesh")
+ROUTE_REFLECTORS: Dict[int, List[str]] = getattr(settings, "ROUTE_REFLECTORS", {})
+ROUTE_REFLECTOR_COUNT: int = getattr(settings, "ROUTE_REFLECTOR_COUNT", 2)
+
+ibgp_modes = ("full-mesh", "route-reflector")
+
+# the interface loopback addresses go on. See `RouterRole.loopback`
+loopback_port = "lo"
+
+# node types that are the network outside the lab
+external_node_types = ("cloud", "nat")
+# node types that just pass traffic through, so whatever's behind them counts
+switch_node_types = ("ethernet_switch", "ethernet_hub")
+
+
+@dataclass
+class RouterRole:
+    """
+    What a router does, worked out from what it's linked to. See `infer_roles()`.
+    """
+
+    name: str
+    asn: Optional[int]
+    # its ports by what's at the other end, in port order.
+    # a router in the same AS
+    internal_ports: List[str] = field(default_factory=list)
+    # a router in another AS, or one without an AS
+    border_ports: List[str] = field(default_factory=list)
+    # the network outside the lab: a cloud or NAT node, directly or through switches
+    external_ports: List[str] = field(default_factory=list)
+    # anything else, e.g. hosts like alpine-1
+    host_ports: List[str] = field(default_factory=list)
+    # whether its AS runs OSPF, which it does if it has any internal routers
+    ospf: bool = False
+    # in route reflector mode, whether it reflects iBGP routes for the rest of its AS
+    route_reflector: bool = False
+    # whether it needs a loopback address: in route reflector mode iBGP peers with
+    # those instead of every OSPF interface
+    loopback: bool = False
+
+    @property
+    def kind(self) -> str:
+        """
+        "border" if it's linked outside its AS, "internal" if it's only linked to
+        routers in it, "cpe" if it has hosts behind it, otherwise "other".
+        """
+        if self.border_ports or self.external_ports:
+            return "border"
+        if self.host_ports:
+            return "cpe"
+        if self.internal_ports:
+            return "internal"
+        return "other"
+
+    @property
+    def bgp(self) -> bool:
+        """
+        Everything runs BGP except internal routers, which OSPF covers.
+        """
+        return self.kind != "internal"
+
+    @property
+    def ospf_interfaces(self) -> List[str]:
+        """
+        The ports that form OSPF adjacencies.
+        """
+        return self.internal_ports if self.ospf else []
+
+
+# node name: role, for each router
+Roles = Dict[str, RouterRole]
+
+# (topology revision and iBGP settings, roles) for this run
+_roles: Optional[Tuple[str, Roles]] = None
+
+
+def get_roles(project_topology: Optional[topology.Topology] = None) -> Roles:
+    """
+    Returns the role of each router in the topology (by default the one for this run),
+    worked out at most once per topology. Don't modify the result, it's shared.
+    """
+    global _roles
+    if project_topology is None:
+        project_topology = topology.get_topology()
+    key = f"{project_topology.revision} {IBGP_MODE} {ROUTE_REFLECTORS} "
+    key += str(ROUTE_REFLECTOR_COUNT)
+    if _roles is None or _roles[0] != key:
+        _roles = (key, infer_roles(project_topology))
+    return _roles[1]
+
+
+def infer_roles(project_topology: topology.Topology) -> Roles:
+    """
+    Does the work for `get_roles()`, in a single pass over each router's links (see
+    `Topology.endpoints()`) after finding which switches lead outside the lab.
+    """
+    if IBGP_MODE not in ibgp_modes:
+        raise ValueError(
+            f"IBGP_MODE must be one of {', '.join(ibgp_modes)}, not {IBGP_MODE}"
+        )
+
+    external_nodes = get_external_nodes(project_topology)
+    roles: Roles = {
+        node.name: RouterRole(name=node.name, asn=project_topology.asns[node.node_id])
+        # sorted so get_ibgp_peers() doesn't have to
+        for node in sorted(project_topology.nodes, key=lambda node: node.name)
+        if project_topology.is_router(node.node_id)
+    }
+
+    for node in project_topology.nodes:
+        if node.name not in roles:
+            continue
+        role = roles[node.name]
+        for endpoint in project_topology.endpoints(node.node_id):
+            peer_node = project_topology.get_node(node_id=endpoint.peer_node_id)
+            if peer_node is None:
+                continue
+            port_name = endpoint.port_name
+            if project_topology.is_router(peer_node.node_id):
+                peer_asn = project_topology.asns[peer_node.node_id]
+                if role.asn is not None and peer_asn == role.asn:
+                    role.internal_ports.append(port_name)
+                else:
+                    role.border_ports.append(port_name)
+            elif peer_node.node_id in external_nodes:
+                role.external_ports.append(port_name)
+            else:
+                role.host_ports.append(port_name)
+
+    ospf_asns = {role.asn for role in roles.values() if role.kind == "internal"}
+    for node_name, role in roles.items():
+        role.ospf = role.asn in ospf_asns
+        # the order links were made in doesn't matter, ports do
+        order = get_port_order(project_topology, node_name)
+        for ports in (
+            role.internal_ports,
+            role.border_ports,
+            role.external_ports,
+            role.host_ports,
+        ):
+            ports.sort(key=lambda port: order.get(port, len(order)))
+
+    if IBGP_MODE == "route-reflector":
+        for asn in ospf_asns:
+            for name in choose_route_reflectors(roles, asn):
+                roles[name].route_reflector = True
+        for role in roles.values():
+            role.loopback = role.ospf and role.bgp
+
+    return roles
+
+
+def choose_route_reflectors(roles: Roles, asn: Optional[int]) -> List[str]:
+    """
+    Returns the names of an AS's route reflectors: the ones in ROUTE_REFLECTORS if it
+    has any there, otherwise the ROUTE_REFLECTOR_COUNT BGP routers with the most links
+    inside the AS (and so the most paths to the rest of it).
+    """
+    candidates = [role for role in roles.values() if role.asn == asn and role.bgp]
+    if asn in ROUTE_REFLECTORS:
+        chosen = set(ROUTE_REFLECTORS[asn])
+        configured = [role.name for role in candidates if role.name in chosen]
+        if configured:
+            return configured
+    # stable sort, so ties go by name
+    candidates.sort(key=lambda role: len(role.internal_ports), reverse=True)
+    return [role.name for role in candidates[:ROUTE_REFLECTOR_COUNT]]
+
+
+def get_external_nodes(project_topology: topology.Topology) -> Set[str]:
+    """
+    Returns the IDs of the cloud and NAT nodes, and the switches connected to them
+    (directly or through other switches).
+    """
+    external = {
+        node.node_id
+        for node in project_topology.nodes
+        if node.node_type in external_node_types
+    }
+    switches = {
+        node.node_id
+        for node in project_topology.nodes
+        if node.node_type in switch_node_types
+    }
+    # switch ID: IDs of the nodes it's linked to. Not `Topology.endpoints()`, which
+    # skips ends without port names, and switches and clouds don't always have them
+    neighbors: Dict[str, List[str]] = {node_id: [] for node_id in switches}
+    for link in project_topology.links:
+        if len(link.nodes) != 2:
+            continue
+        first, second = (end["node_id"] for end in link.nodes)
+        if first in switches:
+            neighbors[first].append(second)
+        if second in switches:
+            neighbors[second].append(first)
+
+    # spread out from the clouds through the switches
+    pending = [node_id for node_id in switches if external & set(neighbors[node_id])]
+    external.update(pending)
+    while pending:
+        for neighbor_id in neighbors[pending.pop()]:
+            if neighbor_id in switches and neighbor_id not in external:
+                external.add(neighbor_id)
+                pending.append(neighbor_id)
+    return external
+
+
+def get_port_order(
+    project_topology: topology.Topology, node_name: str
+) -> Dict[str, int]:
+    node = project_topology.get_node(name=node_name)
+    if node is None:
+        return {}
+    return {port["name"]: index for index, port in enumerate(node.ports)}
+
+
+def get_ibgp_peers(roles: Roles, node_name: str) -> List[RouterRole]:
+    """
+    The routers a router forms iBGP sessions with over its AS's OSPF network, if it
+    runs OSPF. Sorted by name.
+
+    In full mesh mode that's the other BGP routers in the same AS. In route reflector
+    mode route reflectors still peer with all of them (the rest as clients) but the
+    rest only peer with the route reflectors.
+    """
+    role = roles[node_name]
+    if not role.ospf or not role.bgp:
+        return []
+    return [
+        other
+        for other in roles.values()
+        if other.name != node_name
+        and other.asn == role.asn
+        and other.bgp
+        and (IBGP_MODE == "full-mesh" or role.route_reflector or other.route_reflector)
+    ]
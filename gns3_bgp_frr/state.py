@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+
+def content_hash(content: str) -> str:
+    """
+    sha256 of a string, as hex. Matches what `sha256sum` prints for the same file.
+    """
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class AppliedState:
+    """
+    Remembers what was last successfully applied to each node, so unchanged nodes can be
+    skipped next time. Stored as JSON at `path`:
+
+        {
+            node.name: {
+                "node_id": the node's GNS3 id, so a re-imported project doesn't match,
+                "config_hash": content_hash() of what we generated and applied,
+                "remote_hash": sha256 of the file the node saved it to, to spot drift,
+            }
+        }
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Optional[str]]] = {}
+        if path.exists():
+            try:
+                self.entries = json.loads(path.read_text())
+            except ValueError:
+                # corrupt or half written. Treat everything as changed
+                self.entries = {}
+
+    def is_unchanged(self, node_name: str, node_id: str, config_hash: str) -> bool:
+        """
+        True if `config_hash` is what was last applied to this exact node.
+        """
+        entry = self.entries.get(node_name)
+        return (
+            entry is not None
+            and entry.get("node_id") == node_id
+            and entry.get("config_hash") == config_hash
+        )
+
+    def remote_hash(self, node_name: str) -> Optional[str]:
+        entry = self.entries.get(node_name)
+        return entry.get("remote_hash") if entry else None
+
+    def record(
+        self,
+        node_name: str,
+        node_id: str,
+        config_hash: str,
+        remote_hash: Optional[str],
+    ):
+        self.entries[node_name] = {
+            "node_id": node_id,
+            "config_hash": config_hash,
+            "remote_hash": remote_hash,
+        }
+
+    def forget(self, node_name: str):
+        self.entries.pop(node_name, None)
+
+    def save(self):
+        """
+        Write the state out atomically so an interrupted run can't leave it corrupt.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        temp_path.write_text(json.dumps(self.entries, indent=4, sort_keys=True))
+        os.replace(temp_path, self.path)
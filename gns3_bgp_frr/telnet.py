@@ -0,0 +1,296 @@
+import atexit
+import re
+import threading
+from telnetlib import Telnet
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple
+from gns3_bgp_frr import metrics, tracing
+
+# sh and vtysh prompts both end with this
+PROMPT = b"# "
+
+# the outer sh prompt is the working directory, e.g. `/ # `. vtysh prompts are the
+# hostname, e.g. `asn1border1# ` or `asn1border1(config-router)# `
+shell_prompt_pattern = re.compile(rb"(?:^|\n)[^\n]*[/~][^\s#]* # $")
+# a line that's nothing but one of the prompts above
+prompt_line_pattern = re.compile(rb"\r*(?:[/~][^\s#]* |[\w.-]+(?:\([\w-]+\))?)# ")
+
+# the ASCII bell and cursor position reports, e.g. `\x07;5R`. These show up when
+# another client, like a GNS3 PuTTY window, is connected to the same port and answers
+# terminal queries. See `gns3.run_shell_commands()`.
+interference_pattern = re.compile(rb"\x07|\x1b\[[\d;]*R|;\d+R")
+
+# how much `stream()` sends before waiting for the prompts to come back. Keeps us well
+# under the 4 KiB tty input buffer
+STREAM_BATCH_LINES = 32
+STREAM_BATCH_BYTES = 1024
+# how long `stream()` waits for each command's prompt. Some legitimately take much
+# longer than the telnet timeout, e.g. `frrinit.sh restart` or `vtysh -f` with a big
+# config
+STREAM_COMMAND_TIMEOUT = 120
+
+
+class StreamError(Exception):
+    """
+    Raised by `TelnetSession.stream()` when something else is typing on the port or a
+    prompt never came back.
+
+    `completed` is how many of the commands had their prompt come back, all of which
+    ran, and `output` is everything printed by them. If `interference` is true the
+    session is at a prompt after the last of those, so the rest can be sent from there.
+    """
+
+    def __init__(self, message: str, output: bytes, completed: int, interference: bool):
+        super().__init__(message)
+        self.output = output
+        self.completed = completed
+        self.interference = interference
+
+
+class TelnetSession:
+    """
+    A telnet connection to a single node port that stays open between commands.
+
+    Get one from `pool.get()` rather than creating it directly, and hold it with `with
+    session:` while using it so concurrent callers don't interleave their commands.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.telnet: Optional[Telnet] = None
+        # True when the last prompt we saw was the outer sh prompt
+        self.at_shell = False
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> "TelnetSession":
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.lock.release()
+
+    def is_alive(self) -> bool:
+        """
+        Cheap local check that the connection is still open. Doesn't send anything.
+        """
+        if self.telnet is None or self.telnet.get_socket() is None:
+            return False
+        try:
+            # raises EOFError if the other side has closed, e.g. the node restarted
+            self.telnet.read_very_eager()
+        except (EOFError, OSError):
+            return False
+        return True
+
+    def connect(self):
+        """
+        (Re)open the connection if it isn't alive. The session state is unknown
+        afterwards so the next `reset()` does the full handshake.
+        """
+        if self.is_alive():
+            return
+        self.close()
+        started = perf_counter()
+        self.telnet = Telnet(self.host, self.port, timeout=self.timeout)
+        metrics.observe("telnet connect", perf_counter() - started)
+        self.at_shell = False
+
+    def close(self):
+        if self.telnet is not None:
+            try:
+                self.telnet.close()
+            except OSError:
+                pass
+        self.telnet = None
+        self.at_shell = False
+
+    def write(self, data: bytes):
+        assert self.telnet is not None
+        self.telnet.write(data)
+        metrics.count("telnet bytes sent", len(data))
+
+    def read_until(
+        self, match: bytes = PROMPT, timeout: Optional[float] = None
+    ) -> bytes:
+        """
+        `Telnet.read_until()` that also tracks whether we've ended up at the shell.
+        """
+        assert self.telnet is not None
+        result = self.telnet.read_until(
+            match, timeout=self.timeout if timeout is None else timeout
+        )
+        metrics.count("telnet bytes received", len(result))
+        if not result.endswith(match):
+            metrics.count("telnet read timeouts")
+        if result.endswith(PROMPT):
+            self.at_shell = shell_prompt_pattern.search(result) is not None
+        return result
+
+    def read_prompt(self, timeout: Optional[float] = None) -> bytes:
+        """
+        Read until a line that's just a prompt, skipping any `# ` inside echoed commands
+        or their output. If that takes more than timeout seconds (default the session's)
+        the result won't end with `PROMPT`.
+        """
+        deadline = perf_counter() + (self.timeout if timeout is None else timeout)
+        output = b""
+        while True:
+            result = self.read_until(PROMPT, max(0.0, deadline - perf_counter()))
+            output += result
+            if not result.endswith(PROMPT):
+                return output
+            last_line = output[output.rfind(b"\n") + 1 :]
+            if prompt_line_pattern.fullmatch(last_line):
+                return output
+
+    def drain(self, quiet: float = 0.3):
+        """
+        Throw away output until the port has been quiet for `quiet` seconds, e.g. the
+        rest of a batch after `stream()` gave up on it.
+        """
+        assert self.telnet is not None
+        for _ in range(int(self.timeout / quiet) + 1):
+            # nothing will match this so it reads for the whole timeout
+            if not self.telnet.read_until(b"\x00\x00", timeout=quiet):
+                break
+
+    def reset(self):
+        """
+        Get back to a clear line at the outer sh prompt.
+
+        If we were already there (e.g. the last user of the session finished in sh) this
+        costs a single ctrl-c round trip. Otherwise, or on a fresh connection, exit out of
+        vtysh and any config mode first.
+        """
+        self.connect()
+
+        # clear the active line (ctrl-c) and see where we are
+        self.write(b"\x03")
+        self.read_prompt()
+        if self.at_shell:
+            return
+
+        # exit to the shell in case we're in vtysh, potentially in config mode.
+        self.write(b"end\n")
+        # stops it running
+        self.read_prompt()
+        self.write(b"exit\n")
+        self.read_prompt()
+        self.at_shell = True
+
+    def stream(self, commands: List[str]) -> bytes:
+        """
+        Send commands back to back in batches, without waiting for a prompt between
+        each one, and return everything that was printed.
+
+        Completion is tracked by counting the prompts that come back: one per command,
+        waiting up to `STREAM_COMMAND_TIMEOUT` for each. Raises `StreamError` if one
+        doesn't come back, or after the batch with signs of another client on the same
+        port. It says how far it got so nothing has to be sent twice.
+        """
+        output = b""
+        completed = 0
+        for batch in _batches(
+            [command.strip().encode() + b"\n" for command in commands]
+        ):
+            # each command's span runs from when it could start, i.e. the previous
+            # prompt, to its own prompt
+            started = perf_counter()
+            self.write(b"".join(batch))
+            interference = False
+            for line in batch:
+                result = self.read_prompt(STREAM_COMMAND_TIMEOUT)
+                finished = perf_counter()
+                metrics.observe("telnet prompt wait", finished - started)
+                tracing.record(
+                    line.decode(errors="replace").strip(),
+                    "command",
+                    started,
+                    finished,
+                    port=self.port,
+                )
+                started = finished
+                output += result
+                if not result.endswith(PROMPT):
+                    raise StreamError(
+                        f"timed out waiting for a prompt on {self.port}",
+                        output,
+                        completed,
+                        interference=False,
+                    )
+                completed += 1
+                # the rest of the batch has been sent, so see it through first
+                if interference_pattern.search(result):
+                    interference = True
+            if interference:
+                raise StreamError(
+                    f"interference on port {self.port}",
+                    output,
+                    completed,
+                    interference=True,
+                )
+        return output
+
+
+def _batches(lines: List[bytes]) -> Iterator[List[bytes]]:
+    """
+    Split lines up into batches of at most `STREAM_BATCH_LINES` lines and (unless a
+    single line is longer) `STREAM_BATCH_BYTES` bytes.
+    """
+    batch: List[bytes] = []
+    size = 0
+    for line in lines:
+        if batch and (
+            len(batch) >= STREAM_BATCH_LINES or size + len(line) > STREAM_BATCH_BYTES
+        ):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(line)
+        size += len(line)
+    if batch:
+        yield batch
+
+
+class TelnetSessionPool:
+    """
+    Keeps one `TelnetSession` per (host, port) open for the whole `manage.py` run,
+    including chained subcommands, so the connection handshake is paid once per node.
+    """
+
+    def __init__(self):
+        self.sessions: Dict[Tuple[str, int], TelnetSession] = {}
+        self.lock = threading.Lock()
+
+    def get(self, host: str, port: int, timeout: float) -> TelnetSession:
+        with self.lock:
+            session = self.sessions.get((host, port))
+            if session is None:
+                session = TelnetSession(host, port, timeout)
+                self.sessions[(host, port)] = session
+            return session
+
+    def discard(self, host: str, port: int):
+        """
+        Close the session to a port, e.g. because the node is being stopped.
+        """
+        with self.lock:
+            session = self.sessions.pop((host, port), None)
+        if session is not None:
+            with session:
+                session.close()
+
+    def close_all(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            with session:
+                session.close()
+
+
+# shared by everything in this process. Closed at exit.
+pool = TelnetSessionPool()
+atexit.register(pool.close_all)
@@ -0,0 +1,352 @@
+import hashlib
+import json
+import os
+import re
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+import gns3fy
+from gns3_bgp_frr import logging, tracing
+from settings import *
+
+# saved alongside the generated configs
+snapshot_path = Path(__file__).resolve().parent / ".." / "generated" / "topology.json"
+
+# the node properties we keep. Everything else (environment, console settings etc.)
+# doesn't affect addressing or configs
+snapshot_properties = ("image",)
+
+
+@dataclass
+class Node:
+    """
+    The parts of a `gns3fy.Node` needed to address and generate configs. Has the same
+    attribute names so it can be used in its place.
+    """
+
+    node_id: str
+    name: str
+    node_type: Optional[str] = None
+    properties: Dict[str, Any] = field(default_factory=dict)
+    # the node's ports in adapter order, each with at least "name", "adapter_number"
+    # and "port_number"
+    ports: List[Dict[str, Any]] = field(default_factory=list)
+
+
+@dataclass
+class Link:
+    """
+    The parts of a `gns3fy.Link` needed to address and generate configs.
+    """
+
+    link_id: str
+    # the two ends of the link, each with "node_id", "adapter_number" and "port_number"
+    nodes: List[Dict[str, Any]] = field(default_factory=list)
+
+
+@dataclass
+class Endpoint:
+    """
+    One end of a link, as seen from the node it's on. See `Topology.endpoints()`.
+    """
+
+    link_id: str
+    node_id: str
+    port_name: str
+    # the node and port at the other end. Clouds don't always have port names
+    peer_node_id: str
+    peer_port_name: Optional[str]
+
+
+@dataclass
+class Topology:
+    """
+    A snapshot of the project's nodes, ports and links. Taken whenever we connect to
+    the project (see `gns3.get_project()`) and saved to `snapshot_path`, so addressing
+    and config generation can run without the GNS3 server.
+
+    Indexed when created so lookups by node ID, name or port don't have to scan every
+    node or link. Don't change `nodes` or `links` afterwards.
+    """
+
+    project_name: str
+    server_url: str
+    # changes whenever a node, port or link does. Not labels or node status
+    revision: str
+    nodes: List[Node] = field(default_factory=list)
+    links: List[Link] = field(default_factory=list)
+    # when this revision was first read from the server, as a unix timestamp. 0 for
+    # snapshots saved before this was
+    taken_at: float = 0.0
+
+    def __post_init__(self):
+        self.nodes_by_id: Dict[str, Node] = {node.node_id: node for node in self.nodes}
+        self.nodes_by_name: Dict[str, Node] = {node.name: node for node in self.nodes}
+        # node ID: adapter number: port name
+        self.port_names: Dict[str, Dict[int, str]] = {
+            node.node_id: {
+                adapter_number: port["name"]
+                for adapter_number, port in enumerate(node.ports)
+            }
+            for node in self.nodes
+        }
+        # node ID: that node's ends of every link it's on, in link order. Used by
+        # `roles` and `gns3` to find what each node is linked to without scanning links
+        self.adjacency: Dict[str, List[Endpoint]] = {
+            node.node_id: [] for node in self.nodes
+        }
+        for link in self.links:
+            if len(link.nodes) != 2:
+                continue
+            first, second = link.nodes
+            for end, peer in ((first, second), (second, first)):
+                port_name = self.port_name(end["node_id"], end["adapter_number"])
+                peer_port_name = self.port_name(peer["node_id"], peer["adapter_number"])
+                if port_name is None:
+                    continue
+                self.adjacency[end["node_id"]].append(
+                    Endpoint(
+                        link_id=link.link_id,
+                        node_id=end["node_id"],
+                        port_name=port_name,
+                        peer_node_id=peer["node_id"],
+                        peer_port_name=peer_port_name,
+                    )
+                )
+        # node ID: role and AS number, worked out once
+        self.routers = {node.node_id for node in self.nodes if is_router(node)}
+        self.asns: Dict[str, Optional[int]] = {
+            node.node_id: get_asn(node.name) for node in self.nodes
+        }
+
+    def get_node(
+        self, name: Optional[str] = None, node_id: Optional[str] = None
+    ) -> Optional[Node]:
+        """
+        Same as `gns3fy.Project.get_node()`.
+        """
+        if node_id is not None:
+            return self.nodes_by_id.get(node_id)
+        if name is not None:
+            return self.nodes_by_name.get(name)
+        return None
+
+    def port_name(self, node_id: str, adapter_number: int) -> Optional[str]:
+        """
+        The name of a node's port, e.g. "eth0", from the adapter number links use.
+        """
+        return self.port_names.get(node_id, {}).get(adapter_number)
+
+    def endpoints(self, node_id: str) -> List[Endpoint]:
+        """
+        The node's end of every link it's on.
+        """
+        return self.adjacency.get(node_id, [])
+
+    def is_router(self, node_id: str) -> bool:
+        return node_id in self.routers
+
+
+def is_router(node: Union[gns3fy.Node, Node]) -> bool:
+    return (
+        node.properties is not None
+        and "image" in node.properties
+        and node.properties["image"].startswith("frrouting")
+    )
+
+
+def get_asn(node_name: str) -> Optional[int]:
+    """
+    Returns the AS number of the device via name if it has one, otherwise None.
+    """
+    match = re.match(r"asn(\d+)", node_name)
+    if match and match.group(1):
+        return int(match.group(1))
+
+    # else
+    return None
+
+
+# the topology for this run. See `get_topology()`
+_topology: Optional[Topology] = None
+
+
+@tracing.traced()
+def get_topology(refresh=False, log=False) -> Topology:
+    """
+    Returns the topology, from (in order of preference) this run, the saved snapshot, or
+    the GNS3 server.
+
+    Set refresh to true to always read the nodes and links from the server again, e.g.
+    after changing the topology in GNS3 without running any other command since.
+    """
+    # gns3 imports us
+    from gns3_bgp_frr import gns3
+
+    global _topology
+    if refresh:
+        project = gns3.get_project()
+        # connecting earlier this run doesn't mean nothing's changed since
+        project.get_nodes()
+        project.get_links()
+        update_snapshot(project, expected=True, log=log)
+    if _topology is None:
+        _topology = load_snapshot()
+        if _topology is not None and log:
+            logging.log(
+                f"using the topology saved {describe_age(_topology.taken_at)} "
+                f"(revision {_topology.revision[:8]}). Run with --refresh-topology if "
+                "it's changed in GNS3 since",
+                "info",
+            )
+    if _topology is None:
+        # connecting updates the snapshot
+        gns3.get_project()
+    assert _topology is not None
+    return _topology
+
+
+def describe_age(timestamp: float) -> str:
+    if not timestamp:
+        return "by an older version"
+    seconds = max(0.0, time.time() - timestamp)
+    for unit, length in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        if seconds >= length:
+            amount = int(seconds // length)
+            return f"{amount} {unit}{'s' if amount != 1 else ''} ago"
+    return "just now"
+
+
+def update_snapshot(project: gns3fy.Project, expected=False, log=False):
+    """
+    Take a snapshot of the nodes and links the project has loaded and save it if it's
+    changed.
+
+    If it has, anything generated from the old snapshot (e.g. by `generate-configs`
+    without the server) is out of date, so says so loudly unless expected is true, e.g.
+    because we're refreshing it to generate configs.
+    """
+    global _topology
+    topology = from_project(project)
+    previous = _topology or load_snapshot()
+    changed = previous is not None and previous.revision != topology.revision
+    if changed and not expected:
+        logging.log(
+            f"the topology has changed in GNS3 since it was saved "
+            f"{describe_age(previous.taken_at)} (revision {previous.revision[:8]} is "
+            f"now {topology.revision[:8]}). Configs generated from the old one are out "
+            "of date: run [cyan]generate-configs[/] again",
+            "error",
+        )
+    if (
+        previous is not None
+        and not changed
+        and previous.taken_at
+        and snapshot_path.exists()
+    ):
+        # keep when this revision was first seen
+        topology.taken_at = previous.taken_at
+    else:
+        if log:
+            logging.log(
+                f"saving topology snapshot (revision {topology.revision[:8]})", "info"
+            )
+        save_snapshot(topology)
+    _topology = topology
+
+
+def from_project(project: gns3fy.Project) -> Topology:
+    nodes = [
+        Node(
+            node_id=str(node.node_id),
+            name=str(node.name),
+            node_type=node.node_type,
+            properties={
+                key: value
+                for key, value in (node.properties or {}).items()
+                if key in snapshot_properties
+            },
+            ports=[
+                {
+                    "name": port["name"],
+                    "adapter_number": port.get("adapter_number"),
+                    "port_number": port.get("port_number"),
+                }
+                for port in node.ports or []
+            ],
+        )
+        for node in project.nodes or []
+        if node.name is not None
+    ]
+    links = [
+        Link(
+            link_id=str(link.link_id),
+            nodes=[
+                {
+                    "node_id": end["node_id"],
+                    "adapter_number": end["adapter_number"],
+                    "port_number": end["port_number"],
+                }
+                for end in link.nodes or []
+            ],
+        )
+        for link in project.links or []
+    ]
+    return Topology(
+        project_name=PROJECT_NAME,
+        server_url=GNS3_SERVER_URL,
+        revision=get_revision(nodes, links),
+        nodes=nodes,
+        links=links,
+        taken_at=time.time(),
+    )
+
+
+def get_revision(nodes: List[Node], links: List[Link]) -> str:
+    """
+    A hash of the nodes and links that doesn't depend on the order the server returned
+    them in.
+    """
+    data = {
+        "nodes": sorted((asdict(node) for node in nodes), key=lambda n: n["node_id"]),
+        "links": sorted((asdict(link) for link in links), key=lambda l: l["link_id"]),
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def load_snapshot(path: Optional[Path] = None) -> Optional[Topology]:
+    """
+    Returns the saved topology (from `snapshot_path` by default), or None if there isn't
+    one for the current project and server, or it can't be read.
+    """
+    path = snapshot_path if path is None else path
+    if not path.exists():
+        return None
+    try:
+        data = json.loads(path.read_text())
+        topology = Topology(
+            project_name=data["project_name"],
+            server_url=data["server_url"],
+            revision=data["revision"],
+            nodes=[Node(**node) for node in data["nodes"]],
+            links=[Link(**link) for link in data["links"]],
+            taken_at=data.get("taken_at", 0.0),
+        )
+    except (ValueError, KeyError, TypeError):
+        return None
+    if topology.project_name != PROJECT_NAME or topology.server_url != GNS3_SERVER_URL:
+        return None
+    return topology
+
+
+def save_snapshot(topology: Topology, path: Optional[Path] = None):
+    """
+    Write the snapshot out (to `snapshot_path` by default) atomically so an interrupted
+    run can't leave it corrupt.
+    """
+    path = snapshot_path if path is None else path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + ".tmp")
+    temp_path.write_text(json.dumps(asdict(topology), indent=4))
+    os.replace(temp_path, path)
@@ -0,0 +1,248 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+# whether spans are recorded. Off unless `--profile` is given, when `span()` costs
+# next to nothing
+enabled = False
+
+# every finished span since `enable()`, in the order they finished
+spans: List["Span"] = []
+_spans_lock = threading.Lock()
+# the spans open in each thread, innermost last
+_open = threading.local()
+# perf_counter() when tracing was enabled. Span times are relative to it
+_origin = 0.0
+
+# what the slowest-of summary tables cover, and where each of those was. See
+# `print_summary()`
+summary_categories = {
+    "node": ("nodes", "phase"),
+    "command": ("telnet commands", "node"),
+}
+# longer names are cut short in them, e.g. `echo <a chunk of base64>`
+summary_name_length = 60
+
+
+@dataclass
+class Span:
+    """
+    Something that took time: a subcommand, a phase of one, the work on a node or a
+    single telnet command. Times are in seconds since tracing was enabled.
+    """
+
+    name: str
+    # "subcommand", "phase", "node" or "command"
+    category: str
+    start: float
+    duration: float = 0.0
+    thread_id: int = 0
+    thread_name: str = ""
+    # the node it's for, if it's inside a node span
+    node: Optional[str] = None
+    args: Dict[str, Any] = field(default_factory=dict)
+
+
+def enable():
+    """
+    Start recording spans, forgetting any from before.
+    """
+    global enabled, _origin
+    with _spans_lock:
+        spans.clear()
+    _origin = time.perf_counter()
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+@contextmanager
+def span(name: str, category: str = "phase", **args) -> Iterator[Optional[Span]]:
+    """
+    Records how long the body takes as a span, nested in any span already open in this
+    thread. Yields the span so args can be added to it, or None if tracing is off.
+    """
+    if not enabled:
+        yield None
+        return
+
+    stack: List[Span] = _open.__dict__.setdefault("stack", [])
+    thread = threading.current_thread()
+    current = Span(
+        name=name,
+        category=category,
+        start=time.perf_counter() - _origin,
+        thread_id=thread.ident or 0,
+        thread_name=thread.name,
+        node=name if category == "node" else (stack[-1].node if stack else None),
+        args=args,
+    )
+    stack.append(current)
+    try:
+        yield current
+    finally:
+        stack.pop()
+        current.duration = time.perf_counter() - _origin - current.start
+        with _spans_lock:
+            spans.append(current)
+
+
+def current() -> Optional[Span]:
+    """
+    The innermost span open in this thread, if any.
+    """
+    stack: List[Span] = _open.__dict__.get("stack", [])
+    return stack[-1] if stack else None
+
+
+def record(name: str, category: str, start: float, end: float, **args):
+    """
+    Records a span that was timed by the caller, e.g. a telnet command that was sent
+    in a batch with others. start and end are from `time.perf_counter()`.
+    """
+    if not enabled:
+        return
+    stack: List[Span] = _open.__dict__.get("stack", [])
+    thread = threading.current_thread()
+    finished = Span(
+        name=name,
+        category=category,
+        start=start - _origin,
+        duration=end - start,
+        thread_id=thread.ident or 0,
+        thread_name=thread.name,
+        node=stack[-1].node if stack else None,
+        args=args,
+    )
+    with _spans_lock:
+        spans.append(finished)
+
+
+Function = TypeVar("Function", bound=Callable[..., Any])
+
+
+def traced(category: str = "phase", name: Optional[str] = None):
+    """
+    Decorator that records each call of a function as a span, named after the function
+    by default.
+    """
+
+    def decorator(function: Function) -> Function:
+        span_name = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with span(span_name, category):
+                return function(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def write_chrome_trace(path: Path):
+    """
+    Write the spans as Chrome trace events, which chrome://tracing and
+    https://ui.perfetto.dev can open. Each thread gets its own row.
+    """
+    process_id = os.getpid()
+    with _spans_lock:
+        recorded = list(spans)
+
+    events: List[Dict[str, Any]] = []
+    thread_names = {}
+    for recorded_span in recorded:
+        thread_names[recorded_span.thread_id] = recorded_span.thread_name
+        args = dict(recorded_span.args)
+        if recorded_span.node is not None:
+            args.setdefault("node", recorded_span.node)
+        events.append(
+            {
+                "name": recorded_span.name,
+                "cat": recorded_span.category,
+                "ph": "X",
+                # microseconds
+                "ts": round(recorded_span.start * 1e6, 1),
+                "dur": round(recorded_span.duration * 1e6, 1),
+                "pid": process_id,
+                "tid": recorded_span.thread_id,
+                "args": args,
+            }
+        )
+    for thread_id, thread_name in thread_names.items():
+        events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": process_id,
+                "tid": thread_id,
+                "args": {"name": thread_name},
+            }
+        )
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+
+
+def get_slowest(category: str, limit: int = 10) -> List[Span]:
+    with _spans_lock:
+        matching = [recorded for recorded in spans if recorded.category == category]
+    return sorted(matching, key=lambda recorded: recorded.duration, reverse=True)[
+        :limit
+    ]
+
+
+def print_summary(limit: int = 10):
+    """
+    Print how long each subcommand and phase took in total, then the slowest nodes and
+    telnet commands.
+    """
+    from rich import print
+    from rich.table import Table
+
+    # name: (count, total seconds), in the order they first finished
+    totals: Dict[str, List[float]] = {}
+    with _spans_lock:
+        for recorded_span in spans:
+            if recorded_span.category in ("subcommand", "phase"):
+                total = totals.setdefault(recorded_span.name, [0, 0.0])
+                total[0] += 1
+                total[1] += recorded_span.duration
+
+    table = Table(title="subcommands and phases")
+    table.add_column("name")
+    table.add_column("calls", justify="right")
+    table.add_column("total", justify="right")
+    for name, (calls, seconds) in totals.items():
+        table.add_row(name, str(calls), f"{seconds:.3f}s")
+    print(table)
+
+    for category, (title, where) in summary_categories.items():
+        slowest = get_slowest(category, limit)
+        if not slowest:
+            continue
+        table = Table(title=f"slowest {title}")
+        table.add_column("name")
+        table.add_column(where)
+        table.add_column("duration", justify="right")
+        for recorded_span in slowest:
+            name = recorded_span.name
+            if len(name) > summary_name_length:
+                name = name[: summary_name_length - 3] + "..."
+            table.add_row(
+                name,
+                str(recorded_span.args.get(where, recorded_span.node) or ""),
+                f"{recorded_span.duration:.3f}s",
+            )
+        print(table)
@@ -7,17 +7,83 @@ Usage is
 
 """
 
+from pathlib import Path
+from typing import Optional
 import rich_click as click
-from gns3_bgp_frr import configs, gns3
+from gns3_bgp_frr import metrics, tracing
 from gns3_bgp_frr.click import AppearanceOrderGroup
-import pytest
+
+# the gns3_bgp_frr modules (and gns3fy, jinja2 and pytest through them) are imported
+# inside each command rather than here, so `--help` starts instantly and doesn't need
+# the GNS3 server.
 
 click.rich_click.USE_RICH_MARKUP = True
 
+# where `--profile` saves its trace
+trace_path = Path(__file__).resolve().parent / "generated" / "trace.json"
+
 # define global group to make subcommands available
 @click.group(cls=AppearanceOrderGroup, chain=True)
-def cli():
-    pass
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    help="How many nodes to configure at once. Defaults to 16.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Time each command, phase, node and telnet command. Saves them to "
+    "[cyan]generated/trace.json[/] for chrome://tracing or ui.perfetto.dev and prints "
+    "the slowest.",
+)
+@click.option(
+    "--metrics",
+    "metrics_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Also save the telnet and HTTP metrics printed at the end of the run to this "
+    "file, as JSON.",
+)
+@click.pass_context
+def cli(
+    ctx: click.Context,
+    concurrency: Optional[int],
+    profile: bool,
+    metrics_path: Optional[Path],
+):
+    if concurrency is not None:
+        from gns3_bgp_frr import gns3
+
+        gns3.MAX_CONCURRENCY = concurrency
+
+    # these run after the chained commands, even if one fails
+    ctx.call_on_close(lambda: report_metrics(metrics_path))
+    if profile:
+        tracing.enable()
+        ctx.call_on_close(write_profile)
+
+
+def report_metrics(path: Optional[Path]):
+    """
+    Print the telnet and HTTP metrics for the run, if there were any, and save them to
+    path if given.
+    """
+    from gns3_bgp_frr import logging
+
+    if metrics.counters or metrics.histograms:
+        from gns3_bgp_frr import gns3
+
+        metrics.print_summary(telnet_timeout=gns3.TELNET_TIMEOUT)
+    if path is not None:
+        metrics.write(path)
+        logging.log(f"saved the metrics to [cyan]{path.resolve()}[/]", "done")
+
+
+def write_profile():
+    from gns3_bgp_frr import logging
+
+    tracing.print_summary()
+    tracing.write_chrome_trace(trace_path)
+    logging.log(f"saved the trace to [cyan]{trace_path.resolve()}[/]", "done")
 
 
 @cli.command()
@@ -25,42 +91,147 @@ def start_all():
     """
     Starts all nodes.
     """
+    from gns3_bgp_frr import gns3
+
     gns3.start_all(log=True)
 
 
+@cli.command()
+@click.option(
+    "--timeout",
+    type=float,
+    help="How many seconds to wait before giving up. Defaults to 120.",
+)
+def wait_ready(timeout: Optional[float]):
+    """
+    Wait until every node is ready to be configured: its shell answers and, for
+    routers, vtysh answers with the enabled daemons running.
+    The other commands do this themselves for nodes they start.
+    """
+    from gns3_bgp_frr import gns3
+
+    gns3.wait_until_ready(gns3.project.nodes, timeout=timeout, log=True)
+
+
 @cli.command()
 def set_up():
     """
     Enable the required OSPF and BGP daemons on each node.
-    Run twice or restart GNS3 after running once if one of them doesn't start (check a
-    node with `ps -a`)
+    Routers where they don't come up are restarted.
     """
+    from gns3_bgp_frr import gns3
+
     gns3.set_daemon_state_all(True, log=True)
 
 
 @cli.command()
-def generate_configs():
+@click.option(
+    "--refresh-topology",
+    is_flag=True,
+    help="Read the topology from the GNS3 server instead of the copy saved by the last "
+    "command that connected to it.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    help="How many processes to render configs with in big topologies. Defaults to "
+    "the number of CPUs.",
+)
+def generate_configs(refresh_topology: bool, workers: Optional[int]):
     """
     Automatically generate addresses then create FRR configs for each router, in the
     [cyan]\\[project root]/generated[/] folder.
-    Automatically starts the nodes (required to avoid errors when reading links).
+    Works offline from the saved topology if there is one.
+    Only configs that changed are rewritten.
     """
-    configs.generate_configs(log=True)
+    from gns3_bgp_frr import configs
+
+    if workers is not None:
+        configs.RENDER_WORKERS = workers
+    configs.generate_configs(log=True, refresh_topology=refresh_topology)
 
 
 @cli.command()
-def apply_configs():
+@click.option(
+    "--bulk/--line-by-line",
+    default=True,
+    show_default=True,
+    help="Copy each config file into the node and load it with vtysh, or type it in "
+    "one line at a time.",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only send the differences between each router's running config and its "
+    "generated config.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Apply to every node, even ones that haven't changed since the last apply.",
+)
+def apply_configs(bulk: bool, incremental: bool, force: bool):
     """
     Apply the generated configs to the devices.
     Configs must have been generated first.
     Automatically starts the nodes.
+    Skips nodes that haven't changed since the last apply.
     Shows IPs in the project.
     """
-    configs.apply_frr_configs(log=True)
-    configs.configure_alpine(log=True)
+    from gns3_bgp_frr import configs, gns3
+
+    configs.apply_frr_configs(log=True, bulk=bulk, incremental=incremental, force=force)
+    configs.configure_alpine(log=True, force=force)
     gns3.show_interface_ips(log=True)
 
 
+@cli.command()
+@click.option(
+    "--timeout",
+    type=float,
+    help="How many seconds to wait before giving up. Defaults to 300.",
+)
+@click.option(
+    "--interval",
+    type=float,
+    help="How many seconds between polls of each router. Defaults to 1.",
+)
+@click.option(
+    "--settle",
+    type=float,
+    help="How many seconds a router's sessions and routes have to stay the same to "
+    "count as converged. Defaults to 5.",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    help="Also save each router's time to convergence to this JSON file.",
+)
+def measure_convergence(
+    timeout: Optional[float],
+    interval: Optional[float],
+    settle: Optional[float],
+    output: Optional[Path],
+):
+    """
+    Poll every router until all the BGP, OSPF and BFD sessions in its generated config
+    are up and its BGP routes stop changing, then show how long each router and the
+    whole lab took.
+    Run straight after apply-configs.
+    """
+    from gns3_bgp_frr import convergence
+
+    states = convergence.measure_convergence(
+        timeout=timeout, poll_interval=interval, settle_time=settle, log=True
+    )
+    if output is not None:
+        convergence.save_convergence(
+            states,
+            output,
+            convergence.SETTLE_TIME if settle is None else settle,
+        )
+
+
 @cli.command()
 def reset():
 
@@ -68,6 +239,8 @@ def reset():
     Resets the entire project to default. If you configure something in the project, add
     a [cyan]reset_\\[thing]()[/] function to undo it and call it from here.
     """
+    from gns3_bgp_frr import configs, gns3
+
     gns3.set_daemon_state_all(False, log=True)
     configs.clear_frr_configs(log=True)
     configs.clear_alpine_config(log=True)
@@ -79,6 +252,8 @@ def stop_all():
     """
     Stops all nodes.
     """
+    from gns3_bgp_frr import gns3
+
     gns3.stop_all(log=True)
 
 
@@ -87,6 +262,8 @@ def test():
     """
     Run tests.
     """
+    import pytest
+
     # use the `tests` folder, show names of successful tests too, show no traceback but
     # the full error, shorten output
     pytest.main(["tests", "-rA", "--tb=line", "--no-header"])
@@ -4,13 +4,29 @@ GNS3_SERVER_HOST = "192.168.1.1"
 GNS3_SERVER_USERNAME = "exampleuser"
 GNS3_SERVER_PASSWORD = "examplepassword"
 PROJECT_NAME = "frr-bgp"
-# a free subnet, at least a /24, in CIDR format, that's routable within your network
+# a free subnet in CIDR format that's routable within your network. asn1's internal
+# links are addressed from the first half and every other link from the second, so
+# each half needs a subnet of P2P_PREFIXLEN per link. A /24 is plenty for the example
+# project
 P2P_SUPERNET = "10.0.0.0/24"
+# the size of each link's subnet: 30, or 31 to fit twice as many links (RFC 3021)
+P2P_PREFIXLEN = 30
+# optional. A free IPv6 subnet in CIDR format, split the same way as P2P_SUPERNET, to
+# also give each link a /127 from (RFC 6164). e.g. "fd00:0:0:1::/64"
+P2P_SUPERNET_V6 = None
+# optional. Separate subnets, in CIDR format, for the links inside other ASes, keyed by
+# AS number. e.g. {2: "10.0.2.0/24"}. Must not overlap P2P_SUPERNET unless it's for
+# asn1, which then uses it instead of the first half of P2P_SUPERNET
+ASN_SUPERNETS = {}
 # an IP and mask, in  CIDR notation, for each of the external routers, in the network
 # your GNS3 VM is connected to. This is your lan or dev network, probably the network
 # your GNS3 VM is one. This is considered 'external' to the GNS3 lab.
 ASN1BORDER1_EXTERNAL_IP = "192.168.1.251/24"
 ASN1BORDER2_EXTERNAL_IP = "192.168.1.252/24"
+# optional. The same by router name, if your external links aren't on asn1border1 and
+# 2, e.g. {"asn1border1": "192.168.1.251/24", "asn3border1": "192.168.1.253/24"}.
+# Routers with an external link that isn't listed leave it unaddressed
+# EXTERNAL_IPS = {}
 # the IP of the (real, outside GNS3) gateway on the same subnet as
 # ASN1BORDER1_EXTERNAL_IP and ASN2BORDER1_EXTERNAL_IP. Either for BGP or default route.
 # See the description of the next setting too.
@@ -27,3 +43,14 @@ EXTERNAL_GATEWAY = "192.168.1.254"
 ENABLE_EXTERNAL_GATEWAY_BGP = True
 # if ENABLE_EXTERNAL_GATEWAY_BGP is True, set this to the AS number of EXTERNAL_GATEWAY
 EXTERNAL_GATEWAY_ASN = 64512
+# optional. How border routers in ASes that run OSPF (e.g. asn1) form iBGP:
+# - "full-mesh": every one peers with every OSPF interface of every other one
+# - "route-reflector": each gets a loopback from its AS's subnet and peers with the
+# route reflectors over it, which reflect routes to the rest. Far fewer sessions in
+# bigger ASes
+IBGP_MODE = "full-mesh"
+# optional. With "route-reflector", which routers to use by AS number. e.g.
+# {1: ["asn1border1"]}. ASes that aren't listed use the ROUTE_REFLECTOR_COUNT border
+# routers with the most links inside the AS
+ROUTE_REFLECTORS = {}
+ROUTE_REFLECTOR_COUNT = 2
@@ -0,0 +1,541 @@
+"""
+Simulated FRR (and alpine) aux-port telnet endpoints.
+
+Each `FakeRouter` listens on its own localhost port and emulates just enough of the
+outer `sh` and `vtysh` of the frrouting docker image for `gns3_bgp_frr` to drive it:
+prompts, ctrl-c, line echo, the handful of shell commands we send, and a small config
+mode that keeps a running config.
+
+Like a real aux port the shell is shared between connections, so leaving `vtysh`
+running on one connection leaves it running for the next.
+"""
+import base64
+import fnmatch
+import hashlib
+import json
+from pathlib import Path
+import re
+import shlex
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional
+
+# /etc/frr/daemons as it comes in the frrouting/frr image, settings and all
+DEFAULT_DAEMONS = (Path(__file__).parent / "frr" / "daemons").read_text()
+
+# vtysh commands that open a nested config context
+CONTEXT_COMMANDS = (
+    "interface ",
+    "router ",
+    "route-map ",
+    "address-family ",
+    "peer ",
+    "bfd",
+    "line ",
+)
+
+# config commands that are only valid at the top level
+TOP_LEVEL_COMMANDS = (
+    "interface ",
+    "router ",
+    "route-map ",
+    "ip prefix-list ",
+    "ip route ",
+    "line ",
+)
+
+CONTEXT_PROMPTS = {
+    "interface": "config-if",
+    "router": "config-router",
+    "route-map": "config-route-map",
+    "address-family": "config-router-af",
+    "peer": "config-bfd-peer",
+    "bfd": "config-bfd",
+    "line": "config-line",
+}
+
+
+class FakeRouter:
+    """
+    State for one simulated node. `latency` seconds are slept before every response to
+    emulate a slow GNS3 server.
+    """
+
+    def __init__(self, name: str, frr: bool = True, latency: float = 0.0):
+        self.name = name
+        self.frr = frr
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.files: Dict[str, str] = {}
+        if frr:
+            self.files["/etc/frr/daemons"] = DEFAULT_DAEMONS
+            self.files["/etc/frr/vtysh.conf"] = "service integrated-vtysh-config\n"
+        self.started = False
+        self.running_daemons: List[str] = []
+        # (header, children) tree of the running config
+        self.running_config: List[List] = []
+        # shell state shared by all connections
+        self.in_vtysh = False
+        self.config_stack: Optional[List[List]] = None
+        # counters for benchmarks
+        self.commands_received = 0
+        # every line received, in order
+        self.history: List[str] = []
+        self.connections = 0
+        self.server: Optional[socketserver.ThreadingTCPServer] = None
+        self.port = 0
+        # emulate a PuTTY window on the same port answering terminal queries
+        self.interference = False
+        # how many of the next base64 chunks `gns3.write_file()` sends to garble
+        self.corrupt_writes = 0
+        # how many of the next `frrinit.sh restart`s leave the daemons stopped
+        self.fail_reloads = 0
+        # seconds after starting before the port answers, like a booting container
+        self.boot_delay = 0.0
+        self.booted_at = 0.0
+
+    # ---------------------------------------------------------------- lifecycle
+
+    def listen(self, host: str = "127.0.0.1") -> int:
+        router = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                router.handle_connection(self.request)
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self.server = Server((host, 0), Handler)
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        return self.port
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+            self.booted_at = time.time() + self.boot_delay
+            self.in_vtysh = False
+            self.config_stack = None
+            self.running_config = []
+            if self.frr:
+                self.running_daemons = ["zebra", "staticd", "watchfrr"] + [
+                    daemon
+                    for daemon in ("bgpd", "ospfd", "bfdd")
+                    if f"\n{daemon}=yes" in "\n" + self.files["/etc/frr/daemons"]
+                ]
+                saved = self.files.get("/etc/frr/frr.conf")
+                if saved:
+                    self.load_config(saved.splitlines())
+
+    def stop(self):
+        with self.lock:
+            self.started = False
+            self.running_daemons = []
+            self.in_vtysh = False
+            self.config_stack = None
+
+    # ---------------------------------------------------------------- telnet
+
+    def handle_connection(self, sock: socket.socket):
+        if not self.started or time.time() < self.booted_at:
+            sock.close()
+            return
+        self.connections += 1
+        buffer = b""
+        try:
+            while self.started:
+                try:
+                    sock.settimeout(0.2)
+                    data = sock.recv(4096)
+                except socket.timeout:
+                    continue
+                if not data:
+                    return
+                buffer += data
+                while True:
+                    if b"\x03" in buffer and (
+                        b"\n" not in buffer
+                        or buffer.index(b"\x03") < buffer.index(b"\n")
+                    ):
+                        index = buffer.index(b"\x03")
+                        buffer = buffer[index + 1 :]
+                        self.respond(sock, "^C\r\n" + self.prompt())
+                        continue
+                    if b"\n" not in buffer:
+                        break
+                    line, buffer = buffer.split(b"\n", 1)
+                    text = line.decode(errors="replace").strip("\r")
+                    self.commands_received += 1
+                    self.history.append(text)
+                    with self.lock:
+                        output = self.run(text)
+                    junk = "\x07;5R" if self.interference else ""
+                    self.respond(
+                        sock,
+                        junk
+                        + text
+                        + "\r\n"
+                        + output.replace("\n", "\r\n")
+                        + self.prompt(),
+                    )
+        except OSError:
+            return
+        finally:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def respond(self, sock: socket.socket, text: str):
+        if self.latency:
+            time.sleep(self.latency)
+        sock.sendall(text.encode())
+
+    def prompt(self) -> str:
+        if not self.in_vtysh:
+            return "/ # "
+        if self.config_stack is None:
+            return f"{self.name}# "
+        if len(self.config_stack) == 0:
+            return f"{self.name}(config)# "
+        header = self.config_stack[-1][0]
+        keyword = header.split(" ")[0]
+        return f"{self.name}({CONTEXT_PROMPTS.get(keyword, 'config')})# "
+
+    # ---------------------------------------------------------------- shell
+
+    def run(self, line: str) -> str:
+        if self.in_vtysh:
+            return self.vtysh(line)
+        return self.shell(line)
+
+    def shell(self, line: str) -> str:
+        if not line.strip():
+            return ""
+        output = []
+        for command in re.split(r"\s*(?:&&|;)\s*", line):
+            output.append(self.shell_command(command))
+        return "".join(output)
+
+    def shell_command(self, command: str) -> str:
+        redirect = None
+        append = False
+        match = re.match(r"^(.*?)\s*(>>|>)\s*(\S+)$", command)
+        if match and not command.startswith("sed"):
+            command, operator, redirect = match.groups()
+            append = operator == ">>"
+        try:
+            words = shlex.split(command)
+        except ValueError:
+            return f"sh: syntax error\n"
+        if not words:
+            return ""
+        name, args = words[0], words[1:]
+        name = name.rsplit("/", 1)[-1]
+        handler = getattr(self, f"sh_{name.replace('-', '_').replace('.', '_')}", None)
+        if handler is None:
+            output = f"sh: {name}: not found\n"
+        else:
+            output = handler(args)
+        if redirect is not None and redirect.endswith(".b64") and self.corrupt_writes:
+            self.corrupt_writes -= 1
+            # still valid base64, just not what was sent
+            output = ("B" if output[0] == "A" else "A") + output[1:]
+        if redirect is not None:
+            self.files[redirect] = (
+                self.files.get(redirect, "") if append else ""
+            ) + output
+            return ""
+        return output
+
+    def sh_exit(self, args):
+        return ""
+
+    def sh_end(self, args):
+        return "sh: end: not found\n"
+
+    def sh_echo(self, args):
+        return " ".join(args) + "\n"
+
+    def sh_sleep(self, args):
+        time.sleep(float(args[0]))
+        return ""
+
+    def sh_cat(self, args):
+        return "".join(self.files.get(path, "") for path in args)
+
+    def sh_rm(self, args):
+        output = ""
+        for pattern in [arg for arg in args if not arg.startswith("-")]:
+            matches = [path for path in self.files if fnmatch.fnmatch(path, pattern)]
+            if not matches and "-f" not in args:
+                output += f"rm: can't remove '{pattern}': No such file or directory\n"
+            for path in matches:
+                del self.files[path]
+        return output
+
+    def sh_grep(self, args):
+        pattern, paths = args[0], args[1:]
+        output = ""
+        for path in paths:
+            if path not in self.files:
+                output += f"grep: {path}: No such file or directory\n"
+                continue
+            output += "".join(
+                line + "\n"
+                for line in self.files[path].split("\n")
+                if re.search(pattern, line)
+            )
+        return output
+
+    def sh_sed(self, args):
+        expression, path = args[-2], args[-1]
+        match = re.match(r"s/(.*)/(.*)/g?", expression)
+        if match is None or path not in self.files:
+            return f"sed: {path}: No such file or directory\n"
+        pattern, replacement = match.groups()
+        lines = [
+            re.sub(pattern, replacement, line) for line in self.files[path].split("\n")
+        ]
+        self.files[path] = "\n".join(lines)
+        return ""
+
+    def sh_sha256sum(self, args):
+        output = ""
+        for path in args:
+            if path not in self.files:
+                output += f"sha256sum: {path}: No such file or directory\n"
+                continue
+            digest = hashlib.sha256(self.files[path].encode()).hexdigest()
+            output += f"{digest}  {path}\n"
+        return output
+
+    def sh_base64(self, args):
+        path = [arg for arg in args if not arg.startswith("-")][0]
+        return base64.b64decode(self.files.get(path, "")).decode()
+
+    def sh_frrinit_sh(self, args):
+        if not self.frr:
+            return "sh: frrinit.sh: not found\n"
+        if args and args[0] in ("restart", "stop", "start"):
+            with self.lock:
+                self.running_daemons = []
+                self.running_config = []
+                if args[0] == "restart" and self.fail_reloads:
+                    self.fail_reloads -= 1
+                elif args[0] != "stop":
+                    self.started = False
+                    self.start()
+            if self.latency:
+                time.sleep(self.latency * 5)
+        return ""
+
+    def sh_ps(self, args):
+        lines = ["PID   USER     TIME  COMMAND", "    1 root      0:00 /sbin/tini"]
+        for index, daemon in enumerate(self.running_daemons):
+            lines.append(f"  {index + 10} frr       0:00 /usr/lib/frr/{daemon} -d")
+        return "\n".join(lines) + "\n"
+
+    def sh_vtysh(self, args):
+        if not self.frr:
+            return "sh: vtysh: not found\n"
+        if "zebra" not in self.running_daemons:
+            return "Exiting: failed to connect to any daemons.\n"
+        if not args:
+            self.in_vtysh = True
+            self.config_stack = None
+            return ""
+        output = ""
+        if args[0] == "-f":
+            self.load_config(self.files.get(args[1], "").splitlines())
+            return ""
+        for index, arg in enumerate(args):
+            if arg == "-c":
+                output += self.vtysh_exec(args[index + 1])
+        return output
+
+    # ---------------------------------------------------------------- vtysh
+
+    def vtysh(self, line: str) -> str:
+        stripped = line.strip()
+        if self.config_stack is None:
+            if stripped == "exit":
+                self.in_vtysh = False
+                return ""
+            if stripped in ("conf t", "configure terminal"):
+                self.config_stack = []
+                return ""
+            if stripped == "end" or not stripped:
+                return ""
+            return self.vtysh_exec(stripped)
+        return self.config_line(line)
+
+    def vtysh_exec(self, command: str) -> str:
+        if command in ("wr mem", "write memory", "write"):
+            self.files["/etc/frr/frr.conf"] = self.render_running_config()
+            return "Note: this version of vtysh never writes vtysh.conf\nBuilding Configuration...\nIntegrated configuration saved to /etc/frr/frr.conf\n[OK]\n"
+        if command in ("show running-config", "show run"):
+            return self.render_running_config()
+        if command == "show daemons":
+            return " ".join(d for d in self.running_daemons if d != "watchfrr") + "\n"
+        if command.startswith("show bgp summary json"):
+            return json.dumps(self.bgp_summary()) + "\n"
+        if command.startswith("show ip ospf neighbor json"):
+            return json.dumps(self.ospf_neighbors()) + "\n"
+        if command.startswith("show bfd peers json"):
+            return (
+                json.dumps(
+                    [{"peer": peer, "status": "up"} for peer in self.bgp_neighbors()]
+                )
+                + "\n"
+            )
+        return "% Unknown command: " + command + "\n"
+
+    def bgp_neighbors(self) -> List[str]:
+        neighbors = []
+        for header, children in self.running_config:
+            if header.startswith("router bgp"):
+                for child, _ in children:
+                    match = re.match(r"neighbor (\S+) remote-as", child)
+                    if match:
+                        neighbors.append(match.group(1))
+        return neighbors
+
+    def ospf_neighbors(self) -> Dict:
+        # one Full neighbor on each interface that isn't passive, as links are p2p
+        neighbors = {}
+        for header, children in self.running_config:
+            if header.startswith("interface ") and any(
+                child == "no ip ospf passive" for child, _ in children
+            ):
+                interface = header.split()[1]
+                neighbors[f"{self.name}-{interface}"] = [
+                    {"nbrState": "Full/-", "ifaceName": interface}
+                ]
+        return {"neighbors": neighbors}
+
+    def bgp_summary(self) -> Dict:
+        peers = {
+            neighbor: {"state": "Established", "pfxRcd": 1, "pfxSnt": 1}
+            for neighbor in self.bgp_neighbors()
+        }
+        if not peers:
+            return {}
+        return {"ipv4Unicast": {"peers": peers, "peerCount": len(peers)}}
+
+    def config_line(self, line: str) -> str:
+        stripped = line.strip()
+        assert self.config_stack is not None
+        if not stripped or stripped.startswith("!"):
+            return ""
+        if stripped == "end":
+            self.config_stack = None
+            return ""
+        if stripped in ("exit", "exit-address-family", "quit"):
+            if self.config_stack:
+                self.config_stack.pop()
+            else:
+                self.config_stack = None
+            return ""
+        if stripped.startswith("do "):
+            return self.vtysh_exec(stripped[3:])
+        if stripped in ("wr mem", "write memory"):
+            return self.vtysh_exec(stripped)
+
+        # like vtysh, fall back to the top level for commands that only live there
+        if stripped.startswith(TOP_LEVEL_COMMANDS) or stripped == "bfd":
+            self.config_stack.clear()
+
+        siblings = (
+            self.config_stack[-1][1] if self.config_stack else self.running_config
+        )
+        if stripped.startswith("no "):
+            target = stripped[3:]
+            removed = False
+            for entry in list(siblings):
+                if entry[0] == target or entry[0].startswith(target + " "):
+                    siblings.remove(entry)
+                    removed = True
+            # non-default negations show up in the running config
+            if not removed and stripped != "no shutdown":
+                if not any(entry[0] == stripped for entry in siblings):
+                    siblings.append([stripped, []])
+            return ""
+
+        if stripped.startswith(CONTEXT_COMMANDS) or stripped == "bfd":
+            # a context can't contain another of the same kind, e.g. bfd peers
+            keyword = stripped.split(" ")[0]
+            while (
+                self.config_stack and self.config_stack[-1][0].split(" ")[0] == keyword
+            ):
+                self.config_stack.pop()
+            siblings = (
+                self.config_stack[-1][1] if self.config_stack else self.running_config
+            )
+            for entry in siblings:
+                if entry[0] == stripped:
+                    self.config_stack.append(entry)
+                    return ""
+            entry = [stripped, []]
+            siblings.append(entry)
+            self.config_stack.append(entry)
+            return ""
+
+        if not any(entry[0] == stripped for entry in siblings):
+            siblings.append([stripped, []])
+        return ""
+
+    def load_config(self, lines: List[str]):
+        self.config_stack = []
+        for line in lines:
+            indent = len(line) - len(line.lstrip(" "))
+            # top level lines close any open contexts
+            stripped = line.strip()
+            if indent == 0 and stripped and not stripped.startswith("!"):
+                if stripped not in ("exit", "end"):
+                    self.config_stack = []
+            self.config_line(line)
+            if self.config_stack is None:
+                self.config_stack = []
+        self.config_stack = None
+
+    def render_running_config(self) -> str:
+        lines = [
+            "Building configuration...",
+            "",
+            "Current configuration:",
+            "!",
+            "frr version 8.2.2_git",
+            "frr defaults traditional",
+            f"hostname {self.name}",
+            "service integrated-vtysh-config",
+            "!",
+        ]
+
+        def render(entries, depth):
+            for header, children in entries:
+                lines.append(" " * depth + header)
+                if children:
+                    render(children, depth + 1)
+                    if header.startswith("address-family"):
+                        lines.append(" " * depth + "exit-address-family")
+                    else:
+                        lines.append(" " * depth + "exit")
+                if depth == 0:
+                    lines.append("!")
+
+        render(self.running_config, 0)
+        lines.append("end")
+        return "\n".join(lines) + "\n"
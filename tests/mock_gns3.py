@@ -0,0 +1,325 @@
+"""
+An in-process mock of the GNS3 v2 REST endpoints that gns3fy uses, backed by a
+synthetic topology, plus a `FakeRouter` telnet endpoint for every docker node.
+
+    lab = MockLab(synthetic_topology.generate_topology(50))
+    lab.start()
+    # point `settings` and gns3_bgp_frr at the mock
+    install_settings(lab, output_path, monkeypatch)
+    ...
+    lab.close()
+"""
+import json
+import re
+import sys
+import threading
+import time
+import types
+from collections import Counter
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+from mock_frr import FakeRouter
+
+PROJECT_ID = "6f5c5b8e-2b6f-4d3a-9d8f-6a2b9b1f0c11"
+
+root_path = Path(__file__).resolve().parent / ".."
+
+
+class MockLab:
+    """
+    Serves one project called `project_name` built from `topology` (see
+    `synthetic_topology`). `latency` seconds are added to every HTTP response and every
+    telnet response.
+    """
+
+    def __init__(
+        self,
+        topology: Dict[str, List[Dict[str, Any]]],
+        project_name: str = "frr-bgp",
+        latency: float = 0.0,
+        http_latency: Optional[float] = None,
+    ):
+        self.project_name = project_name
+        self.latency = latency
+        self.http_latency = latency if http_latency is None else http_latency
+        self.nodes: Dict[str, Dict[str, Any]] = {}
+        self.links: Dict[str, Dict[str, Any]] = {}
+        self.routers: Dict[str, FakeRouter] = {}
+        self.request_counts: Counter = Counter()
+        self.lock = threading.Lock()
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.host = "127.0.0.1"
+
+        for node in deepcopy(topology["nodes"]):
+            node.update(
+                {
+                    "project_id": PROJECT_ID,
+                    "compute_id": "local",
+                    "status": "stopped",
+                    "console_type": "telnet",
+                    "console_host": self.host,
+                    "label": {"text": node["name"]},
+                }
+            )
+            self.nodes[node["node_id"]] = node
+        for link in deepcopy(topology["links"]):
+            link["project_id"] = PROJECT_ID
+            self.links[link["link_id"]] = link
+
+    # ---------------------------------------------------------------- lifecycle
+
+    def start(self):
+        for node in self.nodes.values():
+            if node["node_type"] != "docker":
+                continue
+            image = node["properties"].get("image", "")
+            router = FakeRouter(
+                node["name"], frr=image.startswith("frrouting"), latency=self.latency
+            )
+            port = router.listen(self.host)
+            node["console"] = port
+            node["properties"]["aux"] = port
+            self.routers[node["node_id"]] = router
+
+        lab = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                lab.handle(self, "GET")
+
+            def do_POST(self):
+                lab.handle(self, "POST")
+
+            def do_PUT(self):
+                lab.handle(self, "PUT")
+
+        self.server = ThreadingHTTPServer((self.host, 0), Handler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        # each one takes up to its poll interval to notice, so do them all at once
+        threads = [
+            threading.Thread(target=router.close) for router in self.routers.values()
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    @property
+    def url(self) -> str:
+        assert self.server is not None
+        return f"http://{self.host}:{self.server.server_address[1]}"
+
+    def settings_module(self) -> types.ModuleType:
+        """
+        A `settings` module with the values from `settings.example.py`, pointed at us.
+        """
+        module = types.ModuleType("settings")
+        exec((root_path / "settings.example.py").read_text(), module.__dict__)
+        module.GNS3_SERVER_URL = self.url
+        module.GNS3_SERVER_HOST = self.host
+        module.PROJECT_NAME = self.project_name
+        return module
+
+    def router(self, name: str) -> FakeRouter:
+        return next(router for router in self.routers.values() if router.name == name)
+
+    def telnet_commands(self) -> int:
+        return sum(router.commands_received for router in self.routers.values())
+
+    def telnet_connections(self) -> int:
+        return sum(router.connections for router in self.routers.values())
+
+    # ---------------------------------------------------------------- node state
+
+    def start_node(self, node_id: str):
+        node = self.nodes[node_id]
+        node["status"] = "started"
+        if node_id in self.routers:
+            self.routers[node_id].start()
+
+    def stop_node(self, node_id: str):
+        node = self.nodes[node_id]
+        node["status"] = "stopped"
+        if node_id in self.routers:
+            self.routers[node_id].stop()
+
+    # ---------------------------------------------------------------- http
+
+    def project(self) -> Dict[str, Any]:
+        return {
+            "name": self.project_name,
+            "project_id": PROJECT_ID,
+            "status": "opened",
+            "filename": f"{self.project_name}.gns3",
+            "path": f"/opt/gns3/projects/{PROJECT_ID}",
+            "auto_close": True,
+            "auto_open": False,
+            "auto_start": False,
+        }
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str):
+        length = int(request.headers.get("Content-Length") or 0)
+        body = json.loads(request.rfile.read(length) or b"null") if length else None
+
+        path = request.path.split("?")[0].rstrip("/")
+        # count by endpoint with the ids replaced so they group nicely
+        endpoint = re.sub(r"[0-9a-f]{8}-[0-9a-f-]{27}", "{id}", path)
+        with self.lock:
+            self.request_counts[f"{method} {endpoint}"] += 1
+
+        if self.http_latency:
+            time.sleep(self.http_latency)
+
+        status, payload = self.route(method, path, body)
+        data = json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def route(self, method: str, path: str, body: Any) -> Tuple[int, Any]:
+        prefix = f"/v2/projects/{PROJECT_ID}"
+        if path in ("", "/v2"):
+            return 200, {}
+        if path == "/v2/version":
+            return 200, {"version": "2.2.33", "local": False}
+        if path == "/v2/projects":
+            return 200, [self.project()]
+        if not path.startswith(prefix):
+            return 404, {"status": 404, "message": f"{path} not found"}
+
+        rest = path[len(prefix) :]
+        if rest == "":
+            return 200, self.project()
+        if rest == "/open" or rest == "/close":
+            return 201, self.project()
+        if rest == "/stats":
+            return 200, {
+                "nodes": len(self.nodes),
+                "links": len(self.links),
+                "drawings": 0,
+                "snapshots": 0,
+            }
+        if rest == "/nodes":
+            return 200, list(self.nodes.values())
+        if rest == "/links":
+            return 200, list(self.links.values())
+        if rest in ("/nodes/start", "/nodes/stop"):
+            for node_id in self.nodes:
+                if rest.endswith("start"):
+                    self.start_node(node_id)
+                else:
+                    self.stop_node(node_id)
+            return 200, {}
+
+        match = re.fullmatch(r"/nodes/([^/]+)(/\w+)?", rest)
+        if match:
+            node_id, action = match.groups()
+            if node_id not in self.nodes:
+                return 404, {"status": 404, "message": "node not found"}
+            if action is None:
+                return 200, self.nodes[node_id]
+            if action == "/links":
+                return 200, [
+                    link
+                    for link in self.links.values()
+                    if any(end["node_id"] == node_id for end in link["nodes"])
+                ]
+            if action == "/start":
+                self.start_node(node_id)
+                return 200, self.nodes[node_id]
+            if action == "/stop":
+                self.stop_node(node_id)
+                return 200, self.nodes[node_id]
+            if action == "/reload":
+                self.stop_node(node_id)
+                self.start_node(node_id)
+                return 200, self.nodes[node_id]
+
+        match = re.fullmatch(r"/links/([^/]+)", rest)
+        if match:
+            link_id = match.group(1)
+            if link_id not in self.links:
+                return 404, {"status": 404, "message": "link not found"}
+            if method == "PUT" and body:
+                self.links[link_id].update(body)
+            return 200, self.links[link_id]
+
+        return 404, {"status": 404, "message": f"{path} not found"}
+
+
+def install_settings(
+    lab: MockLab,
+    output_path: Optional[Path] = None,
+    monkeypatch: Optional[pytest.MonkeyPatch] = None,
+    **overrides,
+):
+    """
+    Make `import settings` return the mock's settings, with any overrides. Any
+    gns3_bgp_frr modules that already did `from settings import *` or read optional
+    settings are patched too, and their cached project, topology, addressing and roles
+    are forgotten.
+
+    If output_path is given everything that would go in `generated` goes there instead.
+    If monkeypatch is given it's used to make the changes, so they're undone after the
+    test.
+    """
+    if monkeypatch is None:
+        monkeypatch = pytest.MonkeyPatch()
+
+    module = lab.settings_module()
+    for key, value in overrides.items():
+        setattr(module, key, value)
+    monkeypatch.setitem(sys.modules, "settings", module)
+
+    # import them all now so they're all patched
+    from gns3_bgp_frr import addressing, configs, gns3, metrics, roles, telnet, topology
+
+    for name, loaded in list(sys.modules.items()):
+        if name.startswith("gns3_bgp_frr") and loaded is not None:
+            for key in dir(module):
+                if key.isupper() and hasattr(loaded, key):
+                    monkeypatch.setattr(loaded, key, getattr(module, key))
+            # and ones that did `import settings`
+            if isinstance(getattr(loaded, "settings", None), types.ModuleType):
+                monkeypatch.setattr(loaded, "settings", module)
+
+    monkeypatch.setattr(gns3, "_gns3_server", None)
+    monkeypatch.setattr(gns3, "_project", None)
+    monkeypatch.setattr(topology, "_topology", None)
+    monkeypatch.setattr(addressing, "_interface_ips", None)
+    monkeypatch.setattr(roles, "_roles", None)
+    metrics.reset()
+    # sessions to another lab's ports
+    telnet.pool.close_all()
+
+    if output_path is not None:
+        output_path.mkdir(parents=True, exist_ok=True)
+        monkeypatch.setattr(topology, "snapshot_path", output_path / "topology.json")
+        monkeypatch.setattr(
+            addressing, "addressing_path", output_path / "addressing.json"
+        )
+        monkeypatch.setattr(
+            addressing, "allocations_path", output_path / "allocations.json"
+        )
+        monkeypatch.setattr(configs, "output_folder_path", output_path)
+        monkeypatch.setattr(configs, "applied_state_path", output_path / "applied.json")
+
+    return module
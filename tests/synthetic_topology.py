@@ -0,0 +1,254 @@
+"""
+Builds synthetic GNS3 topologies shaped like the lab in `project.gns3project`, but with
+any number of routers. Used by the mock GNS3 server and the benchmarks.
+
+The output is plain dicts in the same shape the GNS3 REST API returns, minus anything
+that depends on a running server (console ports, status).
+"""
+import json
+import uuid
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+FRR_IMAGE = "frrouting/frr:v8.2.2"
+ALPINE_IMAGE = "alpine:latest"
+
+# generate the same uuids for the same topology so runs are repeatable
+_uuid_namespace = uuid.UUID("0c7d1f2e-3f61-4a0a-9a70-0d3d1d6f3b10")
+
+
+def _node_id(name: str) -> str:
+    return str(uuid.uuid5(_uuid_namespace, name))
+
+
+def _link_id(index: int) -> str:
+    return str(uuid.uuid5(_uuid_namespace, f"link-{index}"))
+
+
+class _Builder:
+    def __init__(self):
+        self.nodes: Dict[str, Dict[str, Any]] = {}
+        self.links: List[Dict[str, Any]] = []
+        # next free adapter per node
+        self.next_adapter: Dict[str, int] = {}
+        # adapters that have been reserved for specific links
+        self.reserved: Dict[str, set] = {}
+
+    def add_node(self, name: str, node_type: str = "docker", image: str = FRR_IMAGE):
+        properties: Dict[str, Any] = {}
+        if node_type == "docker":
+            properties["image"] = image
+        self.nodes[name] = {
+            "name": name,
+            "node_id": _node_id(name),
+            "node_type": node_type,
+            "properties": properties,
+        }
+        self.next_adapter[name] = 0
+        self.reserved[name] = set()
+
+    def reserve(self, name: str, adapter: int):
+        self.reserved[name].add(adapter)
+
+    def _take_adapter(self, name: str, adapter: Optional[int]) -> int:
+        if adapter is not None:
+            return adapter
+        while self.next_adapter[name] in self.reserved[name]:
+            self.next_adapter[name] += 1
+        adapter = self.next_adapter[name]
+        self.next_adapter[name] += 1
+        return adapter
+
+    def add_link(
+        self,
+        name_a: str,
+        name_b: str,
+        adapter_a: Optional[int] = None,
+        adapter_b: Optional[int] = None,
+    ):
+        adapter_a = self._take_adapter(name_a, adapter_a)
+        adapter_b = self._take_adapter(name_b, adapter_b)
+        self.links.append(
+            {
+                "link_id": _link_id(len(self.links)),
+                "link_type": "ethernet",
+                "nodes": [
+                    _link_end(self.nodes[name_a], adapter_a),
+                    _link_end(self.nodes[name_b], adapter_b),
+                ],
+            }
+        )
+
+    def build(self) -> Dict[str, List[Dict[str, Any]]]:
+        # give every node enough ports for its links, at least the 8 from the README
+        used: Dict[str, int] = {name: 0 for name in self.nodes}
+        for link in self.links:
+            for end in link["nodes"]:
+                name = end["_name"]
+                used[name] = max(used[name], end["adapter_number"] + 1)
+        for name, node in self.nodes.items():
+            if node["node_type"] == "docker":
+                adapters = max(8, used[name])
+                node["properties"]["adapters"] = adapters
+                node["ports"] = [
+                    {
+                        "name": f"eth{number}",
+                        "short_name": f"eth{number}",
+                        "adapter_number": number,
+                        "port_number": 0,
+                        "link_type": "ethernet",
+                    }
+                    for number in range(adapters)
+                ]
+            else:
+                node["ports"] = [
+                    {
+                        "name": f"Ethernet{number}",
+                        "short_name": f"e{number}",
+                        "adapter_number": 0,
+                        "port_number": number,
+                        "link_type": "ethernet",
+                    }
+                    for number in range(max(8, used[name]))
+                ]
+        for link in self.links:
+            for end in link["nodes"]:
+                del end["_name"]
+        return {"nodes": list(self.nodes.values()), "links": self.links}
+
+
+def _link_end(node: Dict[str, Any], adapter: int) -> Dict[str, Any]:
+    # non-docker builtins (switch, cloud) use port numbers on a single adapter
+    if node["node_type"] == "docker":
+        adapter_number, port_number = adapter, 0
+    else:
+        adapter_number, port_number = 0, adapter
+    return {
+        "_name": node["name"],
+        "node_id": node["node_id"],
+        "adapter_number": adapter_number,
+        "port_number": port_number,
+        "label": {
+            "text": "",
+            "style": "font-family: TypeWriter;font-size: 10.0;font-weight: bold;fill: #000000;fill-opacity: 1.0;",
+            "x": 0,
+            "y": 0,
+            "rotation": 0,
+        },
+    }
+
+
+def generate_topology(
+    router_count: int = 15, asn_count: Optional[int] = None
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Generate a lab like the README's with roughly `router_count` FRR routers in
+    `asn_count` ASNs.
+
+    - asn1 has border and internal routers. Every border is linked to two internals and
+      the internals form a ring.
+    - asn1border1 and asn1border2 use eth7 for the external LAN, like the real lab.
+    - the rest of the routers are spread over the other ASNs as border routers, one
+      each by default. They form a chain, and the first in each ASN also links to one
+      of the asn1 borders.
+    - asn6 also gets asn6cpe1, with alpine-1 behind it on eth0.
+    """
+    router_count = max(router_count, 11)
+    asn1_border_count = max(3, router_count // 20)
+    asn1_internal_count = max(2, router_count // 20)
+    # the rest are in the other ASNs, minus the cpe
+    other_count = router_count - asn1_border_count - asn1_internal_count - 1
+    if asn_count is None:
+        asn_count = other_count + 1
+    # at least up to asn6 for the cpe, at most one router each
+    asn_count = min(max(asn_count, 6), other_count + 1)
+
+    builder = _Builder()
+    builder.add_node("LAN", node_type="cloud")
+    builder.add_node("Switch1", node_type="ethernet_switch")
+    builder.add_link("LAN", "Switch1")
+
+    borders = [f"asn1border{number}" for number in range(1, asn1_border_count + 1)]
+    internals = [
+        f"asn1internal{number}" for number in range(1, asn1_internal_count + 1)
+    ]
+    for name in borders + internals:
+        builder.add_node(name)
+
+    # external links on eth7
+    for name in borders[:2]:
+        builder.reserve(name, 7)
+        builder.add_link(name, "Switch1", adapter_a=7)
+
+    for index, border in enumerate(borders):
+        builder.add_link(border, internals[index % asn1_internal_count])
+        builder.add_link(border, internals[(index + 1) % asn1_internal_count])
+    if asn1_internal_count > 2:
+        for index, internal in enumerate(internals):
+            builder.add_link(internal, internals[(index + 1) % asn1_internal_count])
+    elif asn1_internal_count == 2:
+        builder.add_link(internals[0], internals[1])
+
+    # (name, index of its ASN after asn1 if it's the first router in it)
+    others: List[Tuple[str, Optional[int]]] = []
+    other_asn_count = asn_count - 1
+    for index in range(other_asn_count):
+        count = other_count // other_asn_count
+        count += 1 if index < other_count % other_asn_count else 0
+        for number in range(1, count + 1):
+            others.append(
+                (f"asn{index + 2}border{number}", index if number == 1 else None)
+            )
+    for name, _ in others:
+        builder.add_node(name)
+    for index, (name, asn_index) in enumerate(others):
+        if index + 1 < len(others):
+            builder.add_link(name, others[index + 1][0])
+        if asn_index is not None:
+            builder.add_link(name, borders[asn_index % asn1_border_count])
+
+    builder.add_node("asn6cpe1")
+    builder.add_node("alpine-1", image=ALPINE_IMAGE)
+    builder.add_link("asn6cpe1", "alpine-1", adapter_a=0, adapter_b=0)
+    builder.reserve("asn6cpe1", 0)
+    builder.add_link("asn6cpe1", "asn6border1")
+
+    return builder.build()
+
+
+def load_project_file(path: Path) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Load the topology from a portable `.gns3project` export like the one in the repo
+    root.
+    """
+    with zipfile.ZipFile(path) as archive:
+        project_file = next(
+            name for name in archive.namelist() if name.endswith(".gns3")
+        )
+        topology = json.loads(archive.read(project_file))["topology"]
+
+    builder = _Builder()
+    names_by_id = {}
+    for node in topology["nodes"]:
+        image = (node.get("properties") or {}).get("image", FRR_IMAGE)
+        builder.add_node(node["name"], node_type=node["node_type"], image=image)
+        names_by_id[node["node_id"]] = node["name"]
+
+    for link in topology["links"]:
+        ends = link["nodes"]
+        adapters = []
+        for end in ends:
+            name = names_by_id[end["node_id"]]
+            if builder.nodes[name]["node_type"] == "docker":
+                adapters.append(end["adapter_number"])
+            else:
+                adapters.append(end["port_number"])
+        builder.add_link(
+            names_by_id[ends[0]["node_id"]],
+            names_by_id[ends[1]["node_id"]],
+            adapter_a=adapters[0],
+            adapter_b=adapters[1],
+        )
+
+    return builder.build()
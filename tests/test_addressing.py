@@ -0,0 +1,135 @@
+import pathfix
+import pytest
+from gns3_bgp_frr import addressing, topology
+from test_topology import make_topology
+
+########## test working out and caching the addressing plan
+
+
+def use_topology(monkeypatch, tmp_path):
+    project_topology = make_topology()
+    monkeypatch.setattr(topology, "_topology", project_topology)
+    monkeypatch.setattr(addressing, "_interface_ips", None)
+    monkeypatch.setattr(addressing, "addressing_path", tmp_path / "addressing.json")
+    monkeypatch.setattr(addressing, "allocations_path", tmp_path / "allocations.json")
+    monkeypatch.setattr(addressing, "P2P_SUPERNET", "10.0.0.0/24")
+    monkeypatch.setattr(addressing, "P2P_PREFIXLEN", 30)
+    monkeypatch.setattr(addressing, "P2P_SUPERNET_V6", None)
+    monkeypatch.setattr(addressing, "ASN_SUPERNETS", {})
+    return project_topology
+
+
+def test_link_gets_a_p2p_subnet(monkeypatch, tmp_path):
+    use_topology(monkeypatch, tmp_path)
+    assert addressing.get_interface_ips() == {
+        "asn2border1": {"eth0": "10.0.0.129/30"},
+        "asn3border1": {"eth0": "10.0.0.130/30"},
+    }
+    assert addressing.get_interface_ips(version=6) == {}
+
+
+def test_p2p_31s_and_ipv6(monkeypatch, tmp_path):
+    use_topology(monkeypatch, tmp_path)
+    monkeypatch.setattr(addressing, "P2P_PREFIXLEN", 31)
+    monkeypatch.setattr(addressing, "P2P_SUPERNET_V6", "fd00::/64")
+    assert addressing.get_interface_ips() == {
+        "asn2border1": {"eth0": "10.0.0.128/31"},
+        "asn3border1": {"eth0": "10.0.0.129/31"},
+    }
+    assert addressing.get_interface_ips(version=6) == {
+        "asn2border1": {"eth0": "fd00::8000:0:0:0/127"},
+        "asn3border1": {"eth0": "fd00::8000:0:0:1/127"},
+    }
+
+
+def test_links_inside_an_asn_use_its_pool(monkeypatch, tmp_path):
+    project_topology = use_topology(monkeypatch, tmp_path)
+    # make it an asn2 internal link
+    project_topology.asns["id-2"] = 2
+    monkeypatch.setattr(addressing, "ASN_SUPERNETS", {2: "10.2.0.0/24"})
+    assert addressing.get_interface_ips()["asn2border1"]["eth0"] == "10.2.0.1/30"
+
+    monkeypatch.setattr(addressing, "ASN_SUPERNETS", {2: "10.0.0.128/25"})
+    with pytest.raises(ValueError):
+        addressing.get_interface_ips()
+
+
+def test_plan_is_reused_until_settings_change(monkeypatch, tmp_path):
+    use_topology(monkeypatch, tmp_path)
+    calls = []
+    assign = addressing.assign_interface_ips
+    monkeypatch.setattr(
+        addressing,
+        "assign_interface_ips",
+        lambda *args, **kwargs: calls.append(1) or assign(*args, **kwargs),
+    )
+
+    first = addressing.get_interface_ips()
+    assert addressing.get_interface_ips() is first
+    # as if it's a new run
+    monkeypatch.setattr(addressing, "_interface_ips", None)
+    assert addressing.get_interface_ips() == first
+    assert len(calls) == 1
+
+    monkeypatch.setattr(addressing, "P2P_SUPERNET", "10.1.0.0/24")
+    assert addressing.get_interface_ips()["asn2border1"]["eth0"] == "10.1.0.129/30"
+    assert len(calls) == 2
+
+
+def set_links(monkeypatch, *links):
+    """
+    Replace the test topology's links with ones between the given (node ID, port)
+    pairs. Every router gets two ports.
+    """
+    nodes = make_topology().nodes + [
+        topology.Node(
+            node_id="id-3",
+            name="asn4border1",
+            properties={"image": "frrouting/frr:latest"},
+        )
+    ]
+    for node in nodes:
+        node.ports = [
+            {"name": f"eth{index}", "adapter_number": index, "port_number": 0}
+            for index in range(2)
+        ]
+    links = [
+        topology.Link(
+            link_id=f"link-{first}-{second}",
+            nodes=[
+                {"node_id": node_id, "adapter_number": port, "port_number": 0}
+                for node_id, port in (first, second)
+            ],
+        )
+        for first, second in links
+    ]
+    project_topology = topology.Topology(
+        project_name=topology.PROJECT_NAME,
+        server_url=topology.GNS3_SERVER_URL,
+        revision=topology.get_revision(nodes, links),
+        nodes=nodes,
+        links=links,
+    )
+    monkeypatch.setattr(topology, "_topology", project_topology)
+
+
+def test_links_keep_their_subnets_when_others_change(monkeypatch, tmp_path):
+    use_topology(monkeypatch, tmp_path)
+    first_link = (("id-1", 0), ("id-2", 0))
+    second_link = (("id-1", 1), ("id-3", 0))
+    third_link = (("id-2", 1), ("id-3", 1))
+
+    set_links(monkeypatch, first_link)
+    assert addressing.get_interface_ips()["asn2border1"]["eth0"] == "10.0.0.129/30"
+
+    # a new link ahead of it in the project doesn't renumber it
+    set_links(monkeypatch, second_link, first_link)
+    interface_ips = addressing.get_interface_ips()
+    assert interface_ips["asn2border1"]["eth0"] == "10.0.0.129/30"
+    assert interface_ips["asn2border1"]["eth1"] == "10.0.0.133/30"
+
+    # removing it frees its subnet for the next new link
+    set_links(monkeypatch, second_link, third_link)
+    interface_ips = addressing.get_interface_ips()
+    assert interface_ips["asn2border1"]["eth1"] == "10.0.0.133/30"
+    assert interface_ips["asn3border1"]["eth1"] == "10.0.0.129/30"
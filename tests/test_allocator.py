@@ -0,0 +1,55 @@
+import pathfix
+import pytest
+from netaddr import IPNetwork
+from gns3_bgp_frr import allocator
+
+########## test handing out link subnets
+
+
+def test_subnets_are_handed_out_lowest_first_until_full():
+    pool = allocator.SubnetPool("10.0.0.0/29", 30)
+    assert pool.allocate() == IPNetwork("10.0.0.0/30")
+    assert pool.allocate() == IPNetwork("10.0.0.4/30")
+    assert len(pool) == 2
+    with pytest.raises(IndexError):
+        pool.allocate()
+
+
+def test_released_and_reserved_subnets():
+    pool = allocator.SubnetPool("10.0.0.0/24", 31)
+    assert pool.reserve("10.0.0.2/31")
+    assert not pool.reserve("10.0.0.2/31")
+    assert pool.allocate() == IPNetwork("10.0.0.0/31")
+    # skips the reserved one
+    assert pool.allocate() == IPNetwork("10.0.0.4/31")
+
+    pool.release("10.0.0.0/31")
+    assert not pool.is_allocated("10.0.0.0/31")
+    assert pool.allocate() == IPNetwork("10.0.0.0/31")
+
+    with pytest.raises(ValueError):
+        pool.reserve("10.0.1.0/31")
+    with pytest.raises(ValueError):
+        pool.reserve("10.0.0.0/30")
+
+
+def test_huge_pools_cost_nothing_up_front():
+    pool = allocator.SubnetPool("fd00::/48", 127)
+    assert pool.size == 2**79
+    assert pool.allocate() == IPNetwork("fd00::/127")
+    assert len(pool._bits) < 100
+
+
+def test_p2p_ips():
+    assert allocator.get_p2p_ips(IPNetwork("10.0.0.4/30")) == [
+        "10.0.0.5/30",
+        "10.0.0.6/30",
+    ]
+    assert allocator.get_p2p_ips(IPNetwork("10.0.0.4/31")) == [
+        "10.0.0.4/31",
+        "10.0.0.5/31",
+    ]
+    assert allocator.get_p2p_ips(IPNetwork("fd00::2/127")) == [
+        "fd00::2/127",
+        "fd00::3/127",
+    ]
@@ -0,0 +1,110 @@
+import pathfix
+from gns3_bgp_frr import config_diff
+
+########## test diffing generated configs against running configs
+
+generated = """\
+!========== base config
+interface eth0
+ ip address 10.0.0.1/30
+!
+!========== BGP config
+bfd
+ peer 10.0.0.2
+   no shutdown
+ !
+router bgp 2
+ no bgp network import-check
+ neighbor 10.0.0.2 remote-as 3
+ neighbor 10.0.0.2 timers 1 3
+ !
+ address-family ipv4 unicast
+  redistribute connected
+  !
+ exit-address-family
+exit
+!
+"""
+
+running_output = """\
+vtysh -c 'show running-config'\r
+Building configuration...\r
+\r
+Current configuration:\r
+!\r
+frr version 8.2.2_git\r
+frr defaults traditional\r
+hostname asn2border1\r
+service integrated-vtysh-config\r
+!\r
+interface eth0\r
+ ip address 10.0.0.1/30\r
+exit\r
+!\r
+bfd\r
+ peer 10.0.0.2\r
+ exit\r
+ !\r
+exit\r
+!\r
+router bgp 2\r
+ no bgp network import-check\r
+ neighbor 10.0.0.2 remote-as 3\r
+ neighbor 10.0.0.2 timers 1 3\r
+ !\r
+ address-family ipv4 unicast\r
+  redistribute connected\r
+ exit-address-family\r
+exit\r
+!\r
+end\r
+/ # """
+
+
+def running() -> config_diff.ConfigTree:
+    return config_diff.parse_config(config_diff.extract_running_config(running_output))
+
+
+def test_parse_merges_repeated_sections():
+    tree = config_diff.parse_config(
+        "interface eth0\n ip address 10.0.0.1/30\n!\ninterface eth0\n no ip ospf passive\n"
+    )
+    assert tree == {
+        "interface eth0": {"ip address 10.0.0.1/30": {}, "no ip ospf passive": {}}
+    }
+
+
+def test_matching_configs_have_no_diff():
+    desired = config_diff.parse_config(generated)
+    assert config_diff.diff_configs(running(), desired) == []
+
+
+def test_changed_line_is_removed_then_added_in_context():
+    desired = config_diff.parse_config(generated.replace("timers 1 3", "timers 2 6"))
+    assert config_diff.diff_configs(running(), desired) == [
+        "router bgp 2",
+        "no neighbor 10.0.0.2 timers 1 3",
+        "neighbor 10.0.0.2 timers 2 6",
+        "exit",
+    ]
+
+
+def test_removed_sections_are_negated_and_interfaces_emptied():
+    desired = config_diff.parse_config("bfd\n peer 10.0.0.2\n")
+    assert config_diff.diff_configs(running(), desired) == [
+        "interface eth0",
+        "no ip address 10.0.0.1/30",
+        "exit",
+        "no router bgp 2",
+    ]
+
+
+def test_new_sections_are_sent_whole():
+    desired = config_diff.parse_config(
+        generated + "router ospf\n ospf router-id 0.0.2.1\n"
+    )
+    assert config_diff.diff_configs(running(), desired) == [
+        "router ospf",
+        "ospf router-id 0.0.2.1",
+        "exit",
+    ]
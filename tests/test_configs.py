@@ -0,0 +1,57 @@
+import pathfix
+from gns3_bgp_frr import configs, roles
+from test_addressing import use_topology
+
+########## test rendering and writing out configs
+
+
+def test_write_if_changed(tmp_path):
+    path = tmp_path / "asn2border1.ios"
+    assert configs.write_if_changed(path, "hostname asn2border1\n")
+    assert not configs.write_if_changed(path, "hostname asn2border1\n")
+    assert configs.write_if_changed(path, "hostname asn2border2\n")
+    assert path.read_text() == "hostname asn2border2\n"
+    assert [file.name for file in tmp_path.iterdir()] == ["asn2border1.ios"]
+
+
+def test_only_changed_configs_are_written(monkeypatch, tmp_path):
+    use_topology(monkeypatch, tmp_path)
+    monkeypatch.setattr(roles, "_roles", None)
+    monkeypatch.setattr(configs, "output_folder_path", tmp_path)
+    assert configs.generate_configs() == ["asn2border1", "asn3border1"]
+    assert configs.generate_configs() == []
+    serial = (tmp_path / "asn2border1.ios").read_text()
+
+    # the same configs come out of the workers
+    monkeypatch.setattr(configs, "PARALLEL_RENDER_MIN_ROUTERS", 0)
+    monkeypatch.setattr(configs, "RENDER_WORKERS", 2)
+    (tmp_path / "asn2border1.ios").unlink()
+    assert configs.generate_configs() == ["asn2border1"]
+    assert (tmp_path / "asn2border1.ios").read_text() == serial
+
+
+def test_default_originated_only_from_addressed_external_ports(tmp_path):
+    ospf_template = configs.get_environment(tmp_path).get_template("ospf.j2")
+    router_roles = {
+        name: roles.RouterRole(
+            name=name,
+            asn=3,
+            internal_ports=["eth0"],
+            external_ports=["eth1"],
+            ospf=True,
+        )
+        for name in ("asn3border1", "asn3border2")
+    }
+    # asn3border2 isn't in EXTERNAL_IPS, so its external port has no address
+    interface_ips = {
+        "asn3border1": {"eth0": "10.0.0.1/30", "eth1": "192.168.1.253/24"},
+        "asn3border2": {"eth0": "10.0.0.2/30"},
+    }
+
+    def render(name):
+        return configs.generate_ospf_config(
+            name, ospf_template, interface_ips, router_roles
+        )
+
+    assert "default-information originate" in render("asn3border1")
+    assert "default-information originate" not in render("asn3border2")
@@ -0,0 +1,95 @@
+import pathfix
+from gns3_bgp_frr import convergence
+
+########## test reading sessions out of configs and show output
+
+
+config = """
+interface eth0
+ ip address 10.0.0.1/30
+interface eth1
+ ip address 10.0.0.5/30
+!
+router ospf
+ passive-interface default
+!
+interface eth1
+ no ip ospf passive
+!
+bfd
+ peer 10.0.0.2
+   no shutdown
+ !
+router bgp 1
+ neighbor 10.0.0.2 remote-as 2
+ neighbor 10.0.0.2 bfd
+ !
+ address-family ipv4 unicast
+  neighbor 10.0.0.2 prefix-list allow-all in
+ exit-address-family
+exit
+"""
+
+
+def test_get_expected_sessions():
+    expected = convergence.get_expected_sessions(config)
+    assert expected.bgp == {"10.0.0.2"}
+    assert expected.bfd == {"10.0.0.2"}
+    assert expected.ospf == 1
+
+
+def test_parse_json_outputs():
+    commands = [convergence.bgp_summary_command, convergence.bfd_peers_command]
+    output = (
+        f"/ # {commands[0]}\r\n"
+        '{"ipv4Unicast":{"peers":{"10.0.0.2":{"state":"Established","pfxRcd":3}}}}\r\n'
+        f"/ # {commands[1]}\r\n"
+        "% bfdd is not running\r\n/ # "
+    )
+    summary, bfd = convergence.parse_json_outputs(output, commands)
+    assert convergence.get_bgp_peers(summary) == {"10.0.0.2": ("Established", 3)}
+    assert bfd is None
+    assert convergence.get_up_bfd_peers(bfd) == set()
+
+
+def test_count_full_ospf_neighbors():
+    neighbors = {
+        "neighbors": {
+            "0.0.1.1": [{"nbrState": "Full/-"}],
+            "0.0.1.2": [{"nbrState": "ExStart/-"}],
+            "0.0.1.3": [{"state": "Full/DR"}],
+        }
+    }
+    assert convergence.count_full_ospf_neighbors(neighbors) == 2
+
+
+def test_is_settled():
+    state = convergence.RouterConvergence(
+        "r1", convergence.get_expected_sessions(config)
+    )
+    state.bgp_established = state.bfd_up = state.ospf_full = 1
+    assert state.sessions_up
+    state.converged_at, state.polled_at = 1.0, 4.0
+    assert state.is_settled(3)
+    assert not state.is_settled(5)
+
+
+def test_parse_json_outputs_with_wrapped_echoes():
+    commands = [convergence.bgp_summary_command, convergence.ospf_neighbor_command]
+    # the terminal wraps long commands, and JSON can contain `# ` too
+    output = (
+        "\x07;5Rvtysh -c 'show bgp sum\r\nmary json'\r\n"
+        '{"ipv4Unicast":{"peers":{"10.0.0.2":{"state":"Active","desc":"# "}}}}\r\n'
+        "/ # vtysh -c 'show ip ospf nei \rghbor json'\r\n"
+        '{\r\n  "neighbors":{\r\n    "0.0.1.1":[{"nbrState":"Full/-"}]\r\n  }\r\n}\r\n'
+        "/ # "
+    )
+    summary, neighbors = convergence.parse_json_outputs(output, commands)
+    assert convergence.get_bgp_peers(summary) == {"10.0.0.2": ("Active", 0)}
+    assert convergence.count_full_ospf_neighbors(neighbors) == 1
+
+    # a prompt missing means it didn't finish
+    assert convergence.parse_json_outputs(output[: -len("/ # ")], commands) == [
+        None,
+        None,
+    ]
@@ -0,0 +1,39 @@
+import pathfix
+import pytest
+from gns3_bgp_frr import metrics
+
+########## test counting and timing I/O
+
+
+def test_histogram_buckets():
+    histogram = metrics.Histogram()
+    for seconds in (0.0005, 0.001, 0.2, 30):
+        histogram.observe(seconds)
+    recorded = histogram.to_dict()
+    assert recorded["count"] == 4
+    assert recorded["max"] == 30
+    assert recorded["total"] == pytest.approx(30.2015)
+    assert recorded["buckets"]["<=0.001s"] == 2
+    assert recorded["buckets"]["<=0.5s"] == 1
+    assert recorded["buckets"][">10s"] == 1
+
+
+def test_requests_for_different_nodes_count_together(monkeypatch):
+    monkeypatch.setattr(metrics, "counters", {})
+    monkeypatch.setattr(metrics, "histograms", {})
+    project = "6f5c5b8e-2b6f-4d3a-9d8f-6a2b9b1f0c11"
+    for node in (
+        "0c7d1f2e-3f61-4a0a-9a70-0d3d1d6f3b10",
+        "9a70aaaa-3f61-4a0a-9a70-0d3d1d6f3b10",
+    ):
+        assert (
+            metrics.get_endpoint(
+                f"http://example:3080/v2/projects/{project}/nodes/{node}/start?x=1"
+            )
+            == "/v2/projects/{id}/nodes/{id}/start"
+        )
+    metrics.count("telnet bytes sent", 10)
+    metrics.count("telnet bytes sent", 5)
+    metrics.observe("telnet connect", 0.002)
+    assert metrics.to_dict()["counters"] == {"telnet bytes sent": 15}
+    assert metrics.to_dict()["histograms"]["telnet connect"]["count"] == 1
@@ -0,0 +1,378 @@
+import json
+from time import perf_counter, sleep
+import pathfix
+import pytest
+import mock_gns3
+import synthetic_topology
+from gns3_bgp_frr import config_diff, configs, gns3, metrics, telnet, topology
+
+########## test the whole pipeline against a mock GNS3 server and FRR nodes
+
+
+@pytest.fixture
+def lab(request, monkeypatch, tmp_path):
+    """
+    The example project (or a synthetic one with the given number of routers), served
+    by a mock and installed as this test's settings.
+    """
+    router_count = getattr(request, "param", None)
+    if router_count is None:
+        topology = synthetic_topology.load_project_file(
+            mock_gns3.root_path / "project.gns3project"
+        )
+    else:
+        topology = synthetic_topology.generate_topology(router_count, asn_count=8)
+    mock_lab = mock_gns3.MockLab(topology)
+    mock_lab.start()
+    mock_gns3.install_settings(
+        mock_lab, tmp_path / "generated", monkeypatch, P2P_SUPERNET="10.0.0.0/16"
+    )
+    yield mock_lab
+    mock_lab.close()
+
+
+def run(*arguments: str):
+    import manage
+
+    manage.cli(list(arguments), standalone_mode=False)
+
+
+def test_example_project_end_to_end(lab, tmp_path):
+    run("set-up", "generate-configs", "apply-configs")
+    # compiled templates are cached with the rest of the output
+    assert list((tmp_path / "generated" / "template_cache").glob("*.cache"))
+
+    running = lab.router("asn1border1").render_running_config()
+    assert "router bgp 1" in running
+    assert "router ospf" in running
+    # saved, so it survives a restart
+    assert lab.router("asn2border1").files["/etc/frr/frr.conf"]
+    assert "bgpd=yes" in lab.router("asn2border1").files["/etc/frr/daemons"]
+    assert "address" in lab.router("alpine-1").files["/etc/network/interfaces"]
+    # the ends of each link are labelled with their IPs
+    labels = [
+        end["label"]["text"] for link in lab.links.values() for end in link["nodes"]
+    ]
+    assert any(label.startswith("eth0\n10.0.") for label in labels)
+
+    # every API call was timed
+    http_requests = sum(
+        histogram.count
+        for name, histogram in metrics.histograms.items()
+        if name.startswith("http ")
+    )
+    assert http_requests == sum(lab.request_counts.values())
+    assert metrics.counters.get("telnet read timeouts", 0) == 0
+
+    # nothing's changed, so nothing's sent again
+    commands = lab.telnet_commands()
+    run("generate-configs", "apply-configs")
+    assert configs.generate_configs() == []
+    # just the checks for changes made by hand
+    assert lab.telnet_commands() - commands <= len(lab.routers)
+
+
+def test_topology_snapshot(lab, monkeypatch, tmp_path, capsys):
+    real_snapshot = mock_gns3.root_path / "generated" / "topology.json"
+    before = real_snapshot.stat().st_mtime if real_snapshot.exists() else None
+    run("set-up")
+    # saved with the test's output, not over the real one
+    assert (tmp_path / "generated" / "topology.json").exists()
+    after = real_snapshot.stat().st_mtime if real_snapshot.exists() else None
+    assert after == before
+
+    # refreshing reads the topology again, even after connecting earlier in the run
+    link_count = len(topology.get_topology().links)
+    removed = lab.links.pop(next(iter(lab.links)))
+    run("generate-configs", "--refresh-topology")
+    assert len(topology.get_topology().links) == link_count - 1
+
+    # a later run that connects says if configs were generated from an old snapshot
+    lab.links[removed["link_id"]] = removed
+    monkeypatch.setattr(gns3, "_project", None)
+    monkeypatch.setattr(topology, "_topology", None)
+    capsys.readouterr()
+    gns3.get_project()
+    assert "has changed in GNS3" in capsys.readouterr().out
+    assert len(topology.load_snapshot().links) == link_count
+
+
+@pytest.mark.parametrize("concurrency", ["0", "-1"])
+def test_concurrency_must_be_positive(concurrency):
+    import rich_click as click
+
+    with pytest.raises(click.BadParameter):
+        run("--concurrency", concurrency, "stop-all")
+
+
+def test_ready_with_stock_daemons_file(lab, monkeypatch):
+    # the mock routers start with it, which has settings like `vtysh_enable=yes` as
+    # well as daemons
+    assert "vtysh_enable=yes" in lab.router("asn1border1").files["/etc/frr/daemons"]
+    monkeypatch.setattr(gns3, "READY_TIMEOUT", 5)
+    run("set-up", "wait-ready")
+    assert gns3.check_ready(gns3.project.get_node(name="asn1border1")) is None
+
+
+def test_ready_skips_nodes_without_a_console(lab, monkeypatch):
+    # e.g. a docker node added with its console set to none
+    node_id = next(
+        node_id for node_id, node in lab.nodes.items() if node["name"] == "asn1border1"
+    )
+    lab.nodes[node_id]["console"] = None
+    lab.nodes[node_id]["properties"]["aux"] = None
+    monkeypatch.setattr(gns3, "READY_TIMEOUT", 5)
+    started = perf_counter()
+    run("start-all", "wait-ready")
+    assert perf_counter() - started < gns3.READY_TIMEOUT
+    assert gns3.get_telnet_port(gns3.project.get_node(name="asn1border1")) is None
+
+
+def test_unaddressed_external_port(lab, monkeypatch, tmp_path):
+    from gns3_bgp_frr import addressing
+
+    monkeypatch.setattr(addressing, "EXTERNAL_IPS", {"asn1border1": "192.168.1.251/24"})
+    run("generate-configs")
+    assert (
+        "default-information originate"
+        in (tmp_path / "generated" / "asn1border1.ios").read_text()
+    )
+    # no address so nowhere to send it
+    assert (
+        "default-information originate"
+        not in (tmp_path / "generated" / "asn1border2.ios").read_text()
+    )
+
+
+def get_applied_routers(lab, since):
+    """
+    The routers that had a config loaded since `since` (from `get_history_lengths()`).
+    """
+    return {
+        router.name
+        for router in lab.routers.values()
+        if any(
+            line.startswith("vtysh -f ")
+            for line in router.history[since[router.name] :]
+        )
+    }
+
+
+def get_history_lengths(lab):
+    return {router.name: len(router.history) for router in lab.routers.values()}
+
+
+def assert_running_configs_match(lab, output_path):
+    for router in lab.routers.values():
+        if router.frr:
+            generated = (output_path / f"{router.name}.ios").read_text()
+            running = config_diff.parse_config(router.render_running_config())
+            assert (
+                config_diff.diff_configs(running, config_diff.parse_config(generated))
+                == []
+            ), router.name
+
+
+def test_apply_configs_resends_drifted_and_forced(lab):
+    run("set-up", "generate-configs", "apply-configs")
+    frr_routers = {router.name for router in lab.routers.values() if router.frr}
+
+    # changed by hand since the last apply
+    lab.router("asn3border1").files["/etc/frr/frr.conf"] += "! changed by hand\n"
+    since = get_history_lengths(lab)
+    run("apply-configs")
+    assert get_applied_routers(lab, since) == {"asn3border1"}
+
+    since = get_history_lengths(lab)
+    run("apply-configs", "--force")
+    assert get_applied_routers(lab, since) == frr_routers
+
+
+def test_incremental_apply_sends_only_the_differences(lab, monkeypatch, tmp_path):
+    run("set-up", "generate-configs", "apply-configs")
+    # only changes the routers that peer with the external gateway
+    monkeypatch.setattr(configs.settings, "EXTERNAL_GATEWAY_ASN", 64513)
+    since = get_history_lengths(lab)
+    run("generate-configs", "apply-configs", "--incremental")
+
+    configured = {
+        router.name
+        for router in lab.routers.values()
+        if "conf t" in router.history[since[router.name] :]
+    }
+    assert configured == {"asn1border1", "asn1border2"}
+    assert_running_configs_match(lab, tmp_path / "generated")
+
+
+def test_write_file_in_chunks(lab):
+    run("start-all")
+    router = lab.router("asn2border1")
+    node = gns3.project.get_node(name="asn2border1")
+    # quotes, backslashes and line endings the shell would otherwise mangle
+    contents = "".join(f"line {index} 'quoted' \\ $HOME\r\n" for index in range(100))
+    since = len(router.history)
+    gns3.write_file(node, "/tmp/written", contents)
+
+    assert router.files["/tmp/written"] == contents
+    chunks = [line for line in router.history[since:] if line.startswith("echo ")]
+    assert len(chunks) > 1
+    assert all(len(chunk) < gns3.WRITE_FILE_CHUNK_SIZE + 40 for chunk in chunks)
+    # the temporary file is cleaned up
+    assert "/tmp/written.b64" not in router.files
+
+    router.corrupt_writes = 1
+    with pytest.raises(gns3.ChecksumError):
+        gns3.write_file(node, "/tmp/written", contents + "more")
+
+
+def test_bulk_apply_falls_back_to_line_by_line(lab, tmp_path):
+    run("set-up", "generate-configs")
+    router = lab.router("asn2border1")
+    router.corrupt_writes = 1
+    since = get_history_lengths(lab)
+    run("apply-configs")
+
+    assert "conf t" in router.history[since[router.name] :]
+    assert not any(
+        line.startswith("vtysh -f ") for line in router.history[since[router.name] :]
+    )
+    # the others were still copied in whole
+    assert "asn3border1" in get_applied_routers(lab, since)
+    assert_running_configs_match(lab, tmp_path / "generated")
+
+
+def test_line_by_line_apply(lab, tmp_path):
+    run("set-up", "generate-configs")
+    since = get_history_lengths(lab)
+    run("apply-configs", "--line-by-line")
+
+    assert get_applied_routers(lab, since) == set()
+    assert_running_configs_match(lab, tmp_path / "generated")
+
+
+def test_run_on_nodes_partial_failure(lab):
+    run("start-all")
+    nodes = [
+        gns3.project.get_node(name=name)
+        for name in ("asn1border1", "asn2border1", "asn3border1")
+    ]
+
+    def function(node):
+        if node.name == "asn2border1":
+            raise RuntimeError("broken")
+        return gns3.run_shell_commands(node, [f"echo {node.name}"])
+
+    with pytest.raises(gns3.NodeError) as error:
+        gns3.run_on_nodes(nodes, function, max_workers=1)
+
+    assert str(error.value) == "1 of 3 nodes failed: asn2border1"
+    results = error.value.results
+    assert [result.node.name for result in results] == [node.name for node in nodes]
+    assert isinstance(results[1].error, RuntimeError)
+    # including the one after it
+    for result in (results[0], results[2]):
+        assert result.error is None
+        assert f"{result.node.name}\r\n" in result.result
+
+
+def test_failed_reload_restarts_the_node(lab, monkeypatch):
+    run("start-all")
+    monkeypatch.setattr(gns3, "FRR_RELOAD_TIMEOUT", 1)
+    router = lab.router("asn2border1")
+    router.fail_reloads = 1
+    nodes = [
+        gns3.project.get_node(name=name) for name in ("asn1border1", "asn2border1")
+    ]
+    booted_at = router.booted_at
+    stops = lab.request_counts["POST /v2/projects/{id}/nodes/{id}/stop"]
+    gns3.reload_frr(nodes)
+
+    # only the one that didn't come back
+    assert lab.request_counts["POST /v2/projects/{id}/nodes/{id}/stop"] == stops + 1
+    assert router.booted_at > booted_at
+    assert "zebra" in gns3.get_running_daemons(nodes[1])
+
+
+def test_reconnects_after_node_restart(lab):
+    run("start-all")
+    router = lab.router("asn2border1")
+    node = gns3.project.get_node(name="asn2border1")
+    assert "one\r\n" in gns3.run_shell_commands(node, ["echo one"])
+    session = telnet.pool.get(lab.host, node.properties["aux"], gns3.TELNET_TIMEOUT)
+    assert session.is_alive()
+
+    # restarted behind our back, e.g. from the GNS3 GUI, which drops the connection
+    lab.stop_node(node.node_id)
+    sleep(0.5)
+    lab.start_node(node.node_id)
+    assert not session.is_alive()
+
+    assert "two\r\n" in gns3.run_shell_commands(node, ["echo two"])
+    assert router.connections == 2
+
+
+def test_interference_falls_back_without_repeating_commands(lab):
+    run("start-all")
+    router = lab.router("asn2border1")
+    node = gns3.project.get_node(name="asn2border1")
+    # like a PuTTY window open to the same port, answering terminal queries
+    router.interference = True
+    commands = [f"echo line{index}" for index in range(telnet.STREAM_BATCH_LINES + 4)]
+    since = len(router.history)
+    output = gns3.run_shell_commands(node, commands)
+
+    sent = [line for line in router.history[since:] if line.startswith("echo ")]
+    assert sent == commands
+    assert all(f"line{index}\r\n" in output for index in range(len(commands)))
+
+
+def test_slow_command_is_waited_for_not_repeated(lab, monkeypatch):
+    run("start-all")
+    monkeypatch.setattr(gns3, "TELNET_TIMEOUT", 0.2)
+    # sessions keep the timeout they were made with
+    telnet.pool.close_all()
+    router = lab.router("asn2border1")
+    node = gns3.project.get_node(name="asn2border1")
+    commands = ["echo before", "sleep 0.6", "echo after"]
+    since = len(router.history)
+    output = gns3.run_shell_commands(node, commands)
+
+    assert [line for line in router.history[since:] if line in commands] == commands
+    assert "after\r\n" in output
+
+
+@pytest.mark.parametrize("lab", [40], indirect=True)
+def test_synthetic_lab_end_to_end(lab):
+    run("set-up", "generate-configs", "apply-configs")
+    for router in lab.routers.values():
+        if router.frr:
+            assert router.files.get("/etc/frr/frr.conf"), router.name
+    # a multi-router ASN without its own supernet advertises its links instead
+    assert "redistribute connected" in lab.router("asn2border1").render_running_config()
+
+
+def test_measure_convergence(lab, tmp_path):
+    run("set-up", "generate-configs", "apply-configs")
+    output = tmp_path / "convergence.json"
+    run(
+        "measure-convergence",
+        "--interval",
+        "0.1",
+        "--settle",
+        "0.2",
+        "--timeout",
+        "30",
+        "--output",
+        str(output),
+    )
+
+    results = json.loads(output.read_text())
+    assert results["lab_converged_at"] is not None
+    assert set(results["routers"]) == {
+        router.name for router in lab.routers.values() if router.frr
+    }
+    internal = results["routers"]["asn1internal1"]
+    assert internal["ospf_full"] == internal["ospf_expected"] == 3
+    border = results["routers"]["asn1border1"]
+    assert border["bgp_established"] == border["bgp_expected"] == 5
+    assert border["bfd_up"] == 5
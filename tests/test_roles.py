@@ -0,0 +1,108 @@
+import pathfix
+from gns3_bgp_frr import roles, topology
+
+########## test working out what each router does from the topology
+
+
+def make_lab() -> topology.Topology:
+    """
+    asn1border1 has the outside world (through a switch) and asn2border1 behind it,
+    asn1internal1 links it to asn1border2, which has a host.
+    """
+    routers = ["asn1border1", "asn1internal1", "asn1border2", "asn2border1"]
+    nodes = [
+        topology.Node(
+            node_id=name,
+            name=name,
+            node_type="docker",
+            properties={"image": "frrouting/frr:latest"},
+            ports=[
+                {"name": f"eth{index}", "adapter_number": index, "port_number": 0}
+                for index in range(8)
+            ],
+        )
+        for name in routers
+    ] + [
+        topology.Node(node_id="LAN", name="LAN", node_type="cloud"),
+        topology.Node(node_id="Switch1", name="Switch1", node_type="ethernet_switch"),
+        topology.Node(
+            node_id="host",
+            name="host",
+            node_type="docker",
+            properties={"image": "alpine:latest"},
+            ports=[{"name": "eth0", "adapter_number": 0, "port_number": 0}],
+        ),
+    ]
+    ends = [
+        (("LAN", 0), ("Switch1", 0)),
+        (("asn1border1", 7), ("Switch1", 0)),
+        (("asn1border1", 1), ("asn1internal1", 0)),
+        (("asn1border1", 0), ("asn2border1", 0)),
+        (("asn1internal1", 1), ("asn1border2", 0)),
+        (("asn1border2", 1), ("host", 0)),
+    ]
+    links = [
+        topology.Link(
+            link_id=f"link-{index}",
+            nodes=[
+                {"node_id": node_id, "adapter_number": adapter, "port_number": 0}
+                for node_id, adapter in link_ends
+            ],
+        )
+        for index, link_ends in enumerate(ends)
+    ]
+    return topology.Topology(
+        project_name=topology.PROJECT_NAME,
+        server_url=topology.GNS3_SERVER_URL,
+        revision=topology.get_revision(nodes, links),
+        nodes=nodes,
+        links=links,
+    )
+
+
+def test_ports_are_sorted_by_what_they_face():
+    router_roles = roles.infer_roles(make_lab())
+    border = router_roles["asn1border1"]
+    assert border.internal_ports == ["eth1"]
+    assert border.border_ports == ["eth0"]
+    assert border.external_ports == ["eth7"]
+    assert router_roles["asn1border2"].host_ports == ["eth1"]
+    assert "host" not in router_roles
+
+
+def test_kinds_ospf_and_bgp():
+    router_roles = roles.infer_roles(make_lab())
+    assert router_roles["asn1border1"].kind == "border"
+    assert router_roles["asn1internal1"].kind == "internal"
+    assert router_roles["asn1border2"].kind == "cpe"
+
+    # asn1 has an internal router so it runs OSPF. It's the only one without BGP
+    assert router_roles["asn1internal1"].ospf_interfaces == ["eth0", "eth1"]
+    assert not router_roles["asn1internal1"].bgp
+    assert not router_roles["asn2border1"].ospf
+    assert router_roles["asn2border1"].ospf_interfaces == []
+
+    peers = roles.get_ibgp_peers(router_roles, "asn1border1")
+    assert [peer.name for peer in peers] == ["asn1border2"]
+    assert roles.get_ibgp_peers(router_roles, "asn2border1") == []
+
+
+def test_route_reflectors(monkeypatch):
+    monkeypatch.setattr(roles, "IBGP_MODE", "route-reflector")
+    monkeypatch.setattr(roles, "ROUTE_REFLECTOR_COUNT", 1)
+    monkeypatch.setattr(roles, "ROUTE_REFLECTORS", {})
+    router_roles = roles.infer_roles(make_lab())
+    # a tie on internal links, so by name
+    assert router_roles["asn1border1"].route_reflector
+    assert not router_roles["asn1border2"].route_reflector
+    assert [name for name, role in router_roles.items() if role.loopback] == [
+        "asn1border1",
+        "asn1border2",
+    ]
+    peers = roles.get_ibgp_peers(router_roles, "asn1border2")
+    assert [peer.name for peer in peers] == ["asn1border1"]
+
+    monkeypatch.setattr(roles, "ROUTE_REFLECTORS", {1: ["asn1border2"]})
+    router_roles = roles.infer_roles(make_lab())
+    assert router_roles["asn1border2"].route_reflector
+    assert not router_roles["asn1border1"].route_reflector
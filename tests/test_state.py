@@ -0,0 +1,44 @@
+import pathfix
+from gns3_bgp_frr.state import AppliedState, content_hash
+
+########## test remembering what was applied to each node
+
+
+def test_content_hash_matches_sha256sum():
+    # `echo -n hello | sha256sum`
+    assert (
+        content_hash("hello")
+        == "2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824"
+    )
+
+
+def test_recorded_node_is_unchanged_until_config_or_id_changes(tmp_path):
+    state = AppliedState(tmp_path / "applied.json")
+    assert not state.is_unchanged("asn2border1", "id-1", "hash-1")
+
+    state.record("asn2border1", "id-1", "hash-1", "remote-1")
+    assert state.is_unchanged("asn2border1", "id-1", "hash-1")
+    assert not state.is_unchanged("asn2border1", "id-1", "hash-2")
+    assert not state.is_unchanged("asn2border1", "id-2", "hash-1")
+    assert state.remote_hash("asn2border1") == "remote-1"
+
+
+def test_state_survives_save_and_forget(tmp_path):
+    path = tmp_path / "applied.json"
+    state = AppliedState(path)
+    state.record("asn2border1", "id-1", "hash-1", "remote-1")
+    state.record("asn3border1", "id-2", "hash-2", None)
+    state.save()
+
+    reloaded = AppliedState(path)
+    assert reloaded.is_unchanged("asn3border1", "id-2", "hash-2")
+    reloaded.forget("asn2border1")
+    reloaded.save()
+
+    assert AppliedState(path).remote_hash("asn2border1") is None
+
+
+def test_corrupt_state_is_treated_as_empty(tmp_path):
+    path = tmp_path / "applied.json"
+    path.write_text('{"asn2border1": {"node_')
+    assert AppliedState(path).entries == {}
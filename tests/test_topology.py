@@ -0,0 +1,94 @@
+import pathfix
+from gns3_bgp_frr import topology
+
+########## test the offline topology snapshot
+
+
+def make_topology(reverse=False) -> topology.Topology:
+    nodes = [
+        topology.Node(
+            node_id="id-1",
+            name="asn2border1",
+            properties={"image": "frrouting/frr:latest"},
+            ports=[{"name": "eth0", "adapter_number": 0, "port_number": 0}],
+        ),
+        topology.Node(
+            node_id="id-2",
+            name="asn3border1",
+            properties={"image": "frrouting/frr:latest"},
+            ports=[{"name": "eth0", "adapter_number": 0, "port_number": 0}],
+        ),
+    ]
+    links = [
+        topology.Link(
+            link_id="link-1",
+            nodes=[
+                {"node_id": "id-1", "adapter_number": 0, "port_number": 0},
+                {"node_id": "id-2", "adapter_number": 0, "port_number": 0},
+            ],
+        )
+    ]
+    if reverse:
+        nodes.reverse()
+    return topology.Topology(
+        project_name=topology.PROJECT_NAME,
+        server_url=topology.GNS3_SERVER_URL,
+        revision=topology.get_revision(nodes, links),
+        nodes=nodes,
+        links=links,
+    )
+
+
+def test_revision_ignores_order_but_not_changes():
+    assert make_topology().revision == make_topology(reverse=True).revision
+
+    changed = make_topology()
+    changed.nodes[0].ports[0]["name"] = "eth1"
+    assert topology.get_revision(changed.nodes, changed.links) != changed.revision
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = tmp_path / "topology.json"
+    original = make_topology()
+    topology.save_snapshot(original, path)
+
+    loaded = topology.load_snapshot(path)
+    assert loaded == original
+    assert loaded is not None
+    assert loaded.get_node(name="asn3border1") == original.nodes[1]
+    assert loaded.get_node(node_id="id-1") == original.nodes[0]
+
+
+def test_snapshot_for_another_project_is_ignored(tmp_path):
+    path = tmp_path / "topology.json"
+    other = make_topology()
+    other.project_name = "not-" + other.project_name
+    topology.save_snapshot(other, path)
+    assert topology.load_snapshot(path) is None
+
+    path.write_text("{")
+    assert topology.load_snapshot(path) is None
+
+
+def test_index_lookups():
+    project_topology = make_topology()
+    assert project_topology.port_name("id-2", 0) == "eth0"
+    assert project_topology.port_name("id-2", 1) is None
+    assert project_topology.is_router("id-1")
+    assert project_topology.asns["id-2"] == 3
+
+    (endpoint,) = project_topology.endpoints("id-1")
+    assert endpoint == topology.Endpoint(
+        link_id="link-1",
+        node_id="id-1",
+        port_name="eth0",
+        peer_node_id="id-2",
+        peer_port_name="eth0",
+    )
+
+    # an end is kept even if the other end has no port name, e.g. some clouds
+    project_topology.nodes[1].ports.clear()
+    project_topology.__post_init__()
+    (endpoint,) = project_topology.endpoints("id-1")
+    assert endpoint.peer_port_name is None
+    assert project_topology.endpoints("id-2") == []
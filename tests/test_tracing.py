@@ -0,0 +1,57 @@
+import pathfix
+import json
+import threading
+from time import perf_counter
+from gns3_bgp_frr import tracing
+
+########## test recording spans and exporting them
+
+
+def test_nothing_is_recorded_unless_enabled(monkeypatch):
+    monkeypatch.setattr(tracing, "enabled", False)
+    monkeypatch.setattr(tracing, "spans", [])
+    with tracing.span("generate_configs") as span:
+        assert span is None
+    tracing.record("vtysh -f /tmp/config", "command", 0, 1)
+    assert tracing.spans == []
+
+
+def test_spans_know_their_node(monkeypatch, tmp_path):
+    monkeypatch.setattr(tracing, "spans", [])
+    tracing.enable()
+    try:
+        with tracing.span("apply-configs", "subcommand"):
+            with tracing.span("asn2border1", "node"):
+                start = perf_counter()
+                tracing.record("wr mem", "command", start, start + 0.5, port=5001)
+            # other threads have their own stack
+            thread = threading.Thread(
+                target=lambda: tracing.record("wr mem", "command", start, start + 0.1)
+            )
+            thread.start()
+            thread.join()
+    finally:
+        tracing.disable()
+
+    assert [span.name for span in tracing.spans] == [
+        "wr mem",
+        "asn2border1",
+        "wr mem",
+        "apply-configs",
+    ]
+    assert [span.node for span in tracing.spans] == [
+        "asn2border1",
+        "asn2border1",
+        None,
+        None,
+    ]
+    assert tracing.get_slowest("command", 1)[0].args == {"port": 5001}
+
+    path = tmp_path / "trace.json"
+    tracing.write_chrome_trace(path)
+    events = json.loads(path.read_text())["traceEvents"]
+    command = events[0]
+    assert command["ph"] == "X"
+    assert command["dur"] == 500000
+    assert command["args"] == {"port": 5001, "node": "asn2border1"}
+    assert {event["name"] for event in events if event["ph"] == "M"} == {"thread_name"}